@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class DealershipAppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'dealership_app'
+
+    def ready(self):
+        from . import signals  # noqa: F401
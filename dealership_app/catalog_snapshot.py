@@ -0,0 +1,463 @@
+"""
+Columnar snapshot of the unsold catalog used by the public vehicle listing.
+
+All unsold cars are written to a single file (CATALOG_SNAPSHOT_PATH) as
+fixed-width columns plus one bitmap per categorical value.  Every worker maps
+the file read-only, so filtering, sorting and paging run in memory and the
+page is shared between processes by the OS page cache.
+
+The file is replaced atomically: writers build a new file next to the old one
+and os.replace() it, readers notice the new inode on their next request.
+"""
+import array
+import fcntl
+import json
+import mmap
+import os
+import struct
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Count
+
+from .models import Car
+
+
+MAGIC = b'CCSNAP01'
+
+# (column name, array typecode)
+COLUMNS = [
+    ('id', 'q'),
+    ('brand', 'q'),
+    ('model', 'q'),
+    ('price', 'I'),
+    ('year', 'H'),
+    ('mileage', 'I'),
+    ('kilowatts', 'I'),
+    ('position', 'I'),
+    ('created', 'q'),
+    ('image_count', 'H'),
+    ('transmission', 'B'),
+    ('body', 'B'),
+    ('fuel', 'B'),
+    ('color', 'B'),
+]
+
+# Categorical columns and the Car field they are read from
+CATEGORIES = {
+    'transmission': 'transmission',
+    'body': 'body_type',
+    'fuel': 'fuel_type',
+    'color': 'color',
+}
+
+# Filter key -> bitmap group; brand/model are indexed by id, the rest by code value
+BITMAP_GROUPS = ['brand', 'model', 'transmission', 'body', 'fuel', 'color']
+
+SORT_COLUMNS = {
+    'price': 'price',
+    'mileage': 'mileage',
+    'year': 'year',
+}
+
+# order_by() field of the listing orderings -> column
+ORDER_COLUMNS = {'position': 'position', 'created_at': 'created', 'id': 'id', **SORT_COLUMNS}
+
+_ROW_FIELDS = [
+    'id', 'brand_id', 'brand__name', 'model_name_id', 'model_name__name',
+    'price', 'year', 'mileage', 'kilowatts', 'position', 'created_at',
+    'transmission', 'body_type', 'fuel_type', 'color',
+]
+
+_load_lock = threading.Lock()
+_current = None
+
+
+def is_enabled():
+    return getattr(settings, 'CATALOG_SNAPSHOT_ENABLED', False)
+
+
+def snapshot_path():
+    return getattr(settings, 'CATALOG_SNAPSHOT_PATH',
+                   os.path.join(settings.BASE_DIR, 'tmp', 'catalog.snapshot'))
+
+
+class CatalogSnapshot:
+    """
+    Read-only view over a mapped snapshot file.  close() (or a with block)
+    unmaps it; the shared ones from get_snapshot() are never closed, their
+    mapping is released with the last reference.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as fh:
+            stat = os.fstat(fh.fileno())
+            self._mmap = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        self.key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+        if self._mmap[:8] != MAGIC:
+            self._mmap.close()
+            raise ValueError(f'{path} is not a catalog snapshot')
+        header_length, = struct.unpack_from('<I', self._mmap, 8)
+        header = json.loads(self._mmap[12:12 + header_length].decode('utf-8'))
+
+        view = memoryview(self._mmap)
+        self.rows = header['rows']
+        self.nbytes = (self.rows + 7) // 8
+        self.columns = {
+            name: view[offset:offset + length].cast(typecode)
+            for name, (typecode, offset, length) in header['columns'].items()
+        }
+        view.release()
+        # The same columns as numpy arrays over the mapping, for whole-column tests
+        self.arrays = {name: np.frombuffer(column, dtype=column.format) for name, column in self.columns.items()}
+        self._bitmaps = {
+            group: {value: tuple(span) for value, span in spans.items()}
+            for group, spans in header['bitmaps'].items()
+        }
+        self.categories = header['categories']
+        self.brands = [tuple(b) for b in header['brands']]
+        self.models = [tuple(m) for m in header['models']]
+        self.beginners = self._read_bitmap(header['beginners'])
+        self.all_rows = (1 << self.rows) - 1
+
+    def close(self):
+        """Unmap the file. Nothing may be read from the snapshot afterwards."""
+        # The arrays and column views hold exports of the mapping, which must go first
+        self.arrays = {}
+        for column in self.columns.values():
+            column.release()
+        self.columns = {}
+        self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _read_bitmap(self, span):
+        offset, length = span
+        return int.from_bytes(self._mmap[offset:offset + length], 'little')
+
+    def _flags(self, bitmap):
+        """`bitmap` as one bool per row."""
+        data = np.frombuffer(bitmap.to_bytes(self.nbytes, 'little'), dtype=np.uint8)
+        return np.unpackbits(data, count=self.rows, bitorder='little').view(bool)
+
+    def _bitmap(self, flags):
+        """Bitmap of the rows set in the bool array `flags`."""
+        return int.from_bytes(np.packbits(flags, bitorder='little').tobytes(), 'little')
+
+    def bitmap(self, group, value):
+        """Bitmap of rows whose `group` equals `value` (0 if the value is unknown)."""
+        span = self._bitmaps.get(group, {}).get(str(value))
+        return self._read_bitmap(span) if span else 0
+
+    def _bitmaps_for(self, filters):
+        bitmaps = [self.bitmap(group, filters[group]) for group in BITMAP_GROUPS if filters.get(group)]
+        if filters.get('beginners'):
+            bitmaps.append(self.beginners)
+        return bitmaps
+
+    def _range_tests(self, filters):
+        """One bool array per applied price/year bound, over every row."""
+        price = self.arrays['price']
+        year = self.arrays['year']
+        tests = []
+        if filters.get('price_from') is not None:
+            tests.append(price >= filters['price_from'])
+        if filters.get('price_to') is not None:
+            tests.append(price <= filters['price_to'])
+        if filters.get('year_from') is not None:
+            tests.append(year >= filters['year_from'])
+        return tests
+
+    def match(self, filters):
+        """Return the bitmap of rows matching `filters` (see vehicle_list)."""
+        mask = self.all_rows
+        for bitmap in self._bitmaps_for(filters):
+            mask &= bitmap
+        tests = self._range_tests(filters) if mask else []
+        if tests:
+            mask &= self._bitmap(np.logical_and.reduce(tests))
+        return mask
+
+    def _ordered(self, rows, sort):
+        """`rows` (in listing order) ordered like the ORM: by the sort column, ties by id."""
+        if not sort:
+            return rows
+        column, direction = sort
+        values = self.arrays[SORT_COLUMNS[column]][rows].astype(np.int64)
+        if direction == 'desc':
+            values = -values
+        return rows[np.lexsort((self.arrays['id'][rows], values))]
+
+    def match_scores(self, filters):
+        """How many of `filters` each row satisfies (the ORM's match_score)."""
+        scores = np.zeros(self.rows, dtype=np.int64)
+        for bitmap in self._bitmaps_for(filters):
+            scores += self._flags(bitmap)
+        for test in self._range_tests(filters):
+            scores += test
+        return scores
+
+    def closest_matches(self, filters, sort=None):
+        """
+        Return every car id ranked by how many of `filters` it satisfies,
+        best first; cars with the same score keep the search() order.
+        """
+        scores = self.match_scores(filters)
+        rows = self._ordered(np.arange(self.rows), sort)
+        # Stable, so the order above breaks ties
+        rows = rows[np.argsort(-scores[rows], kind='stable')]
+        return self.arrays['id'][rows].tolist()
+
+    def search(self, filters, sort=None):
+        """
+        Return car ids matching `filters`, ordered like the ORM listing.
+
+        Rows are stored in the default (position, -created_at, id) order, so
+        only the explicit sorts need a sort pass.
+        """
+        rows = np.flatnonzero(self._flags(self.match(filters)))
+        return self.arrays['id'][self._ordered(rows, sort)].tolist()
+
+    def sort_keys(self, ids, ordering, scores=None):
+        """
+        Key tuples of `ids` for an order_by() `ordering` of the listing,
+        ascending when `ids` are in that order; descending fields are negated
+        and 'match_score' is read from the match_scores() array `scores`.
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        by_id = np.argsort(self.arrays['id'])
+        rows = by_id[np.searchsorted(self.arrays['id'], ids, sorter=by_id)]
+        columns = []
+        for field in ordering:
+            name = field.lstrip('-')
+            values = scores[rows] if name == 'match_score' else self.arrays[ORDER_COLUMNS[name]][rows].astype(np.int64)
+            columns.append(-values if field.startswith('-') else values)
+        return list(zip(*(column.tolist() for column in columns)))
+
+    @staticmethod
+    def cursor_key(ordering, values):
+        """The sort_keys() tuple of the row a keyset cursor points at, from its decoded values."""
+        key = []
+        for field, value in zip(ordering, values):
+            if isinstance(value, datetime):
+                value = _micros(value)
+            key.append(-value if field.startswith('-') else value)
+        return tuple(key)
+
+
+def _micros(moment):
+    return int(moment.timestamp() * 1_000_000)
+
+
+def _row_from_values(values, image_count):
+    return {
+        'id': values['id'],
+        'brand': values['brand_id'] or 0,
+        'brand_name': values['brand__name'],
+        'model': values['model_name_id'] or 0,
+        'model_name': values['model_name__name'],
+        'price': values['price'],
+        'year': values['year'],
+        'mileage': values['mileage'],
+        'kilowatts': values['kilowatts'],
+        'position': values['position'],
+        'created': _micros(values['created_at']),
+        'image_count': image_count,
+        'transmission': values['transmission'],
+        'body': values['body_type'],
+        'fuel': values['fuel_type'],
+        'color': values['color'],
+    }
+
+
+def _query_rows(car_ids=None):
+    qs = Car.objects.filter(sold=False)
+    if car_ids is not None:
+        qs = qs.filter(pk__in=car_ids)
+    qs = qs.annotate(image_count=Count('images')).order_by()
+    return [
+        _row_from_values(values, values['image_count'])
+        for values in qs.values(*_ROW_FIELDS, 'image_count')
+    ]
+
+
+def _rows_from_snapshot(snapshot):
+    """Turn a mapped snapshot back into row dicts for an incremental rewrite."""
+    brand_names = {brand_id: name for brand_id, name in snapshot.brands}
+    model_names = {model_id: name for model_id, _, name in snapshot.models}
+    columns = snapshot.columns
+    rows = []
+    for i in range(snapshot.rows):
+        row = {name: columns[name][i] for name, _ in COLUMNS}
+        for group in CATEGORIES:
+            row[group] = snapshot.categories[group][row[group]]
+        row['brand_name'] = brand_names.get(row['brand'])
+        row['model_name'] = model_names.get(row['model'])
+        rows.append(row)
+    return rows
+
+
+def _write(rows, path):
+    rows.sort(key=lambda r: (r['position'], -r['created'], r['id']))
+    n = len(rows)
+    nbytes = (n + 7) // 8
+
+    categories = {
+        group: sorted({row[group] for row in rows})
+        for group in CATEGORIES
+    }
+    codes = {group: {value: i for i, value in enumerate(values)}
+             for group, values in categories.items()}
+
+    columns = {}
+    for name, typecode in COLUMNS:
+        if name in CATEGORIES:
+            data = (codes[name][row[name]] for row in rows)
+        else:
+            data = (row[name] for row in rows)
+        columns[name] = array.array(typecode, data)
+
+    bitmaps = {group: {} for group in BITMAP_GROUPS}
+    beginners = 0
+    for i, row in enumerate(rows):
+        bit = 1 << i
+        for group in BITMAP_GROUPS:
+            if row[group]:
+                key = str(row[group])
+                bitmaps[group][key] = bitmaps[group].get(key, 0) | bit
+        if row['kilowatts'] <= Car.BEGINNER_MAX_KW:
+            beginners |= bit
+
+    brands = sorted({(row['brand'], row['brand_name']) for row in rows if row['brand']},
+                    key=lambda b: b[1])
+    models = sorted({(row['model'], row['brand'], row['model_name']) for row in rows if row['model']},
+                    key=lambda m: m[2])
+
+    # Lay out the sections first so the header can carry their offsets
+    sections = []
+    header = {
+        'rows': n,
+        'categories': categories,
+        'brands': brands,
+        'models': models,
+        'columns': {},
+        'bitmaps': {group: {} for group in BITMAP_GROUPS},
+    }
+    for name, typecode in COLUMNS:
+        data = columns[name].tobytes()
+        sections.append((('columns', name, typecode), data))
+    for group in BITMAP_GROUPS:
+        for value, bits in bitmaps[group].items():
+            sections.append((('bitmaps', group, value), bits.to_bytes(nbytes, 'little')))
+    sections.append((('beginners',), beginners.to_bytes(nbytes, 'little')))
+
+    # Offsets depend on the header size and the header carries the offsets:
+    # size the header with oversized offsets first, then place for real.
+    def place(start):
+        offset = start
+        for target, data in sections:
+            offset = (offset + 7) & ~7
+            if target[0] == 'columns':
+                header['columns'][target[1]] = [target[2], offset, len(data)]
+            elif target[0] == 'bitmaps':
+                header['bitmaps'][target[1]][target[2]] = [offset, len(data)]
+            else:
+                header['beginners'] = [offset, len(data)]
+            offset += len(data)
+
+    place(10 ** 15)
+    data_start = (12 + len(json.dumps(header, ensure_ascii=False).encode('utf-8')) + 7) & ~7
+    place(data_start)
+    header_bytes = json.dumps(header, ensure_ascii=False).encode('utf-8')
+
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as fh:
+        fh.write(MAGIC)
+        fh.write(struct.pack('<I', len(header_bytes)))
+        fh.write(header_bytes)
+        fh.write(b'\0' * (data_start - fh.tell()))
+        for target, data in sections:
+            fh.write(b'\0' * (-fh.tell() % 8))
+            fh.write(data)
+    os.replace(tmp_path, path)
+
+
+@contextmanager
+def _writer_lock(path):
+    """Serialise writers across processes; readers never block."""
+    with open(f'{path}.lock', 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def build_snapshot():
+    """Write a fresh snapshot of every unsold car. Returns the number of rows."""
+    path = snapshot_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with _writer_lock(path):
+        rows = _query_rows()
+        _write(rows, path)
+    return len(rows)
+
+
+def refresh_cars(car_ids):
+    """
+    Incrementally update the snapshot for the given cars.
+
+    Only the changed rows are read from the database; the rest are taken from
+    the current snapshot.  Cars that are sold or deleted drop out.  The file
+    is left as it is when none of the rows changed, as for most image saves.
+    """
+    path = snapshot_path()
+    if not os.path.exists(path):
+        return build_snapshot()
+    car_ids = set(car_ids)
+    with _writer_lock(path):
+        with CatalogSnapshot(path) as snapshot:
+            rows = _rows_from_snapshot(snapshot)
+        changed = _query_rows(car_ids)
+        before = [row for row in rows if row['id'] in car_ids]
+        if sorted(before, key=lambda row: row['id']) == sorted(changed, key=lambda row: row['id']):
+            return len(rows)
+        rows = [row for row in rows if row['id'] not in car_ids] + changed
+        _write(rows, path)
+    return len(rows)
+
+
+def get_snapshot():
+    """
+    Return the current snapshot for this process, or None when disabled.
+
+    Costs one stat() per call; the file is re-mapped only after a writer
+    replaced it.  A missing file is built on first use.
+    """
+    global _current
+    if not is_enabled():
+        return None
+    path = snapshot_path()
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        build_snapshot()
+        stat = os.stat(path)
+    key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    snapshot = _current
+    if snapshot is None or snapshot.key != key:
+        with _load_lock:
+            if _current is None or _current.key != key:
+                # Not closed: other threads may still be reading the old one,
+                # its mapping goes when the last of them drops it
+                _current = CatalogSnapshot(path)
+            snapshot = _current
+    return snapshot
@@ -0,0 +1,34 @@
+"""
+Catalog-wide version counter.
+
+The version is a millisecond timestamp of the last catalog write, kept in the
+shared cache.  Anything derived from the catalog (facet counts, cached pages,
+...) puts it in its cache key, so a bump invalidates all of it at once.
+"""
+import time
+
+from django.core.cache import cache
+
+
+VERSION_KEY = 'catalog:version'
+
+
+def _now_ms():
+    return int(time.time() * 1000)
+
+
+def get_catalog_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # Cache was cleared or evicted: start from "now" so the new version
+        # can never collide with one handed out before.
+        version = _now_ms()
+        cache.add(VERSION_KEY, version, None)
+        version = cache.get(VERSION_KEY, version)
+    return version
+
+
+def bump_catalog_version():
+    version = max(_now_ms(), get_catalog_version() + 1)
+    cache.set(VERSION_KEY, version, None)
+    return version
@@ -0,0 +1,83 @@
+"""
+ETag / Last-Modified validators for the public pages and the model lists.
+
+Validators are derived from the catalog version (see catalog_version.py) and,
+for a detail page, the car's own updated_at, so a matching If-None-Match or
+If-Modified-Since is answered with 304 before the view or the page cache runs.
+"""
+import hashlib
+from datetime import datetime, timezone
+from functools import wraps
+
+from django.conf import settings
+from django.utils import translation
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition
+
+from .catalog_version import get_catalog_version
+from .models import Car
+
+
+def _version_datetime(version):
+    return datetime.fromtimestamp(version / 1000, tz=timezone.utc)
+
+
+def _variant(request):
+    """
+    What else the cached copy depends on: the language, staff access, and
+    the CSRF cookie the language-switch forms were rendered for.
+    """
+    csrf_cookie = request.COOKIES.get(settings.CSRF_COOKIE_NAME, '')
+    staff = 's' if request.user.is_staff else 'a'
+    return f'{translation.get_language()}-{staff}-{hashlib.md5(csrf_cookie.encode()).hexdigest()[:8]}'
+
+
+def _catalog_etag(request, *args, **kwargs):
+    return f'catalog-{get_catalog_version()}-{_variant(request)}'
+
+
+def _catalog_last_modified(request, *args, **kwargs):
+    return _version_datetime(get_catalog_version())
+
+
+def _car_updated_at(request, pk):
+    # Cached on the request: condition() asks for the ETag and Last-Modified separately
+    if not hasattr(request, '_car_updated_at'):
+        request._car_updated_at = Car.objects.filter(pk=pk).order_by().values_list('updated_at', flat=True).first()
+    return request._car_updated_at
+
+
+def _car_etag(request, pk, *args, **kwargs):
+    updated_at = _car_updated_at(request, pk)
+    if updated_at is None:
+        return None
+    # The page also lists other cars (recommendations), hence the catalog version
+    return f'car-{pk}-{int(updated_at.timestamp() * 1000)}-{get_catalog_version()}-{_variant(request)}'
+
+
+def _car_last_modified(request, pk, *args, **kwargs):
+    updated_at = _car_updated_at(request, pk)
+    if updated_at is None:
+        return None
+    return max(updated_at, _version_datetime(get_catalog_version()))
+
+
+def _revalidate(view):
+    """Make browsers and proxies ask again (cheaply, via the validators) on every use."""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        response = view(request, *args, **kwargs)
+        if request.method in ('GET', 'HEAD') and response.status_code in (200, 304):
+            patch_cache_control(response, no_cache=True)
+        return response
+    return wrapper
+
+
+def catalog_conditional(view):
+    """Validators for pages and JSON built from the catalog as a whole."""
+    return _revalidate(condition(etag_func=_catalog_etag, last_modified_func=_catalog_last_modified)(view))
+
+
+def car_conditional(view):
+    """Validators for vehicle_detail(request, pk)."""
+    return _revalidate(condition(etag_func=_car_etag, last_modified_func=_car_last_modified)(view))
@@ -0,0 +1,164 @@
+"""
+Facet counts and range histograms for the vehicle filters.
+
+One grouped query over the unsold cars is cached per catalog version; every
+request then derives its counts from those groups in memory.  Counts are
+disjunctive: the count shown next to an option is the number of cars you
+would get by picking it while keeping all *other* applied filters.
+"""
+from collections import Counter
+
+from django.core.cache import cache
+from django.db.models import BooleanField, Case, Count, F, Value, When
+from django.db.models.functions import Floor
+
+from .catalog_version import get_catalog_version
+from .models import Car
+
+
+# Histogram bucket widths for the range sliders
+PRICE_STEP = 1000
+YEAR_STEP = 1
+MILEAGE_STEP = 10000
+
+# Positions of the grouped values in a cached row
+(BRAND, BRAND_NAME, MODEL, MODEL_NAME, TRANSMISSION, BODY, FUEL, COLOR,
+ BEGINNER, YEAR, PRICE, MILEAGE_BUCKET, COUNT) = range(13)
+
+# Facet name -> row position of the value it counts
+FACETS = {
+    'brand': BRAND,
+    'model': MODEL,
+    'transmission': TRANSMISSION,
+    'body': BODY,
+    'fuel': FUEL,
+    'color': COLOR,
+}
+
+
+def _grouped_rows():
+    """Unsold cars grouped by every filterable value, cached per catalog version."""
+    key = f'facets:groups:{get_catalog_version()}'
+    rows = cache.get(key)
+    if rows is None:
+        qs = (
+            Car.objects.filter(sold=False)
+            .annotate(
+                beginner=Case(
+                    When(kilowatts__lte=Car.BEGINNER_MAX_KW, then=Value(True)),
+                    default=Value(False),
+                    output_field=BooleanField(),
+                ),
+                mileage_bucket=Floor(F('mileage') / MILEAGE_STEP),
+            )
+            .values_list(
+                'brand_id', 'brand__name', 'model_name_id', 'model_name__name',
+                'transmission', 'body_type', 'fuel_type', 'color',
+                'beginner', 'year', 'price', 'mileage_bucket',
+            )
+            .annotate(count=Count('id'))
+            .order_by()
+        )
+        rows = [tuple(row) for row in qs]
+        cache.set(key, rows, 24 * 60 * 60)
+    return rows
+
+
+def _failed_filters(row, filters):
+    """Names of the applied filters this group does not satisfy."""
+    failed = []
+    for facet, index in FACETS.items():
+        value = filters.get(facet)
+        if value and str(row[index]) != str(value):
+            failed.append(facet)
+    if filters.get('beginners') and not row[BEGINNER]:
+        failed.append('beginners')
+    price_from = filters.get('price_from')
+    price_to = filters.get('price_to')
+    if ((price_from is not None and row[PRICE] < price_from) or
+            (price_to is not None and row[PRICE] > price_to)):
+        failed.append('price')
+    year_from = filters.get('year_from')
+    if year_from is not None and row[YEAR] < year_from:
+        failed.append('year')
+    return failed
+
+
+def _histogram(counter, step):
+    return [
+        {'from': bucket * step, 'to': (bucket + 1) * step - 1, 'count': counter[bucket]}
+        for bucket in sorted(counter)
+    ]
+
+
+def get_vehicle_facets(filters):
+    """
+    Return counts for the filters in `filters` (see frontend_views._vehicle_filters).
+
+    Result keys:
+      total       number of cars matching all filters
+      options     {facet: set of values present among unsold cars}
+      counts      {facet: {value: count}} for brand/model/transmission/body/fuel/color,
+                  plus 'beginners' -> count of cars ≤ 77 kW
+      brands      [(id, name)] of brands with unsold cars
+      models      [(id, brand_id, name)] of models with unsold cars
+      histograms  {'price'|'year'|'mileage': [{'from', 'to', 'count'}]}
+    """
+    counts = {facet: Counter() for facet in FACETS}
+    options = {facet: set() for facet in FACETS}
+    beginners = 0
+    price_hist, year_hist, mileage_hist = Counter(), Counter(), Counter()
+    brands, models = {}, {}
+    total = 0
+
+    for row in _grouped_rows():
+        n = row[COUNT]
+        if row[BRAND]:
+            brands[row[BRAND]] = row[BRAND_NAME]
+        if row[MODEL]:
+            models[row[MODEL]] = (row[BRAND], row[MODEL_NAME])
+
+        for facet, index in FACETS.items():
+            if row[index]:
+                options[facet].add(row[index])
+
+        failed = _failed_filters(row, filters)
+        if len(failed) > 1:
+            continue
+        # A group that fails exactly one filter still counts towards the
+        # options of that filter; a fully matching group counts everywhere.
+        only = failed[0] if failed else None
+        for facet, index in FACETS.items():
+            if only in (None, facet) and row[index]:
+                counts[facet][row[index]] += n
+        if only in (None, 'beginners') and row[BEGINNER]:
+            beginners += n
+        if only in (None, 'price'):
+            price_hist[row[PRICE] // PRICE_STEP] += n
+        if only in (None, 'year'):
+            year_hist[row[YEAR] // YEAR_STEP] += n
+        if only is None:
+            mileage_hist[int(row[MILEAGE_BUCKET])] += n
+            total += n
+
+    result_counts = {facet: dict(counter) for facet, counter in counts.items()}
+    result_counts['beginners'] = beginners
+    return {
+        'total': total,
+        'options': options,
+        'counts': result_counts,
+        'brands': sorted(brands.items(), key=lambda b: b[1]),
+        'models': sorted(((model_id, brand_id, name) for model_id, (brand_id, name) in models.items()),
+                         key=lambda m: m[2]),
+        'histograms': {
+            'price': _histogram(price_hist, PRICE_STEP),
+            'year': _histogram(year_hist, YEAR_STEP),
+            'mileage': _histogram(mileage_hist, MILEAGE_STEP),
+        },
+    }
+
+
+def choices_with_counts(choices, facets, facet):
+    """(key, label, count) for the choices of `facet` that occur in the unsold catalog."""
+    counts = facets['counts'][facet]
+    return [(key, label, counts.get(key, 0)) for key, label in choices if key in facets['options'][facet]]
@@ -1,6 +1,7 @@
 from django import forms
 from django.core.exceptions import ValidationError
 import re
+from .image_pipeline import check_pixels
 from .models import Car, CarImage,CarModel
 
 class MultipleFileInput(forms.ClearableFileInput):
@@ -117,6 +118,17 @@ class CarModelForm(forms.ModelForm):
             if mileage < 0:
                 raise ValidationError('Invalid input. Mileage cannot be negative')
         return mileage
+
+    def clean_main_image(self):
+        main_image = self.cleaned_data.get('main_image')
+        # A new upload carries the PIL image its header was read into; nothing is decoded yet
+        image = getattr(main_image, 'image', None)
+        if image is not None:
+            try:
+                check_pixels(image)
+            except ValueError as e:
+                raise ValidationError(f'Invalid input. {e}')
+        return main_image
 class CarImageForm(forms.Form):
     images = forms.ImageField(
         widget=MultipleFileInput(attrs={"class": "form-control rounded", "multiple": True}),
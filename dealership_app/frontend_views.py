@@ -1,154 +1,439 @@
 import json
-from django.http import JsonResponse
+from bisect import bisect_left, bisect_right
+from urllib.parse import urlencode
+from django.http import FileResponse, Http404, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render, get_object_or_404, redirect
 from django.core.paginator import Paginator
+from django.db.models import Case, IntegerField, Q, Value, When
 from django.utils import translation
 from django.urls import reverse
-from .models import Car, CarBrand, CarModel
-
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.views.decorators.http import condition
+from django.utils.text import compress_sequence
+from .models import Car
+from . import catalog_snapshot, image_resize
+from . import inventory_feed as feed
+from .catalog_version import get_catalog_version
+from .conditional import car_conditional, catalog_conditional
+from .facets import get_vehicle_facets, choices_with_counts
+from .model_map import model_map_context, model_map_json, models_for_brand
+from .page_cache import cache_public_page
+from .pagination import KeysetPage, KeysetPaginator, keyset_enabled
+from .recommendations import recommended_cars
+from .typeahead import suggest
+
+@catalog_conditional
+@cache_public_page
 def index(request):
     # Get first 8 cars based on position (custom order)
-    featured_cars = Car.objects.filter(sold=False).order_by('position', '-created_at')[:8]
-    # Only show brands that have available cars
-    brands = CarBrand.objects.filter(car__sold=False).distinct().order_by('name')
+    featured_cars = Car.objects.filter(sold=False).select_related('brand', 'model_name').order_by('position', '-created_at')[:8]
 
     # Get exclusive car
-    exclusive_car = Car.objects.filter(is_exclusive=True, sold=False).first()
+    exclusive_car = Car.objects.filter(is_exclusive=True, sold=False).select_related('brand', 'model_name').first()
 
     # Get current language
     current_language = translation.get_language()
 
-    # Get only fuel choices that exist in available cars for the search form
-    base_qs = Car.objects.filter(sold=False)
-    available_fuels = base_qs.values_list('fuel_type', flat=True).distinct()
-    fuel_choices = [(key, label) for key, label in Car.get_fuel_choices(current_language) if key in available_fuels]
+    # Brands and fuel choices that exist in available cars, with counts, for the search form
+    facets = get_vehicle_facets({})
 
     return render(request, 'frontend/index.html', {
         'featured_cars': featured_cars,
-        'brands': brands,
-        'fuel_choices': fuel_choices,
+        'brands': _brand_options(facets),
+        'fuel_choices': choices_with_counts(Car.get_fuel_choices(current_language), facets, 'fuel'),
         'exclusive_car': exclusive_car,
+        **model_map_context(),
     })
 
+@catalog_conditional
 def ajax_models(request):
     """Return JSON list of {id,name} for models of given brand that have available cars."""
     brand_id = request.GET.get('brand')
     models = []
     if brand_id and brand_id.isdigit():
-        # Only show models that have available cars for this brand
-        qs = CarModel.objects.filter(
-            brand_id=brand_id,
-            car__sold=False
-        ).distinct().order_by('name')
-        models = [{'id': m.id, 'name': m.name} for m in qs]
+        # Only show models that have available cars for this brand (from the cached map)
+        models = models_for_brand(brand_id)
     return JsonResponse(models, safe=False)
 
-def vehicle_list(request):
-    base_qs = Car.objects.filter(sold=False)
-    qs = base_qs
-
-    # -- Filters --
-    brand       = request.GET.get('brand')
-    model_id    = request.GET.get('model_name') or request.GET.get('model')
-    trans       = request.GET.get('transmission')
-    body        = request.GET.get('vehicle_body') or request.GET.get('body_type')
-    fuel        = request.GET.get('fuel')
-    color       = request.GET.get('color')
-    beginners   = request.GET.get('for_beginners')
-    price_from  = request.GET.get('price_from')
-    price_to    = request.GET.get('price_to')
-    year_from   = request.GET.get('year_from')
-    
-    # New sorting options
-    sort_price   = request.GET.get('sort_price')
-    sort_mileage = request.GET.get('sort_mileage')  
-    sort_year    = request.GET.get('sort_year')
-
-    # Track if any filters are applied
-    filters_applied = any([brand, model_id, trans, body, fuel, color, beginners, 
-                          price_from, price_to, year_from])
-
-    if brand:
-        qs = qs.filter(brand_id=brand)
-    if model_id:
-        qs = qs.filter(model_name_id=model_id)
-    if trans:
-        qs = qs.filter(transmission=trans)
-    if body:
-        qs = qs.filter(body_type=body)
-    if fuel:
-        qs = qs.filter(fuel_type=fuel)
-    if color:
-        qs = qs.filter(color=color)
-    if beginners:
-        qs = qs.filter(kilowatts__lte=77)
-    
+@condition(etag_func=lambda request: f'models-{get_catalog_version()}')
+def ajax_model_map(request):
+    """
+    The whole brand -> models map as one JSON blob (see model_map.py).
+    Requested as ?v=<version> it never changes, so it may be cached for good.
+    """
+    response = HttpResponse(model_map_json(), content_type='application/json')
+    if request.GET.get('v') == str(get_catalog_version()):
+        patch_cache_control(response, public=True, max_age=365 * 24 * 60 * 60, immutable=True)
+    else:
+        patch_cache_control(response, no_cache=True)
+    return response
+
+def _accepts_gzip(accept_encoding):
+    """Whether an Accept-Encoding header allows gzip: listed, or covered by *, with q > 0."""
+    qualities = {}
+    for coding in accept_encoding.lower().split(','):
+        name, *params = [part.strip() for part in coding.split(';')]
+        quality = 1.0
+        for param in params:
+            key, _, value = param.partition('=')
+            if key.strip() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if name:
+            qualities[name] = quality
+    quality = qualities.get('gzip', qualities.get('x-gzip', qualities.get('*', 0.0)))
+    return quality > 0
+
+def inventory_feed(request):
+    """
+    Stream every available car for partner marketplaces (see inventory_feed.py).
+
+    ?format=json|csv, ?fields=id,title,... to project, ?lang=mk|en for labels;
+    gzip-compressed when the client accepts it.
+    """
+    fmt = request.GET.get('format', 'json')
+    if fmt not in feed.FORMATS:
+        return JsonResponse({'error': f"format must be one of: {', '.join(feed.FORMATS)}"}, status=400)
+    try:
+        fields = feed.parse_fields(request.GET.get('fields'))
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    language = request.GET.get('lang') if request.GET.get('lang') in ('mk', 'en') else 'mk'
+
+    content = (chunk.encode('utf-8') for chunk in
+               feed.iter_feed(fmt, fields, language, absolute=request.build_absolute_uri))
+    gzip = _accepts_gzip(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+    if gzip:
+        content = compress_sequence(content)
+
+    response = StreamingHttpResponse(
+        content,
+        content_type='text/csv; charset=utf-8' if fmt == 'csv' else 'application/json; charset=utf-8',
+    )
+    response['Content-Disposition'] = f'inline; filename="inventory.{fmt}"'
+    if gzip:
+        response['Content-Encoding'] = 'gzip'
+    patch_vary_headers(response, ('Accept-Encoding',))
+    return response
+
+def _int_param(value):
+    return int(value) if value and value.isdigit() else None
+
+
+def _vehicle_filters(request):
+    """Read the vehicle_list filter parameters into a dict shared by both engines."""
+    return {
+        'brand':        request.GET.get('brand'),
+        'model':        request.GET.get('model_name') or request.GET.get('model'),
+        'transmission': request.GET.get('transmission'),
+        'body':         request.GET.get('vehicle_body') or request.GET.get('body_type'),
+        'fuel':         request.GET.get('fuel'),
+        'color':        request.GET.get('color'),
+        'beginners':    request.GET.get('for_beginners'),
+        'price_from':   _int_param(request.GET.get('price_from')),
+        'price_to':     _int_param(request.GET.get('price_to')),
+        'year_from':    _int_param(request.GET.get('year_from')),
+    }
+
+
+def _vehicle_sort(request):
+    """Return (column, direction) for the requested sort, or None for the default order."""
+    for column in ('price', 'mileage', 'year'):
+        direction = request.GET.get(f'sort_{column}')
+        if direction in ['asc', 'desc']:
+            return column, direction
+    return None
+
+
+def _filters_applied(filters):
+    return any(value not in (None, '') for value in filters.values())
+
+
+def _brand_options(facets):
+    """Brands with available cars as {id, name, count} for the filter dropdowns."""
+    counts = facets['counts']['brand']
+    return [{'id': brand_id, 'name': name, 'count': counts.get(brand_id, 0)}
+            for brand_id, name in facets['brands']]
+
+
+def _filter_context(filters, facets):
+    """Sidebar options for vehicle_list; every option carries its facet count."""
+    current_language = translation.get_language()
+    brand = filters['brand']
+    model_counts = facets['counts']['model']
+    models_list = [{'id': model_id, 'name': name, 'count': model_counts.get(model_id, 0)}
+                   for model_id, brand_id, name in facets['models']
+                   if str(brand_id) == str(brand)] if brand else []
+    color_counts = facets['counts']['color']
+    return {
+        # Only show brands that have available cars
+        'brands': _brand_options(facets),
+        'models': models_list,
+        'transmission_choices': choices_with_counts(Car.get_transmission_choices(current_language), facets, 'transmission'),
+        'fuel_choices':        choices_with_counts(Car.get_fuel_choices(current_language), facets, 'fuel'),
+        'vehicle_bodies':      choices_with_counts(Car.get_body_choices(current_language), facets, 'body'),
+        'colors':              [(key, label, color_counts.get(key, 0)) for key, label in Car.get_color_choices(current_language)],
+        'beginners_count':     facets['counts']['beginners'],
+        'histograms':          facets['histograms'],
+    }
+
+
+def _cars_in_order(ids):
+    """Fetch cars for a page of ids in one query, keeping the given order."""
+    cars = Car.objects.select_related('brand', 'model_name').in_bulk(ids)
+    return [cars[pk] for pk in ids if pk in cars]
+
+
+def _filter_conditions(filters):
+    """One Q per applied vehicle_list filter (a price range counts as two)."""
+    conditions = []
+    if filters['brand']:
+        conditions.append(Q(brand_id=filters['brand']))
+    if filters['model']:
+        conditions.append(Q(model_name_id=filters['model']))
+    if filters['transmission']:
+        conditions.append(Q(transmission=filters['transmission']))
+    if filters['body']:
+        conditions.append(Q(body_type=filters['body']))
+    if filters['fuel']:
+        conditions.append(Q(fuel_type=filters['fuel']))
+    if filters['color']:
+        conditions.append(Q(color=filters['color']))
+    if filters['beginners']:
+        conditions.append(Q(kilowatts__lte=Car.BEGINNER_MAX_KW))
+
     # Price range filtering
-    if price_from and price_from.isdigit():
-        qs = qs.filter(price__gte=int(price_from))
-    if price_to and price_to.isdigit():
-        qs = qs.filter(price__lte=int(price_to))
-    
+    if filters['price_from'] is not None:
+        conditions.append(Q(price__gte=filters['price_from']))
+    if filters['price_to'] is not None:
+        conditions.append(Q(price__lte=filters['price_to']))
+
     # Year filtering
-    if year_from and year_from.isdigit():
-        qs = qs.filter(year__gte=int(year_from))
+    if filters['year_from'] is not None:
+        conditions.append(Q(year__gte=filters['year_from']))
+    return conditions
+
+
+def _vehicle_queryset(filters):
+    """Unsold cars matching the vehicle_list filters."""
+    return Car.objects.filter(sold=False, *_filter_conditions(filters))
+
 
-    # If filters applied but no results, show all cars
-    if filters_applied and not qs.exists():
-        qs = base_qs
+def _closest_matches(filters):
+    """
+    Every unsold car annotated with match_score, the number of `filters` it
+    satisfies, so the best partial matches can be ordered first in one query.
+    """
+    score = sum(
+        (Case(When(condition, then=Value(1)), default=Value(0), output_field=IntegerField())
+         for condition in _filter_conditions(filters)),
+        Value(0),
+    )
+    return Car.objects.filter(sold=False).annotate(match_score=score)
+
+
+def _vehicle_ordering(sort):
+    """order_by() fields for a _vehicle_sort() result; the id keeps keyset cursors stable."""
+    if sort:
+        column, direction = sort
+        return [column if direction == 'asc' else f'-{column}', 'id']
+    # Default sorting by position (custom order), then by creation date
+    return ['position', '-created_at', 'id']
+
+
+def _vehicle_results(request):
+    """Shared by vehicle_list and ajax_vehicles: (filters, facets, queryset, ordering, fallback)."""
+    filters = _vehicle_filters(request)
+    facets = get_vehicle_facets(filters)
+
+    ordering = _vehicle_ordering(_vehicle_sort(request))
+    # If filters applied but no results, show the closest matches first
+    # (the facet total already tells us, so no extra exists() query)
+    if _filters_applied(filters) and not facets['total']:
+        qs = _closest_matches(filters)
+        ordering = ['-match_score'] + ordering
         no_results_fallback = True
     else:
+        qs = _vehicle_queryset(filters)
         no_results_fallback = False
+    # The car cards show brand and model names
+    qs = qs.select_related('brand', 'model_name')
+    return filters, facets, qs, ordering, no_results_fallback
+
+
+def _query_without(request, *names):
+    """The current query string minus `names`, for building pagination links."""
+    query = request.GET.copy()
+    for name in names:
+        query.pop(name, None)
+    return query.urlencode()
 
-    # -- Sorting --
-    if sort_price in ['asc','desc']:
-        qs = qs.order_by('price' if sort_price=='asc' else '-price')
-    elif sort_mileage in ['asc','desc']:
-        qs = qs.order_by('mileage' if sort_mileage=='asc' else '-mileage')
-    elif sort_year in ['asc','desc']:
-        qs = qs.order_by('year' if sort_year=='asc' else '-year')
-    else:
-        # Default sorting by position (custom order), then by creation date
-        qs = qs.order_by('position', '-created_at')
+
+@catalog_conditional
+@cache_public_page
+def vehicle_list(request):
+    snapshot = catalog_snapshot.get_snapshot()
+    if snapshot is not None:
+        return _vehicle_list_from_snapshot(request, snapshot)
+
+    filters, facets, qs, ordering, no_results_fallback = _vehicle_results(request)
 
     # -- Pagination --
-    paginator = Paginator(qs, 12)  # Show 12 cars per page
-    page = request.GET.get('page')
-    cars = paginator.get_page(page)
+    if keyset_enabled(request):
+        cars = KeysetPaginator(qs, ordering, 12).get_page(request.GET.get('cursor'))
+        results_count = get_vehicle_facets({})['total'] if no_results_fallback else facets['total']
+    else:
+        paginator = Paginator(qs.order_by(*ordering), 12)  # Show 12 cars per page
+        page = request.GET.get('page')
+        cars = paginator.get_page(page)
+        results_count = paginator.count
 
-    # models for the initial brand - only show models with available cars
-    models_qs = CarModel.objects.filter(
-        brand_id=brand,
-        car__sold=False
-    ).distinct().order_by('name') if brand else []
+    return render(request, 'frontend/vehicles.html', {
+        'cars': cars,
+        'results_count': results_count,
+        'page_query': _query_without(request, 'page', 'cursor'),
+        'no_results_fallback': no_results_fallback,
+        **_filter_context(filters, facets),
+        **model_map_context(),
+    })
 
-    # Get current language
+def ajax_vehicles(request):
+    """
+    Infinite-scroll feed for vehicle_list: the next 12 cars after ?cursor=,
+    with the same filters and sorts, plus the cursor for the following batch.
+    """
+    _, _, qs, ordering, no_results_fallback = _vehicle_results(request)
+    page = KeysetPaginator(qs, ordering, 12).get_page(request.GET.get('cursor'))
     current_language = translation.get_language()
-    
-    # Get only choices that exist in available cars
-    available_transmissions = base_qs.values_list('transmission', flat=True).distinct()
-    transmission_choices = [(key, label) for key, label in Car.get_transmission_choices(current_language) if key in available_transmissions]
-    
-    available_fuels = base_qs.values_list('fuel_type', flat=True).distinct()
-    fuel_choices = [(key, label) for key, label in Car.get_fuel_choices(current_language) if key in available_fuels]
-    
-    available_bodies = base_qs.values_list('body_type', flat=True).distinct()
-    vehicle_bodies = [(key, label) for key, label in Car.get_body_choices(current_language) if key in available_bodies]
+    return JsonResponse({
+        'results': [{
+            'id': car.pk,
+            'title': car.title,
+            'brand': car.brand.name if car.brand else None,
+            'model': car.model_name.name if car.model_name else None,
+            'year': car.year,
+            'price': car.price,
+            'mileage': car.mileage,
+            'fuel': car.get_fuel_type_display_lang(current_language),
+            'transmission': car.get_transmission_display_lang(current_language),
+            'image': car.main_image.url if car.main_image else None,
+            'url': reverse('frontend_vehicle_detail', args=[car.pk]),
+        } for car in page],
+        'next_cursor': page.next_cursor,
+        'no_results_fallback': no_results_fallback,
+    })
+
+def ajax_typeahead(request):
+    """
+    Search-box suggestions for ?q= (brands, models, car titles) in any
+    spelling; served from the in-process trie without database queries.
+    """
+    vehicles_url = reverse('frontend_vehicles')
+    results = []
+    for entry in suggest(request.GET.get('q', '')[:100]):
+        if entry['kind'] == 'car':
+            url = reverse('frontend_vehicle_detail', args=[entry['car']])
+        else:
+            params = {'brand': entry['brand']}
+            if entry.get('model'):
+                params['model_name'] = entry['model']
+            url = f'{vehicles_url}?{urlencode(params)}'
+        results.append({'type': entry['kind'], 'label': entry['label'], 'count': entry['count'], 'url': url})
+    return JsonResponse({'results': results})
+
+def resized_image(request, token):
+    """
+    A stored image at the size and format signed into `token` (see
+    image_resize.py), encoded on first request and served from disk after.
+    """
+    try:
+        resize = image_resize.parse(token)
+        path = image_resize.get_resized(resize)
+    except (image_resize.InvalidResize, OSError):
+        # Forged or stale URL, or the original is gone or unreadable
+        raise Http404
+    response = FileResponse(open(path, 'rb'), content_type=image_resize.CONTENT_TYPES[resize.format])
+    # The URL names this exact rendition of an upload, which never changes
+    patch_cache_control(response, public=True, max_age=60 * 60 * 24 * 365, immutable=True)
+    return response
+
+def _snapshot_keyset_page(snapshot, ids, ordering, scores, cursor):
+    """
+    The KeysetPaginator page of `ids` (in `ordering` order) for `cursor`:
+    the cursor's sort key is looked up among the snapshot's keys instead of
+    filtering in SQL, then only the page's cars are fetched.
+    """
+    paginator = KeysetPaginator(Car.objects.all(), ordering, 12)
+    direction, values = paginator.decode(cursor)
+    keys = snapshot.sort_keys(ids, paginator.ordering, scores)
+    if direction == 'next':
+        start = bisect_right(keys, snapshot.cursor_key(paginator.ordering, values))
+        stop = start + paginator.per_page
+    elif direction == 'prev':
+        stop = bisect_left(keys, snapshot.cursor_key(paginator.ordering, values))
+        start = max(stop - paginator.per_page, 0)
+    else:
+        start, stop = 0, paginator.per_page
+
+    rows = _cars_in_order(ids[start:stop])
+    if scores is not None:
+        score_of = dict(zip(ids[start:stop], keys[start:stop]))
+        for car in rows:
+            car.match_score = -score_of[car.pk][0]
+    if direction == 'prev':
+        has_next, has_previous = True, start > 0
+    else:
+        has_next, has_previous = stop < len(ids), direction == 'next'
+    return KeysetPage(
+        rows,
+        has_next=has_next,
+        has_previous=has_previous,
+        next_cursor=paginator.cursor(rows[-1], 'next') if rows and has_next else None,
+        previous_cursor=paginator.cursor(rows[0], 'prev') if rows and has_previous else None,
+    )
+
+def _vehicle_list_from_snapshot(request, snapshot):
+    """vehicle_list served from the columnar snapshot: one query for the page rows."""
+    filters = _vehicle_filters(request)
+    sort = _vehicle_sort(request)
+    ordering = _vehicle_ordering(sort)
+
+    ids = snapshot.search(filters, sort)
+    # If filters applied but no results, show the closest matches first
+    no_results_fallback = False
+    if not ids and _filters_applied(filters):
+        ids = snapshot.closest_matches(filters, sort)
+        ordering = ['-match_score'] + ordering
+        no_results_fallback = True
+
+    if keyset_enabled(request):
+        # Same cursors as the ORM listing, so ajax_vehicles can continue from them
+        scores = snapshot.match_scores(filters) if no_results_fallback else None
+        cars = _snapshot_keyset_page(snapshot, ids, ordering, scores, request.GET.get('cursor'))
+    else:
+        # The id list is already in memory, so plain page numbers cost nothing here
+        cars = Paginator(ids, 12).get_page(request.GET.get('page'))  # Show 12 cars per page
+        cars.object_list = _cars_in_order(list(cars.object_list))
 
     return render(request, 'frontend/vehicles.html', {
         'cars': cars,
-        # Only show brands that have available cars
-        'brands': CarBrand.objects.filter(car__sold=False).distinct().order_by('name'),
-        'models': models_qs,
-        'transmission_choices': transmission_choices,
-        'fuel_choices':        fuel_choices,
-        'vehicle_bodies':      vehicle_bodies,
-        'colors':              Car.get_color_choices(current_language),
+        'results_count': len(ids),
+        'page_query': _query_without(request, 'page', 'cursor'),
         'no_results_fallback': no_results_fallback,
+        **_filter_context(filters, get_vehicle_facets(filters)),
+        **model_map_context(),
     })
 
+@car_conditional
+@cache_public_page
 def vehicle_detail(request, pk):
-    car = get_object_or_404(Car, pk=pk)
+    # The template walks the images and equipment several times; load each once
+    car = get_object_or_404(
+        Car.objects.select_related('brand', 'model_name').prefetch_related('images', 'equipment'),
+        pk=pk,
+    )
     
     # Get current language
     current_language = translation.get_language()
@@ -166,110 +451,37 @@ def vehicle_detail(request, pk):
 
 def get_recommended_cars(current_car, limit=None):
     """
-    Intelligent recommendation system for similar cars
-    Only shows vehicles with the same model as the current car
-    Priority: Same model (required) > Same brand > Similar price > Same fuel type > Same body type > Newest
+    Similar cars for the detail page, best first.
+
+    Reads the precomputed top-K table (see recommendations.py): same model
+    first, widened to the same brand/body type when the model group is small.
     """
-    # Only get cars with the same model as the current car
-    all_cars = Car.objects.filter(
-        sold=False, 
-        model_name_id=current_car.model_name_id
-    ).exclude(pk=current_car.pk)
-    
-    if not all_cars.exists():
-        return []
-    
-    # Calculate price range (±30%)
-    price_min = current_car.price * 0.7
-    price_max = current_car.price * 1.3
-    
-    # Scoring system for recommendations
-    scored_cars = []
-    
-    for car in all_cars:
-        score = 0
-        
-        # Since all cars already have the same model, prioritize other factors:
-        # Same brand = +50 points (highest remaining priority)
-        if car.brand_id == current_car.brand_id:
-            score += 50
-        
-        # Similar price range (±30%) = +25 points
-        if price_min <= car.price <= price_max:
-            score += 25
-        # Closer price = more points
-        else:
-            price_diff = abs(car.price - current_car.price)
-            max_diff = current_car.price * 0.5  # Max 50% difference
-            if price_diff <= max_diff:
-                score += max(5, 20 - int(price_diff / (max_diff / 15)))
-        
-        # Same fuel type = +20 points
-        if car.fuel_type == current_car.fuel_type:
-            score += 20
-            
-        # Same body type = +15 points  
-        if car.body_type == current_car.body_type:
-            score += 15
-            
-        # Same transmission = +10 points
-        if car.transmission == current_car.transmission:
-            score += 10
-            
-        # Similar year (±3 years) = +10 points
-        year_diff = abs(car.year - current_car.year)
-        if year_diff <= 3:
-            score += max(2, 10 - year_diff * 2)
-            
-        # Similar power (±50kW) = +5 points  
-        if abs(car.kilowatts - current_car.kilowatts) <= 50:
-            score += 5
-            
-        # Newer cars get slight bonus = +1-3 points
-        score += min(3, (car.year - 2020))
-        
-        # Better position (lower number) gets bonus points = +1-10 points
-        # Position 0-5 gets 10 points, 6-10 gets 8 points, etc.
-        if car.position <= 5:
-            score += 10
-        elif car.position <= 10:
-            score += 8
-        elif car.position <= 15:
-            score += 6
-        elif car.position <= 20:
-            score += 4
-        elif car.position <= 30:
-            score += 2
-        
-        scored_cars.append((car, score))
-    
-    # Sort by score (descending) and get top recommendations
-    scored_cars.sort(key=lambda x: x[1], reverse=True)
-    
-    # Return just the car objects, limited to requested amount (or all if limit is None)
-    if limit is None:
-        return [car for car, score in scored_cars]
-    else:
-        return [car for car, score in scored_cars[:limit]]
+    return recommended_cars(current_car, limit)
 
+@cache_public_page
 def about(request):
     return render(request, 'frontend/about.html')
 
+@cache_public_page
 def contact(request):
     return render(request, 'frontend/contact.html')
 
+@cache_public_page
 def services(request):
     service_type = request.GET.get('service', 'order')  # Default to 'order'
     return render(request, 'frontend/services.html', {
         'service_type': service_type
     })
 
+@cache_public_page
 def collaboration(request):
     return render(request, 'frontend/collaboration.html')
 
+@cache_public_page
 def terms(request):
     return render(request, 'frontend/terms.html')
 
+@cache_public_page
 def privacy(request):
     return render(request, 'frontend/privacy.html')
 
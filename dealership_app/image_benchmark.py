@@ -0,0 +1,173 @@
+"""
+Benchmark of the image pipelines declared on Car and CarImage.
+
+A case runs one pipeline (models.MAIN_IMAGE or CAR_IMAGE, the Variants
+the ProcessedImageField and ImageSpecFields are built from) over one
+generated photo from CORPUS, `repeat` times, in a fresh process so the
+peak RSS measured is the case's own.  Each run is timed stage by stage as
+the upload queue runs them (Pipeline.run): decoding the upload, the stored
+original, every spec, the srcset ladder and the placeholder.
+
+The photos are made from a fixed seed, so the output bytes only change
+when the encoding does.  The benchmark_images command reports the cases
+and compares them with the baseline kept in BASELINE.
+"""
+import math
+import os
+import platform
+import random
+import resource
+import statistics
+import time
+
+import PIL
+from PIL import Image
+
+
+BASELINE = os.path.join(os.path.dirname(__file__), 'image_benchmark.json')
+
+# (width, height, upload format): phone photos sent over Viber are 12-24 MP JPEGs
+CORPUS = [
+    (640, 480, 'JPEG'),
+    (1600, 1200, 'JPEG'),
+    (4000, 3000, 'JPEG'),
+    (6000, 4000, 'JPEG'),
+    (1600, 1200, 'PNG'),
+    (4000, 3000, 'PNG'),
+    (1600, 1200, 'WEBP'),
+    (4000, 3000, 'WEBP'),
+]
+
+UPLOAD_OPTIONS = {'JPEG': {'quality': 95}, 'PNG': {}, 'WEBP': {'quality': 90}}
+
+PIPELINES = ('car', 'car_image')
+
+# Higher is better for images/s only
+METRICS = {'images_per_s': 1, 'p95_ms': -1, 'peak_rss_mb': -1, 'output_bytes': -1}
+
+
+def make_photo(width, height, seed=0):
+    """A photo-like image: smooth shapes, gradients and sensor noise, the same for the same seed."""
+    shapes = Image.effect_mandelbrot((width // 8, height // 8), (-2.2, -1.2, 1.0, 1.2), 64)
+    shapes = shapes.resize((width, height), Image.Resampling.BICUBIC)
+    gradient = Image.linear_gradient('L').resize((width, height))
+    noise = Image.frombytes('L', (width, height), random.Random(seed).randbytes(width * height))
+    return Image.merge('RGB', (
+        Image.blend(shapes, noise, 0.15),
+        Image.blend(gradient, noise, 0.15),
+        Image.blend(shapes.transpose(Image.Transpose.FLIP_LEFT_RIGHT), gradient, 0.5),
+    ))
+
+
+def case_name(pipeline, width, height, fmt):
+    return f'{pipeline}/{width}x{height}.{fmt.lower()}'
+
+
+def write_corpus(directory, photos=CORPUS):
+    """Save the `photos` of CORPUS in `directory`; returns {(width, height, format): path}."""
+    paths = {}
+    for seed, (width, height, fmt) in enumerate(CORPUS):
+        if (width, height, fmt) not in photos:
+            continue
+        path = os.path.join(directory, f'{width}x{height}.{fmt.lower()}')
+        make_photo(width, height, seed).save(path, fmt, **UPLOAD_OPTIONS[fmt])
+        paths[width, height, fmt] = path
+    return paths
+
+
+def p95(samples):
+    """95th percentile by nearest rank."""
+    ordered = sorted(samples)
+    return ordered[math.ceil(0.95 * len(ordered)) - 1]
+
+
+def peak_rss():
+    """Peak resident memory of this process so far, in KB."""
+    # VmHWM starts over at exec; ru_maxrss keeps the peak of the process that spawned this one
+    try:
+        with open('/proc/self/status') as fh:
+            for line in fh:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def run_case(pipeline_name, path, repeat):
+    """Run one pipeline over the photo at `path` `repeat` times; returns its metrics."""
+    from .models import CAR_IMAGE, MAIN_IMAGE
+
+    pipeline = MAIN_IMAGE if pipeline_name == 'car' else CAR_IMAGE
+    idle_rss = peak_rss()
+    totals, stages, output_bytes = [], {}, 0
+    for _ in range(repeat):
+        timings = {}
+        started = last = time.perf_counter()
+
+        def lap(stage):
+            nonlocal last
+            now = time.perf_counter()
+            timings[stage] = now - last
+            last = now
+
+        # The stages of Pipeline.run, timed one by one
+        with open(path, 'rb') as fh:
+            bitmap = pipeline.decode(fh, pipeline.original.bounds())
+        lap('decode')
+        bitmap = pipeline.original.process(bitmap)
+        encoded = [pipeline.original.encode(bitmap, processed=True)]
+        lap('original')
+        for name, variant in pipeline.variants.items():
+            encoded.append(variant.encode(bitmap))
+            lap(name)
+        if pipeline.ladder:
+            encoded += pipeline.ladder.render(bitmap).values()
+            lap('ladder')
+        if pipeline.placeholder:
+            pipeline.placeholder.render(bitmap)
+            lap('placeholder')
+
+        totals.append(last - started)
+        for stage, seconds in timings.items():
+            stages.setdefault(stage, []).append(seconds)
+        output_bytes = sum(len(item.data) for item in encoded)
+
+    peak = peak_rss()
+    return {
+        'images_per_s': round(repeat / sum(totals), 3),
+        'p95_ms': round(p95(totals) * 1000, 1),
+        'peak_rss_mb': round(peak / 1024, 1),
+        'idle_rss_mb': round(idle_rss / 1024, 1),
+        'output_bytes': output_bytes,
+        'upload_bytes': os.path.getsize(path),
+        'stages_ms': {stage: round(statistics.median(seconds) * 1000, 1) for stage, seconds in stages.items()},
+    }
+
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'pillow': PIL.__version__,
+        'machine': platform.machine(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """
+    [(case, metric, baseline value, new value, relative change, regressed)]
+    for the cases both have; a metric regresses when it is worse by more
+    than `tolerance` (output bytes: by any amount over 1%).
+    """
+    rows = []
+    for case, metrics in results.items():
+        before = baseline.get('cases', {}).get(case)
+        if not before:
+            continue
+        for metric, direction in METRICS.items():
+            old, new = before[metric], metrics[metric]
+            change = (new - old) / old if old else 0.0
+            allowed = 0.01 if metric == 'output_bytes' else tolerance
+            rows.append((case, metric, old, new, change, -change * direction > allowed))
+    return rows
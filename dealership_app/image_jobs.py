@@ -0,0 +1,225 @@
+"""
+Database-backed queue for image work, run by the process_images command.
+
+Upload views store the file as it arrived and queue a job instead of
+decoding it in the request; the worker claims jobs, runs them in a process
+pool and retries failures with exponential backoff.  Jobs left in
+'processing' by a worker that died are put back in the queue once they are
+older than STALE_AFTER.  Saved source images queue the generation of their
+specs here as well (see image_specs.py), and catalog writes that touch an
+unknown set of cars queue the rebuild of the similar cars (see
+recommendations.py): under CGI the request's process ends with the response,
+so nothing may be left running in it.
+"""
+import io
+import traceback
+from datetime import timedelta
+
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+from PIL import Image
+
+from .image_specs import generate_specs, store_specs
+from .recommendations import rebuild_recommendations, refresh_recommendations
+from .image_pipeline import check_pixels, measure
+from .image_store import addressed_name, measure_upload, store_once
+from .models import CAR_IMAGE, Car, CarImage, ImageJob, adopt_image, record_image, set_image_columns
+
+
+MAX_ATTEMPTS = 5
+
+# Seconds before the first retry; doubled after every further failure
+BACKOFF = 30
+
+# A job processing for longer than this (seconds) belongs to a dead worker
+STALE_AFTER = 15 * 60
+
+
+def enqueue(task, **targets):
+    return ImageJob.objects.create(task=task, **targets)
+
+
+def queue_specs(instance):
+    """Queue generating the specs of a Car or CarImage, unless that is queued already."""
+    if isinstance(instance, Car):
+        task, targets, tasks = 'car_specs', {'car': instance}, ['car_specs']
+    else:
+        task, targets, tasks = 'car_image_specs', {'car_image': instance}, ['car_image', 'car_image_specs']
+    # Not a processing one: it may have read the source before this save
+    if ImageJob.objects.filter(task__in=tasks, status='pending', **targets).exists():
+        return None
+    return enqueue(task, **targets)
+
+
+def queue_recommendations(car_ids=None):
+    """
+    Queue rescoring the cars that widen to `car_ids` (see recommendations.py),
+    or rebuilding every car's similar cars for None, unless that is queued
+    already. Returns the new jobs.
+    """
+    pending = ImageJob.objects.filter(task='recommendations', status='pending')
+    # A job still waiting will read the catalog as it is now; a rebuild covers every car
+    if pending.filter(car=None).exists():
+        return []
+    if car_ids is None:
+        return [enqueue('recommendations')]
+    cars = Car.objects.filter(pk__in=list(car_ids)).exclude(image_jobs__in=pending)
+    return [enqueue('recommendations', car=car) for car in cars.only('pk')]
+
+
+def _check_image(upload):
+    """
+    Reject files that PIL cannot open or that fail Image.verify(), and
+    images over image_pipeline.MAX_PIXELS.  verify() reads through the file
+    to check its structure but decodes no pixels; the pixel count comes
+    from the header.
+    """
+    try:
+        with Image.open(upload) as image:
+            image.verify()
+    except Exception:
+        raise ValueError(f'{upload.name} is not a valid image')
+    finally:
+        upload.seek(0)
+    check_pixels(image)
+
+
+def queue_car_image(car, upload, position):
+    """
+    Store `upload` for `car` as it arrived and queue its processing.
+
+    The stored file is a valid image straight away, so pages can show it
+    before the worker has resized and re-encoded it.  A photo uploaded
+    before is not queued: the new image shares its stored copy and versions.
+    """
+    _check_image(upload)
+    field = CarImage._meta.get_field('image')
+    car_image = CarImage(car=car, position=position, processing_status='pending')
+    set_image_columns(car_image, 'image', measure_upload(upload))
+    car_image.image = addressed_name(field, car_image, car_image.image_hash, CAR_IMAGE.original.format)
+    if adopt_image(car_image, 'image', processing_status='completed'):
+        car_image.processing_status = 'completed'
+        car_image.save()
+        return car_image
+    # A plain name skips ProcessedImageField's processing; the worker does it
+    car_image.image = field.storage.save(
+        field.generate_filename(car_image, upload.name), upload, max_length=field.max_length)
+    with transaction.atomic():
+        car_image.save()
+        enqueue('car_image', car_image=car_image)
+    return car_image
+
+
+def _process_car_image(job):
+    car_image = job.car_image
+    if car_image.processing_status == 'completed':
+        generate_specs(car_image)
+    else:
+        CarImage.objects.filter(pk=car_image.pk).update(processing_status='processing')
+        source = car_image.image
+        raw_name = source.name
+        digest = car_image.image_hash
+        if not digest:  # queued before uploads were hashed
+            with source.open('rb') as fh:
+                digest = measure(fh).hash
+        field = CarImage._meta.get_field('image')
+        name = addressed_name(field, car_image, digest, CAR_IMAGE.original.format)
+        car_image.processing_status = 'processing'
+        if field.storage.exists(name):
+            # The same photo, queued earlier, has been processed since
+            car_image.image = name
+            columns = adopt_image(car_image, 'image', processing_status='completed')
+            car_image.save(update_fields=['image', *columns])
+            if not columns:
+                record_image(car_image, 'image')
+            generate_specs(car_image)
+        else:
+            # One decode for the stored original and all of its versions
+            with source.open('rb') as fh:
+                original, outputs = CAR_IMAGE.run(fh)
+            store_once(field.storage, name, ContentFile(original.data))
+            car_image.image = name
+            columns = set_image_columns(car_image, 'image', measure(io.BytesIO(original.data)))
+            car_image.save(update_fields=['image', *columns])
+            store_specs(car_image, outputs)
+        field.storage.delete(raw_name)
+    # 'completed' tells the edit page its thumbnails exist
+    CarImage.objects.filter(pk=car_image.pk).update(processing_status='completed')
+
+
+TASKS = {
+    'car_image': _process_car_image,
+    'car_image_specs': lambda job: generate_specs(job.car_image),
+    'car_specs': lambda job: generate_specs(job.car),
+    'recommendations': lambda job: (
+        refresh_recommendations([job.car_id], widened=True) if job.car_id else rebuild_recommendations()
+    ),
+}
+
+
+def recover_stale():
+    """Put jobs a dead worker left in 'processing' back in the queue. Returns how many."""
+    now = timezone.now()
+    return ImageJob.objects.filter(
+        status='processing', locked_at__lt=now - timedelta(seconds=STALE_AFTER),
+    ).update(status='pending', locked_at=None, run_after=now)
+
+
+def claim(limit):
+    """Mark up to `limit` due jobs as processing and return their ids."""
+    now = timezone.now()
+    candidates = (ImageJob.objects.filter(status='pending', run_after__lte=now)
+                  .values_list('pk', flat=True)[:limit])
+    # The conditional update makes a job belong to exactly one worker
+    return [
+        job_id for job_id in candidates
+        if ImageJob.objects.filter(pk=job_id, status='pending')
+        .update(status='processing', locked_at=now, attempts=F('attempts') + 1)
+    ]
+
+
+def release(job_ids):
+    """Hand claimed jobs back to the queue without counting the attempt."""
+    return ImageJob.objects.filter(pk__in=list(job_ids), status='processing').update(
+        status='pending', locked_at=None, attempts=F('attempts') - 1,
+    )
+
+
+def run_job(job_id):
+    """Run one claimed job in a pool process. Returns None or the error text."""
+    close_old_connections()
+    try:
+        job = ImageJob.objects.select_related('car', 'car_image').get(pk=job_id)
+    except ImageJob.DoesNotExist:
+        return None  # its image was deleted meanwhile
+    try:
+        TASKS[job.task](job)
+    except Exception:
+        return traceback.format_exc()
+    finally:
+        close_old_connections()
+    return None
+
+
+def finish(job_id, error=None):
+    """
+    Record the outcome of a claimed job: done, retried after a backoff, or
+    failed for good after MAX_ATTEMPTS. Returns the job's new status.
+    """
+    job = ImageJob.objects.filter(pk=job_id).first()
+    if job is None:
+        return None
+    if error is None:
+        job.status, job.last_error = 'done', ''
+    elif job.attempts >= MAX_ATTEMPTS:
+        job.status, job.last_error = 'failed', error
+        if job.car_image_id:
+            CarImage.objects.filter(pk=job.car_image_id).update(processing_status='error')
+    else:
+        job.status, job.last_error = 'pending', error
+        job.run_after = timezone.now() + timedelta(seconds=BACKOFF * 2 ** (job.attempts - 1))
+    job.locked_at = None
+    job.save(update_fields=['status', 'last_error', 'run_after', 'locked_at', 'updated_at'])
+    return job.status
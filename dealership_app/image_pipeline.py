@@ -0,0 +1,337 @@
+"""
+Decode-once image pipeline.
+
+A Pipeline describes an image field's stored original and the resized
+versions derived from it.  models.py builds the ProcessedImageField and its
+ImageSpecFields from the same Variants, so ImageKit's file names and its
+own (lazy) generation stay as they were, while the image queue produces all
+of them from a single decode: the upload is decoded once, resized to the
+original, and every version is encoded from that bitmap instead of from
+the original re-read and decoded again per version.
+
+A JPEG Variant with max_bytes is encoded to a byte budget rather than at a
+fixed quality: the highest quality (up to options['quality']) that fits is
+found by binary search, with full-resolution chroma kept when it fits at
+FULL_CHROMA_QUALITY or better and progressive used when it is smaller.
+The chosen settings come back with the bytes (Encoded.settings).
+
+A Pipeline's Ladder adds the same image at several widths in WebP, and in
+AVIF when Pillow can write it, for the srcset of the {% picture %} tag
+(templatetags/image_tags.py).  Rungs are never wider than the original and
+carry no EXIF.
+
+A Pipeline's Placeholder is a micro-thumbnail of the image (a few hundred
+bytes of WebP) kept in the row as a data: URI, which templates inline as
+the background of the image's box so it is never empty while the image
+loads.
+
+Uploads are decoded within bounds: one over MAX_PIXELS is refused from
+its header, before anything is decoded, and when the stored original only
+shrinks the image to fit a box, a JPEG is decoded at the smallest 1/2,
+1/4 or 1/8 scale still covering that box (Pillow's draft mode) and other
+formats are reduced by whole factors right after decoding.  A 24 MP phone
+photo is then decoded as 1.5 MP instead of 24.  The bitmap is turned
+upright per its EXIF orientation, which the encoded outputs do not carry.
+
+measure() reads the byte size, pixel size and SHA-256 of a stored image in
+one pass, for the columns models.py keeps them in.
+"""
+import base64
+import hashlib
+import io
+import math
+import os
+from collections import namedtuple
+
+from imagekit import hashers
+from imagekit.specs import ImageSpec
+from imagekit.utils import open_image
+from PIL import ExifTags, Image, ImageOps, features
+from pilkit.processors import ProcessorPipeline, ResizeToFit
+from pilkit.utils import prepare_image, save_image, suggest_extension
+
+
+# Largest upload decoded, in pixels: phone cameras take up to 50 MP
+MAX_PIXELS = 50 * 1000 * 1000
+
+# Lowest JPEG quality a byte budget may push a version down to
+MIN_QUALITY = 40
+
+# 4:4:4 chroma is kept only at this quality or better; below it 4:2:0 looks better for the bytes
+FULL_CHROMA_QUALITY = 80
+
+# Pillow's subsampling values
+SUBSAMPLING_444 = 0
+SUBSAMPLING_420 = 2
+
+Encoded = namedtuple('Encoded', 'data settings')
+
+# A stored image's byte size, pixel size and SHA-256 (hex)
+Measured = namedtuple('Measured', 'size width height hash')
+
+# Bytes read at a time by measure()
+CHUNK_SIZE = 64 * 1024
+
+# What a Pipeline derives from one decoded bitmap, besides the original
+Outputs = namedtuple('Outputs', 'versions rungs placeholder')
+
+# Save options per ladder format, best first (the order of the <source> tags)
+LADDER_FORMATS = {
+    'AVIF': {'quality': 55, 'speed': 8},
+    'WEBP': {'quality': 75, 'method': 4},
+}
+
+LADDER_DIR = 'CACHE/srcset'
+
+
+class Variant:
+    """One output image: processors applied to the decoded bitmap, encoded as `format` with `options`."""
+
+    def __init__(self, processors, format='JPEG', options=None, max_bytes=None):
+        self.processors = list(processors)
+        self.format = format
+        self.options = options or {}
+        self.max_bytes = max_bytes
+
+    def field_kwargs(self):
+        """Keyword arguments for the ProcessedImageField or ImageSpecField this variant defines."""
+        if self.max_bytes:
+            return {'spec': BudgetSpec.for_variant(self)}
+        return {'processors': self.processors, 'format': self.format, 'options': self.options}
+
+    def bounds(self):
+        """The (width, height) box this variant only fits images within, if it is a plain ResizeToFit."""
+        if len(self.processors) == 1 and isinstance(self.processors[0], ResizeToFit):
+            processor = self.processors[0]
+            if processor.width and processor.height and processor.mat_color is None:
+                return processor.width, processor.height
+        return None
+
+    def process(self, bitmap):
+        return ProcessorPipeline(self.processors).process(bitmap)
+
+    def encode(self, bitmap, processed=False):
+        """`bitmap` encoded (after the processors unless `processed`), with the settings used."""
+        if not processed:
+            bitmap = self.process(bitmap)
+        bitmap, options = prepare_image(bitmap, self.format)
+        options.update(self.options)
+        if self.max_bytes and self.format == 'JPEG':
+            return encode_within(bitmap, self.max_bytes, options)
+        data = _save(bitmap, self.format, options)
+        return Encoded(data, _settings(options, data))
+
+    def filename(self, name):
+        """`name` with the extension of this variant's format."""
+        return os.path.splitext(name)[0] + suggest_extension(name, self.format)
+
+
+def _save(bitmap, format, options):
+    return save_image(bitmap, io.BytesIO(), format, options, autoconvert=False).getvalue()
+
+
+def _settings(options, data):
+    settings = {key: options[key] for key in ('quality', 'subsampling', 'progressive') if key in options}
+    settings['bytes'] = len(data)
+    return settings
+
+
+def check_pixels(image):
+    """Raise ValueError if the opened (not yet decoded) `image` has more than MAX_PIXELS."""
+    width, height = image.size
+    if width * height > MAX_PIXELS:
+        raise ValueError(
+            f'The image is {width}x{height} pixels; at most {MAX_PIXELS // 1000000} megapixels are accepted'
+        )
+
+
+def measure(fh):
+    """The Measured of the encoded image in `fh`; only its header is decoded."""
+    digest, size = hashlib.sha256(), 0
+    fh.seek(0)
+    for chunk in iter(lambda: fh.read(CHUNK_SIZE), b''):
+        digest.update(chunk)
+        size += len(chunk)
+    fh.seek(0)
+    with Image.open(fh) as image:
+        width, height = image.size
+    fh.seek(0)
+    return Measured(size, width, height, digest.hexdigest())
+
+
+def encode_within(bitmap, max_bytes, options):
+    """
+    JPEG of `bitmap` at the highest quality up to options['quality'] whose
+    size is at most `max_bytes`. When even MIN_QUALITY is too big, that is
+    what is returned (settings['over_budget'] is set).
+    """
+    ceiling = options.get('quality', 85)
+    # Progressive is usually the smaller, so the search uses it
+    search = dict(options, progressive=True)
+
+    def size(quality, subsampling):
+        return len(_save(bitmap, 'JPEG', dict(search, quality=quality, subsampling=subsampling)))
+
+    best = None
+    for subsampling, floor in ((SUBSAMPLING_444, FULL_CHROMA_QUALITY), (SUBSAMPLING_420, MIN_QUALITY)):
+        low, high = min(floor, ceiling), ceiling
+        found = None
+        while low <= high:
+            quality = (low + high) // 2
+            if size(quality, subsampling) <= max_bytes:
+                found, low = quality, quality + 1
+            else:
+                high = quality - 1
+        if found is not None:
+            best = (found, subsampling)
+            break
+
+    over_budget = best is None
+    quality, subsampling = best or (min(MIN_QUALITY, ceiling), SUBSAMPLING_420)
+    final = dict(options, quality=quality, subsampling=subsampling)
+    # ...but not always
+    candidates = [_save(bitmap, 'JPEG', dict(final, progressive=progressive)) for progressive in (True, False)]
+    data = min(candidates, key=len)
+    final['progressive'] = data is candidates[0]
+    settings = _settings(final, data)
+    if over_budget:
+        settings['over_budget'] = True
+    return Encoded(data, settings)
+
+
+class BudgetSpec(ImageSpec):
+    """ImageKit spec for a Variant with a byte budget, so ImageKit's own generation honours it too."""
+
+    variant = None
+
+    @classmethod
+    def for_variant(cls, variant):
+        return type('BudgetSpec', (cls,), {
+            'variant': variant, 'processors': variant.processors,
+            'format': variant.format, 'options': variant.options,
+        })
+
+    def get_hash(self):
+        # The budget is part of the file name, so changing it makes new files
+        return hashers.pickle([super().get_hash(), self.variant.max_bytes])
+
+    def generate(self):
+        if not self.source:
+            raise self.MissingSource(f"The spec '{self}' has no source file associated with it.")
+        with self.source.open('rb'):
+            bitmap = open_image(self.source)
+            return io.BytesIO(self.variant.encode(bitmap).data)
+
+
+class Ladder:
+    """The widths and modern formats an image is also stored at, for srcset."""
+
+    def __init__(self, widths, formats=tuple(LADDER_FORMATS)):
+        self.widths = sorted(widths)
+        # AVIF needs a Pillow built with libavif
+        self.formats = [fmt for fmt in formats if features.check(fmt.lower())]
+
+    @staticmethod
+    def name(source_name, width, format):
+        """Storage name of one rung, derived from the source's name alone."""
+        root = os.path.splitext(source_name)[0]
+        return f'{LADDER_DIR}/{root}/{width}w.{format.lower()}'
+
+    def rung_widths(self, width):
+        """The ladder's widths for an image `width` pixels wide (never upscaled)."""
+        return [w for w in self.widths if w < width] + [min(width, self.widths[-1])]
+
+    def render(self, bitmap):
+        """{(width, format): Encoded} for every rung of `bitmap`."""
+        bitmap, _ = prepare_image(bitmap, 'JPEG')  # RGB, like the JPEG versions
+        rungs = {}
+        for width in self.rung_widths(bitmap.width):
+            height = max(1, round(bitmap.height * width / bitmap.width))
+            resized = bitmap if width == bitmap.width else bitmap.resize(
+                (width, height), Image.Resampling.LANCZOS, reducing_gap=2.0)
+            for fmt in self.formats:
+                # exif=b'' keeps the camera's metadata (location included) out
+                data = _save(resized, fmt, dict(LADDER_FORMATS[fmt], exif=b''))
+                rungs[width, fmt] = Encoded(data, {'bytes': len(data)})
+        return rungs
+
+
+class Placeholder:
+    """A micro-thumbnail of the image, inlined as a data: URI while the image itself loads."""
+
+    def __init__(self, width=24, format='WEBP', quality=40):
+        self.width = width
+        self.format = format
+        self.quality = quality
+
+    def render(self, bitmap):
+        """The data: URI of `bitmap` shrunk to `width` pixels wide."""
+        bitmap, _ = prepare_image(bitmap, 'JPEG')
+        width = min(self.width, bitmap.width)
+        height = max(1, round(bitmap.height * width / bitmap.width))
+        # The browser blurs it when scaling it up; a plain box filter is detailed enough
+        small = bitmap.resize((width, height), Image.Resampling.BOX, reducing_gap=2.0)
+        data = _save(small, self.format, {'quality': self.quality, 'exif': b''})
+        return f'data:image/{self.format.lower()};base64,{base64.b64encode(data).decode()}'
+
+
+class Pipeline:
+    """An original and its named versions, all produced from one decoded bitmap."""
+
+    def __init__(self, original, ladder=None, placeholder=None, **variants):
+        self.original = original
+        self.ladder = ladder
+        self.placeholder = placeholder
+        self.variants = variants
+
+    def spec(self, name):
+        """Keyword arguments for the ImageSpecField of version `name`."""
+        return self.variants[name].field_kwargs()
+
+    @staticmethod
+    def decode(fh, bounds=None):
+        """
+        The image in `fh` decoded upright, refused over MAX_PIXELS.  With
+        `bounds`, the (width, height) box it is about to be fitted within, it
+        is decoded or reduced to the smallest size still covering that box.
+        """
+        image = Image.open(fh)
+        check_pixels(image)
+        # Orientations 5-8 turn the image a quarter: its stored width is its upright height
+        turned = image.getexif().get(ExifTags.Base.Orientation, 1) > 4
+        if bounds:
+            width, height = image.size[::-1] if turned else image.size
+            scale = min(bounds[0] / width, bounds[1] / height)
+            if scale < 1:
+                needed = (math.ceil(width * scale), math.ceil(height * scale))
+                if turned:
+                    needed = needed[::-1]
+                image.draft(image.mode, needed)  # JPEG only; the others ignore it
+                image.load()
+                # Whole factors draft left, and every factor of the other formats
+                factor = min(image.width // needed[0], image.height // needed[1])
+                if factor > 1 and image.mode not in ('1', 'P', 'I;16'):  # modes reduce() cannot average
+                    image = image.reduce(factor)
+        image.load()
+        ImageOps.exif_transpose(image, in_place=True)
+        return image
+
+    def run(self, fh):
+        """
+        Decode the uploaded image in `fh` once. Returns the encoded original
+        and the Outputs: {name: Encoded version}, the ladder's
+        {(width, format): Encoded} and the placeholder's data: URI.
+        """
+        bitmap = self.original.process(self.decode(fh, self.original.bounds()))
+        original = self.original.encode(bitmap, processed=True)
+        return original, self._outputs(bitmap, None, True, True)
+
+    def derive(self, fh, names=None, ladder=False, placeholder=False):
+        """Outputs with versions `names` (and the ladder, the placeholder) from a stored original, decoded once."""
+        return self._outputs(self.decode(fh), names, ladder, placeholder)
+
+    def _outputs(self, bitmap, names, ladder, placeholder):
+        versions = {name: self.variants[name].encode(bitmap) for name in self.variants if names is None or name in names}
+        rungs = self.ladder.render(bitmap) if ladder and self.ladder else {}
+        placeholder = self.placeholder.render(bitmap) if placeholder and self.placeholder else ''
+        return Outputs(versions, rungs, placeholder)
@@ -0,0 +1,189 @@
+"""
+Resized copies of stored images made on request, behind signed URLs.
+
+resize_url() signs the image name, width, height, fit and format into the
+URL, so the view (frontend_views.resized_image) only ever produces sizes
+the site itself asked for.  A variant is encoded from the stored original
+once and kept under IMAGE_RESIZE_CACHE_DIR: a file lock per variant makes
+concurrent requests for a missing one wait for the request encoding it
+instead of encoding it again.  The cache is trimmed below
+IMAGE_RESIZE_CACHE_MAX_BYTES, least recently served first (serving a file
+bumps its mtime), once enough has been written since the last trim; the
+bytes written are counted in a file next to the cache, as every CGI request
+is a process of its own.  The trim_resize_cache command trims it from cron.
+"""
+import fcntl
+import hashlib
+import os
+import tempfile
+from collections import namedtuple
+
+from django.conf import settings
+from django.core import signing
+from django.core.files.storage import default_storage
+from django.urls import reverse
+from PIL import features
+from pilkit.processors import ResizeToFill, ResizeToFit
+
+from .image_pipeline import LADDER_FORMATS, Pipeline, Variant
+
+
+SALT = 'dealership_app.image_resize'
+
+MAX_SIDE = 2400
+
+FITS = {
+    'fit': ResizeToFit,    # within width x height, aspect kept
+    'fill': ResizeToFill,  # exactly width x height, cropped from the centre
+}
+
+FORMATS = {
+    'jpeg': ('JPEG', {'quality': 80, 'progressive': True, 'optimize': True}),
+    'webp': ('WEBP', dict(LADDER_FORMATS['WEBP'], exif=b'')),
+    'avif': ('AVIF', dict(LADDER_FORMATS['AVIF'], exif=b'')),
+}
+
+CONTENT_TYPES = {'jpeg': 'image/jpeg', 'webp': 'image/webp', 'avif': 'image/avif'}
+
+# A trim leaves the cache at this share of its limit, so it does not run on every write
+TRIM_TO = 0.9
+
+# Bytes written since the last trim, shared by every process writing the cache
+WRITTEN_FILE = '.written'
+
+Resize = namedtuple('Resize', 'name width height fit format')
+
+
+class InvalidResize(ValueError):
+    pass
+
+
+def resize_url(name, width, height=None, fit='fit', format='webp'):
+    """Signed URL of the stored image `name` resized to width x height."""
+    token = signing.dumps([name, width, height, fit, format], salt=SALT, compress=True)
+    return reverse('resized_image', args=[token])
+
+
+def parse(token):
+    """The Resize a URL token stands for; InvalidResize if it is forged or out of range."""
+    try:
+        resize = Resize(*signing.loads(token, salt=SALT))
+    except (signing.BadSignature, TypeError, ValueError):
+        raise InvalidResize('bad signature')
+    sides = [side for side in (resize.width, resize.height) if side is not None]
+    if not sides or not all(isinstance(side, int) and 0 < side <= MAX_SIDE for side in sides):
+        raise InvalidResize('size out of range')
+    if resize.fit not in FITS or (resize.fit == 'fill' and len(sides) < 2):
+        raise InvalidResize('unknown fit')
+    if resize.format not in FORMATS or not features.check(resize.format.replace('jpeg', 'jpg')):
+        raise InvalidResize('unsupported format')
+    return resize
+
+
+def cache_path(resize):
+    key = hashlib.sha256(repr(tuple(resize)).encode()).hexdigest()
+    return os.path.join(settings.IMAGE_RESIZE_CACHE_DIR, key[:2], f'{key}.{resize.format}')
+
+
+def render(resize):
+    """Encoded bytes of `resize`, from the stored original."""
+    fmt, options = FORMATS[resize.format]
+    variant = Variant([FITS[resize.fit](resize.width, resize.height, upscale=False)], fmt, options)
+    with default_storage.open(resize.name, 'rb') as fh:
+        return variant.encode(Pipeline.decode(fh, variant.bounds())).data
+
+
+def get_resized(resize):
+    """Path of the cached file for `resize`, encoding it first when it is missing."""
+    path = cache_path(resize)
+    if _touch(path):
+        return path
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(f'{path}.lock', 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            # Whoever held the lock before us may have written it
+            if not os.path.exists(path):
+                data = render(resize)
+                _write(path, data)
+                _written(len(data))
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+    return path
+
+
+def _touch(path):
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        return False
+    return True
+
+
+def _write(path, data):
+    # Readers see the whole file or none of it
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as fh:
+            fh.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def _written(size):
+    """Count `size` more bytes in the cache, trimming it once the room the last trim left is used up."""
+    with open(os.path.join(settings.IMAGE_RESIZE_CACHE_DIR, WRITTEN_FILE), 'a+') as fh:
+        fcntl.flock(fh, fcntl.LOCK_EX)
+        fh.seek(0)
+        try:
+            written = int(fh.read()) + size
+        except ValueError:
+            written = size  # new, or cut short by a crash
+        due = written > settings.IMAGE_RESIZE_CACHE_MAX_BYTES * (1 - TRIM_TO)
+        fh.seek(0)
+        fh.truncate()
+        fh.write('0' if due else str(written))
+    if due:
+        trim()
+
+
+def trim(max_bytes=None):
+    """
+    Delete the least recently served variants until the cache is below
+    TRIM_TO of `max_bytes` (default: the setting). Returns the bytes freed.
+    """
+    max_bytes = settings.IMAGE_RESIZE_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    root = settings.IMAGE_RESIZE_CACHE_DIR
+    if not os.path.isdir(root):
+        return 0
+    with open(os.path.join(root, '.trim.lock'), 'a') as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return 0  # another process is trimming
+        entries = []
+        for folder in os.scandir(root):
+            if not folder.is_dir():
+                continue
+            for entry in os.scandir(folder.path):
+                if entry.name.endswith(('.lock', '.tmp')):
+                    continue
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        if total <= max_bytes:
+            return 0
+        entries.sort()
+        freed = 0
+        for _, size, path in entries:
+            if total - freed <= max_bytes * TRIM_TO:
+                break
+            for name in (path, f'{path}.lock'):
+                try:
+                    os.remove(name)
+                except FileNotFoundError:
+                    pass
+            freed += size
+        return freed
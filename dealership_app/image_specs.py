@@ -0,0 +1,199 @@
+"""
+Eager generation of the ImageKit specs (resized versions) of car images.
+
+settings.IMAGEKIT_DEFAULT_CACHEFILE_STRATEGY points at Pregenerated, so a
+spec's URL is only ever computed when a page renders: no encoding and no
+existence check.  Instead, a saved source image queues an ImageJob once the
+transaction commits and the process_images worker builds every spec of that
+row; warm_images builds the specs of the existing catalog.  Both decode the
+source once for all its specs, its srcset ladder and its placeholder (see
+image_pipeline.py).
+
+Pages only offer the srcset and placeholder once they are recorded on the
+row, so recording them bumps the catalog version: pages cached while the
+worker was busy are rendered again.
+"""
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, transaction
+from django.db.models import Min
+from imagekit.cachefiles.backends import CacheFileState
+
+from .catalog_version import bump_catalog_version
+from .image_pipeline import Ladder
+from .models import CAR_IMAGE, MAIN_IMAGE, Car, CarImage
+
+
+# The image field each model's specs are generated from, and its pipeline
+SPECS = {
+    Car: ('main_image', MAIN_IMAGE),
+    CarImage: ('image', CAR_IMAGE),
+}
+
+
+class Pregenerated:
+    """ImageKit cache file strategy that leaves all generation to the image queue."""
+
+    def on_source_saved(self, file):
+        instance = getattr(file.generator.source, 'instance', None)
+        if instance is None or instance.pk is None:
+            return
+        # The worker saving a processed upload builds the specs itself
+        if getattr(instance, 'processing_status', 'completed') in ('pending', 'processing'):
+            return
+        from .image_jobs import queue_specs
+        transaction.on_commit(lambda: queue_specs(instance))
+
+    def on_content_required(self, file):
+        # Reading a spec's bytes (not its URL) still works when it is missing
+        file.generate()
+
+    def should_verify_existence(self, file):
+        return False
+
+
+def _spec_file(instance, name):
+    # The descriptor caches the file with the source it saw first
+    instance.__dict__.pop(name, None)
+    return getattr(instance, name)
+
+
+def _overwrite(storage, name, data):
+    if storage.exists(name):
+        storage.delete(name)
+    saved = storage.save(name, ContentFile(data))
+    # Another worker wrote the same file in between; theirs is identical
+    if saved != name:
+        storage.delete(saved)
+
+
+def store_specs(instance, outputs):
+    """
+    Save the Outputs of `instance`'s pipeline: {spec name: Encoded} as the
+    cache files of its specs, the srcset ladder's {(width, format): Encoded}
+    and the placeholder, recording what they were encoded with.
+    """
+    encodings = dict(instance.spec_encodings)
+    fields = {}
+    for name, version in outputs.versions.items():
+        file = _spec_file(instance, name)
+        _overwrite(file.storage, file.name, version.data)
+        file.cachefile_backend.set_state(file, CacheFileState.EXISTS)
+        encodings[name] = version.settings
+    source = getattr(instance, SPECS[type(instance)][0])
+    if outputs.rungs:
+        for (width, fmt), rung in outputs.rungs.items():
+            _overwrite(source.storage, Ladder.name(source.name, width, fmt), rung.data)
+        # The {% picture %} tag lists only what is recorded here, for this source
+        encodings['ladder'] = {
+            'source': source.name,
+            'widths': sorted({width for width, _ in outputs.rungs}),
+            'formats': list(dict.fromkeys(fmt for _, fmt in outputs.rungs)),
+            'bytes': sum(rung.settings['bytes'] for rung in outputs.rungs.values()),
+        }
+    if outputs.placeholder:
+        fields['placeholder'] = instance.placeholder = outputs.placeholder
+        encodings['placeholder'] = {'source': source.name, 'bytes': len(outputs.placeholder)}
+    fields['spec_encodings'] = instance.spec_encodings = encodings
+    type(instance).objects.filter(pk=instance.pk).update(**fields)
+    # update() sends no signal; cached pages still show the image without them
+    transaction.on_commit(bump_catalog_version)
+
+
+def is_current(instance, output):
+    """Whether the ladder or placeholder recorded for `instance` was made from its current image."""
+    source = getattr(instance, SPECS[type(instance)][0])
+    return bool(source) and instance.spec_encodings.get(output, {}).get('source') == source.name
+
+
+def stored_names(instance):
+    """
+    Storage names of the files kept for `instance`'s image: the source, the
+    cache files of its specs and the srcset ladder recorded for it.
+    """
+    source_field, pipeline = SPECS[type(instance)]
+    source = getattr(instance, source_field)
+    if not source:
+        return []
+    names = [source.name] + [_spec_file(instance, name).name for name in pipeline.variants]
+    if is_current(instance, 'ladder'):
+        ladder = instance.spec_encodings['ladder']
+        names += [Ladder.name(source.name, width, fmt) for width in ladder['widths'] for fmt in ladder['formats']]
+    return names
+
+
+def output_names(model):
+    """Names of everything generated for `model`'s image: its specs, 'ladder' and 'placeholder'."""
+    pipeline = SPECS[model][1]
+    return [*pipeline.variants, *(['ladder'] if pipeline.ladder else []), *(['placeholder'] if pipeline.placeholder else [])]
+
+
+def generate_specs(instance, force=False, outputs=None):
+    """
+    Write the specs, srcset ladder and placeholder of a Car or CarImage
+    that do not exist yet (all of them with force), decoding the source
+    once; `outputs` limits that to some of output_names(). Returns how
+    many were made.
+    """
+    source_field, pipeline = SPECS[type(instance)]
+    source = getattr(instance, source_field)
+    if not source:
+        return 0
+    wanted = set(output_names(type(instance)) if outputs is None else outputs)
+    names = []
+    for name in pipeline.variants:
+        if name not in wanted:
+            continue
+        file = _spec_file(instance, name)
+        if force or not file.cachefile_backend.exists(file):
+            names.append(name)
+    ladder = 'ladder' in wanted and pipeline.ladder is not None and (force or not is_current(instance, 'ladder'))
+    placeholder = ('placeholder' in wanted and pipeline.placeholder is not None
+                   and (force or not is_current(instance, 'placeholder')))
+    if not names and not ladder and not placeholder:
+        return 0
+    with source.open('rb') as fh:
+        outputs = pipeline.derive(fh, names, ladder, placeholder)
+    store_specs(instance, outputs)
+    return len(outputs.versions) + len(outputs.rungs) + bool(outputs.placeholder)
+
+
+def distinct_sources(queryset):
+    """
+    pks of one row per stored image in `queryset`: rows sharing a
+    deduplicated file (see image_store.py) share its versions too, so
+    generating them for one row is enough (warm() passes them on).
+    """
+    field_name = SPECS[queryset.model][0]
+    firsts = queryset.order_by().values(field_name).annotate(first=Min('pk')).values_list('first', flat=True)
+    return sorted(firsts)
+
+
+def share_specs(instance):
+    """Give the other rows storing the same file the spec settings and placeholder recorded for `instance`."""
+    field_name = SPECS[type(instance)][0]
+    twins = type(instance).objects.filter(**{field_name: getattr(instance, field_name).name}).exclude(pk=instance.pk)
+    if twins.update(spec_encodings=instance.spec_encodings, placeholder=instance.placeholder):
+        transaction.on_commit(bump_catalog_version)
+
+
+def warm(model_name, ids, force=False, outputs=None):
+    """
+    Generate the specs (or only `outputs`) of one batch of rows in a pool
+    process, for the rows sharing their files as well. Returns
+    (rows, versions made, [(pk, error)]) for the batch.
+    """
+    close_old_connections()
+    model = Car if model_name == 'car' else CarImage
+    written, errors = 0, []
+    try:
+        for instance in model.objects.filter(pk__in=ids).order_by('pk'):
+            try:
+                made = generate_specs(instance, force, outputs)
+                if made:
+                    share_specs(instance)
+                written += made
+            except Exception as exc:
+                errors.append((instance.pk, f'{model_name} {instance.pk}: {exc}'))
+    finally:
+        close_old_connections()
+    return len(ids), written, errors
@@ -0,0 +1,108 @@
+"""
+Content-addressed storage of uploaded car images.
+
+The upload handlers below hash each uploaded file (SHA-256) while Django
+writes it to memory or disk, and the stored original of an upload is named
+after that hash: <upload_to>/<first 2 hex digits>/<hash>.jpg.  Processing
+is deterministic and the specs, srcset ladder and placeholder are all named
+after the original, so uploading the same photo again maps to a file that
+already exists with every version of it: nothing is decoded or encoded,
+and the new row takes the recorded metadata of a row that has it
+(models.adopt_image).
+
+A stored file is counted by the rows that name it: deleting a Car or
+CarImage deletes its files only once no other row refers to them
+(models.release_image).
+"""
+import hashlib
+
+from django.core.files.base import ContentFile
+from django.core.files.uploadhandler import MemoryFileUploadHandler, TemporaryFileUploadHandler
+from imagekit.models import ProcessedImageField
+from imagekit.models.fields.files import ProcessedImageFieldFile
+from imagekit.utils import suggest_extension
+from PIL import Image
+
+from .image_pipeline import Measured, Pipeline, Variant, measure
+
+
+class HashingUploadMixin:
+    """Computes the SHA-256 of an uploaded file from its chunks, as `file.sha256` (hex)."""
+
+    def new_file(self, *args, **kwargs):
+        # Before super(): the memory handler raises StopFutureHandlers when it takes the file
+        self.sha256 = hashlib.sha256()
+        super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        # The memory handler passes large files on to the next handler unread
+        if getattr(self, 'activated', True):
+            self.sha256.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        if file is not None:
+            file.sha256 = self.sha256.hexdigest()
+        return file
+
+
+class HashingMemoryFileUploadHandler(HashingUploadMixin, MemoryFileUploadHandler):
+    pass
+
+
+class HashingTemporaryFileUploadHandler(HashingUploadMixin, TemporaryFileUploadHandler):
+    pass
+
+
+def measure_upload(upload):
+    """The Measured of an upload, hashed by the upload handler when it came through one."""
+    digest = getattr(upload, 'sha256', None)
+    if digest is None:
+        return measure(upload)
+    upload.seek(0)
+    with Image.open(upload) as image:
+        width, height = image.size
+    upload.seek(0)
+    return Measured(upload.size, width, height, digest)
+
+
+def addressed_name(field, instance, digest, format):
+    """Storage name of the original stored by `field` for an upload hashing to `digest`."""
+    return field.generate_filename(instance, f'{digest[:2]}/{digest}{suggest_extension("", format)}')
+
+
+def store_once(storage, name, content):
+    """Save `content` as `name` unless that file exists; returns whether it was written."""
+    if storage.exists(name):
+        return False
+    saved = storage.save(name, content)
+    # The same upload stored by another request in between; theirs is identical
+    if saved != name:
+        storage.delete(saved)
+    return True
+
+
+class ContentAddressedImageFieldFile(ProcessedImageFieldFile):
+    def save(self, name, content, save=True):
+        spec = self.field.get_spec(source=content)
+        self.name = addressed_name(self.field, self.instance, measure_upload(content).hash, spec.format)
+        # A duplicate upload is not processed again
+        if not self.storage.exists(self.name):
+            # Decoded no larger than the field's processors keep (Pipeline.decode)
+            variant = Variant(spec.processors, spec.format, spec.options)
+            content.seek(0)
+            bitmap = Pipeline.decode(content, variant.bounds())
+            store_once(self.storage, self.name, ContentFile(variant.encode(bitmap).data))
+        self._set_instance_attribute(self.name, content)
+        self._committed = True
+        if save:
+            self.instance.save()
+
+    save.alters_data = True
+
+
+class ContentAddressedImageField(ProcessedImageField):
+    """ProcessedImageField storing each distinct upload once, named after its hash."""
+
+    attr_class = ContentAddressedImageFieldFile
@@ -0,0 +1,128 @@
+"""
+Inventory feed for partner marketplaces.
+
+Streams every available car as JSON or CSV.  Cars are read in chunks with
+iterator() (equipment and images prefetched per chunk) and serialized one at
+a time, so memory stays flat however large the inventory is.  Used by the
+inventory_feed view and the export_inventory command.
+"""
+import csv
+import json
+
+from django.urls import reverse
+from django.utils import translation
+
+from .models import Car
+
+
+FORMATS = ('json', 'csv')
+CHUNK_SIZE = 500
+
+# Separator for list values (equipment, images) in CSV output
+CSV_LIST_SEPARATOR = '|'
+
+
+def _url(absolute, path):
+    return absolute(path) if path else None
+
+
+def _detail_url(car, language, absolute):
+    # Detail pages live under the language prefix of the feed
+    with translation.override(language):
+        return absolute(reverse('frontend_vehicle_detail', args=[car.pk]))
+
+
+# Feed field -> function(car, language, absolute) returning its value, in output order
+FIELDS = {
+    'id':                 lambda car, lang, absolute: car.pk,
+    'title':              lambda car, lang, absolute: car.title,
+    'brand':              lambda car, lang, absolute: car.brand.name if car.brand else None,
+    'model':              lambda car, lang, absolute: car.model_name.name if car.model_name else None,
+    'year':               lambda car, lang, absolute: car.year,
+    'price':              lambda car, lang, absolute: car.price,
+    'mileage':            lambda car, lang, absolute: car.mileage,
+    'kilowatts':          lambda car, lang, absolute: car.kilowatts,
+    'engine_capacity':    lambda car, lang, absolute: car.engine_capacity,
+    'fuel_type':          lambda car, lang, absolute: car.fuel_type,
+    'fuel_label':         lambda car, lang, absolute: car.get_fuel_type_display_lang(lang),
+    'transmission':       lambda car, lang, absolute: car.transmission,
+    'transmission_label': lambda car, lang, absolute: car.get_transmission_display_lang(lang),
+    'body_type':          lambda car, lang, absolute: car.body_type,
+    'body_label':         lambda car, lang, absolute: car.get_body_type_display_lang(lang),
+    'registration_type':  lambda car, lang, absolute: car.registration_type,
+    'registration_label': lambda car, lang, absolute: car.get_registration_type_display_lang(lang),
+    'color':              lambda car, lang, absolute: car.color,
+    'color_label':        lambda car, lang, absolute: car.get_color_display_lang(lang),
+    'seats':              lambda car, lang, absolute: car.seats,
+    'seats_label':        lambda car, lang, absolute: car.get_seats_display_lang(lang),
+    'equipment':          lambda car, lang, absolute: [e.name for e in car.equipment.all()],
+    'main_image':         lambda car, lang, absolute: _url(absolute, car.main_image.url if car.main_image else None),
+    'images':             lambda car, lang, absolute: [_url(absolute, image.image.url) for image in car.images.all()],
+    'url':                _detail_url,
+}
+
+
+def parse_fields(value):
+    """
+    Turn a comma-separated projection into a list of feed fields (all when empty).
+    Raises ValueError naming the unknown fields.
+    """
+    if not value:
+        return list(FIELDS)
+    fields = [name.strip() for name in value.split(',') if name.strip()]
+    unknown = [name for name in fields if name not in FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown feed fields: {', '.join(unknown)}")
+    return fields
+
+
+def _cars(fields, chunk_size):
+    qs = Car.objects.filter(sold=False).select_related('brand', 'model_name').order_by('pk')
+    # Only pay for the relations the projection asks for
+    if 'equipment' in fields:
+        qs = qs.prefetch_related('equipment')
+    if 'images' in fields:
+        qs = qs.prefetch_related('images')
+    return qs.iterator(chunk_size=chunk_size)
+
+
+def iter_records(fields, language='mk', absolute=lambda path: path, chunk_size=CHUNK_SIZE):
+    """Yield one dict per available car with the requested fields."""
+    extractors = [(name, FIELDS[name]) for name in fields]
+    for car in _cars(fields, chunk_size):
+        yield {name: extract(car, language, absolute) for name, extract in extractors}
+
+
+def iter_json(records):
+    """A JSON array, one car per line."""
+    yield '[\n'
+    separator = ''
+    for record in records:
+        yield separator + json.dumps(record, ensure_ascii=False)
+        separator = ',\n'
+    yield '\n]\n'
+
+
+class _Echo:
+    """File-like object whose write() returns the line instead of storing it."""
+
+    def write(self, value):
+        return value
+
+
+def iter_csv(records, fields):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(fields)
+    for record in records:
+        yield writer.writerow([
+            CSV_LIST_SEPARATOR.join(str(v) for v in value) if isinstance(value, list) else value
+            for value in (record[name] for name in fields)
+        ])
+
+
+def iter_feed(fmt, fields, language='mk', absolute=lambda path: path, chunk_size=CHUNK_SIZE):
+    """Yield the feed as text chunks in `fmt` ('json' or 'csv')."""
+    records = iter_records(fields, language, absolute, chunk_size)
+    if fmt == 'csv':
+        return iter_csv(records, fields)
+    return iter_json(records)
@@ -0,0 +1,43 @@
+import time
+
+from django.core.management.base import BaseCommand
+from dealership_app.models import Car, CarImage, record_image
+
+
+class Command(BaseCommand):
+    help = "Record the byte size, dimensions and SHA-256 of stored car images that predate those columns"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help='Measure every image again, not only the unrecorded ones')
+
+    def handle(self, *args, **options):
+        targets = []
+        for model, field_name in ((Car, 'main_image'), (CarImage, 'image')):
+            queryset = model.objects.exclude(**{field_name: ''})
+            if not options['all']:
+                queryset = queryset.filter(**{f'{field_name}_hash': ''})
+            targets.append((queryset.only('pk', field_name).order_by('pk'), field_name))
+        total = sum(queryset.count() for queryset, _ in targets)
+        if not total:
+            self.stdout.write(self.style.SUCCESS("✅ Every image is already recorded."))
+            return
+
+        done = failed = stored = 0
+        started = time.monotonic()
+        for queryset, field_name in targets:
+            for instance in queryset.iterator(chunk_size=500):
+                try:
+                    record_image(instance, field_name)
+                    stored += getattr(instance, f'{field_name}_size')
+                except Exception as exc:
+                    failed += 1
+                    self.stderr.write(f"{queryset.model.__name__} {instance.pk}: {exc}")
+                done += 1
+                if done % 100 == 0:
+                    self.stdout.write(f"{done}/{total} images ({done * 100 // total}%)")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ Recorded {done - failed} images ({stored / (1024 * 1024):.1f}MB), {failed} failed "
+            f"in {time.monotonic() - started:.1f}s."
+        ))
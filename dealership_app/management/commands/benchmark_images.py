@@ -0,0 +1,104 @@
+import json
+import multiprocessing
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from dealership_app import image_benchmark
+
+
+class Command(BaseCommand):
+    help = (
+        "Time the Car and CarImage image pipelines on generated photos (images/s, p95, peak RSS, output bytes) "
+        "and compare them with the stored baseline"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=5,
+                            help='Runs per case (default: 5)')
+        parser.add_argument('--case', action='append', dest='cases',
+                            help='Only cases whose name contains this, e.g. car_image or 6000x4000 (repeatable)')
+        parser.add_argument('--baseline', default=image_benchmark.BASELINE,
+                            help='Baseline file to compare with or save to')
+        parser.add_argument('--save-baseline', action='store_true',
+                            help='Store these results as the new baseline')
+        parser.add_argument('--tolerance', type=float, default=0.2,
+                            help='Relative slowdown or memory growth reported as a regression (default: 0.2)')
+        parser.add_argument('--check', action='store_true',
+                            help='Fail when a case regressed against the baseline')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        results = {}
+        with tempfile.TemporaryDirectory(prefix='image-benchmark-') as directory:
+            cases = [
+                (image_benchmark.case_name(pipeline, *photo), pipeline, photo)
+                for pipeline in image_benchmark.PIPELINES
+                for photo in image_benchmark.CORPUS
+            ]
+            if options['cases']:
+                cases = [case for case in cases if any(part in case[0] for part in options['cases'])]
+            if not cases:
+                raise CommandError("No case matches --case.")
+            self.stdout.write("Generating the test photos...")
+            corpus = image_benchmark.write_corpus(directory, {photo for _, _, photo in cases})
+
+            # One case at a time, each in a process of its own so its peak RSS is its own
+            with ProcessPoolExecutor(
+                max_workers=1,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=django.setup,
+                max_tasks_per_child=1,
+            ) as pool:
+                futures = [(name, pool.submit(image_benchmark.run_case, pipeline, corpus[photo], options['repeat']))
+                           for name, pipeline, photo in cases]
+                self.stdout.write(f"{'case':<26} {'upload':>8} {'images/s':>9} {'p95 ms':>8} "
+                                  f"{'peak RSS':>9} {'output':>8}  slowest stages")
+                for name, future in futures:
+                    metrics = results[name] = future.result()
+                    slowest = sorted(metrics['stages_ms'].items(), key=lambda item: -item[1])[:3]
+                    self.stdout.write(
+                        f"{name:<26} {metrics['upload_bytes'] / 1024:>7.0f}K {metrics['images_per_s']:>9.2f} "
+                        f"{metrics['p95_ms']:>8.0f} {metrics['peak_rss_mb']:>8.0f}M "
+                        f"{metrics['output_bytes'] / 1024:>7.0f}K  "
+                        + ', '.join(f"{stage} {ms:.0f}ms" for stage, ms in slowest)
+                    )
+
+        environment = image_benchmark.environment()
+        regressions = self._compare(results, options, environment)
+
+        if options['save_baseline']:
+            with open(options['baseline'], 'w') as fh:
+                json.dump({'environment': environment, 'repeat': options['repeat'], 'cases': results},
+                          fh, indent=2, sort_keys=True)
+                fh.write('\n')
+            self.stdout.write(f"Baseline saved to {options['baseline']}.")
+
+        if options['check'] and regressions:
+            raise CommandError(f"{regressions} metrics regressed against the baseline.")
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ Benchmarked {len(results)} cases, {regressions} regressions, "
+            f"in {time.monotonic() - started:.1f}s."
+        ))
+
+    def _compare(self, results, options, environment):
+        try:
+            with open(options['baseline']) as fh:
+                baseline = json.load(fh)
+        except FileNotFoundError:
+            self.stdout.write("No baseline to compare with.")
+            return 0
+        if baseline.get('environment') != environment:
+            self.stdout.write(self.style.WARNING(
+                f"The baseline was taken on {baseline.get('environment')}; times are only comparable on the same setup."
+            ))
+        rows = image_benchmark.compare(results, baseline, options['tolerance'])
+        changed = [row for row in rows if row[5] or abs(row[4]) > options['tolerance']]
+        for case, metric, old, new, change, regressed in changed:
+            line = f"{case:<26} {metric:<13} {old:>12} -> {new:<12} ({change:+.0%})"
+            self.stdout.write(self.style.ERROR(f"REGRESSED {line}") if regressed else f"improved  {line}")
+        if rows and not changed:
+            self.stdout.write(f"Every metric within {options['tolerance']:.0%} of the baseline.")
+        return sum(1 for row in rows if row[5])
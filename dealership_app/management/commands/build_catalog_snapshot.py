@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from dealership_app import catalog_snapshot
+
+
+class Command(BaseCommand):
+    help = "Rebuild the columnar catalog snapshot used by the vehicle listing"
+
+    def handle(self, *args, **kwargs):
+        rows = catalog_snapshot.build_snapshot()
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"✅ Snapshot written to {catalog_snapshot.snapshot_path()} ({rows} cars)."
+            )
+        )
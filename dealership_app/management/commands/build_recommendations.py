@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from dealership_app import recommendations
+
+
+class Command(BaseCommand):
+    help = "Recompute the precomputed similar-car recommendations for every car"
+
+    def handle(self, *args, **kwargs):
+        cars = recommendations.rebuild_recommendations()
+        self.stdout.write(
+            self.style.SUCCESS(f"✅ Recommendations rebuilt for {cars} cars (top {recommendations.TOP_K} each).")
+        )
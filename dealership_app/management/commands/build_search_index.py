@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from dealership_app import search_index
+
+
+class Command(BaseCommand):
+    help = "Rebuild the admin search index for every car"
+
+    def handle(self, *args, **kwargs):
+        cars = search_index.index_cars()
+        self.stdout.write(self.style.SUCCESS(f"✅ Search index rebuilt for {cars} cars."))
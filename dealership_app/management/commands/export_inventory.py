@@ -0,0 +1,49 @@
+import gzip
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from dealership_app import inventory_feed as feed
+
+
+class Command(BaseCommand):
+    help = "Export every available car as a JSON or CSV inventory feed"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=feed.FORMATS, default='json')
+        parser.add_argument('--fields', default='', help="Comma-separated fields to include (default: all)")
+        parser.add_argument('--lang', choices=['mk', 'en'], default='mk', help="Language of the *_label fields")
+        parser.add_argument('--base-url', default='', help="Prefix for image and detail URLs, e.g. https://example.com")
+        parser.add_argument('--output', '-o', default='-', help="Output file ('-' for stdout)")
+        parser.add_argument('--gzip', action='store_true', help="Gzip the output")
+        parser.add_argument('--chunk-size', type=int, default=feed.CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        try:
+            fields = feed.parse_fields(options['fields'])
+        except ValueError as e:
+            raise CommandError(e)
+
+        base_url = options['base_url'].rstrip('/')
+        chunks = feed.iter_feed(
+            options['format'], fields, options['lang'],
+            absolute=lambda path: base_url + path,
+            chunk_size=options['chunk_size'],
+        )
+
+        output = options['output']
+        if output == '-':
+            stream = gzip.open(sys.stdout.buffer, 'wt', encoding='utf-8') if options['gzip'] else sys.stdout
+        elif options['gzip']:
+            stream = gzip.open(output, 'wt', encoding='utf-8', newline='')
+        else:
+            stream = open(output, 'w', encoding='utf-8', newline='')
+
+        try:
+            for chunk in chunks:
+                stream.write(chunk)
+        finally:
+            if stream is not sys.stdout:
+                stream.close()
+
+        if output != '-':
+            self.stderr.write(self.style.SUCCESS(f"✅ Inventory written to {output}."))
@@ -1,5 +1,6 @@
 import json
 from django.core.management.base import BaseCommand
+from django.db import transaction
 from dealership_app.models import CarBrand, CarModel
 
 
@@ -18,21 +19,24 @@ class Command(BaseCommand):
         brands_created = 0
         models_created = 0
 
-        for brand_name, models in cars_data.items():
-            # Create or get brand
-            brand, brand_created_flag = CarBrand.objects.get_or_create(name=brand_name)
-            if brand_created_flag:
-                brands_created += 1
-                self.stdout.write(f"✅ Created brand: {brand_name}")
+        # One transaction: the brand/model signals bump the catalog version (and so
+        # invalidate the cached model map) only after the whole import is in
+        with transaction.atomic():
+            for brand_name, models in cars_data.items():
+                # Create or get brand
+                brand, brand_created_flag = CarBrand.objects.get_or_create(name=brand_name)
+                if brand_created_flag:
+                    brands_created += 1
+                    self.stdout.write(f"✅ Created brand: {brand_name}")
 
-            # Create models for this brand
-            for model_name in models:
-                model, model_created_flag = CarModel.objects.get_or_create(
-                    brand=brand, 
-                    name=model_name
-                )
-                if model_created_flag:
-                    models_created += 1
+                # Create models for this brand
+                for model_name in models:
+                    model, model_created_flag = CarModel.objects.get_or_create(
+                        brand=brand, 
+                        name=model_name
+                    )
+                    if model_created_flag:
+                        models_created += 1
 
         self.stdout.write(
             self.style.SUCCESS(
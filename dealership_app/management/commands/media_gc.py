@@ -0,0 +1,96 @@
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from dealership_app.image_specs import stored_names
+from dealership_app.models import Car, CarImage
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete files under MEDIA_ROOT that no car refers to: originals of deleted or replaced images, "
+        "failed uploads, and ImageKit cache files and srcset copies of images that are gone or were re-encoded"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only report what would be deleted')
+        parser.add_argument('--min-age', type=float, default=24,
+                            help='Leave files modified less than this many hours ago (default: 24), '
+                                 'such as uploads and versions still being written')
+
+    def _referenced(self):
+        """Names of every file a Car or CarImage row refers to right now."""
+        referenced = set()
+        for model, field_name in ((Car, 'main_image'), (CarImage, 'image')):
+            rows = model.objects.exclude(**{field_name: ''}).only('pk', field_name, 'spec_encodings')
+            for instance in rows.iterator(chunk_size=500):
+                referenced.update(stored_names(instance))
+        return referenced
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        referenced = self._referenced()
+        self.stdout.write(f"{len(referenced)} files referenced by the database.")
+
+        root = settings.MEDIA_ROOT
+        cutoff = time.time() - options['min_age'] * 3600
+        scanned = scanned_bytes = 0
+        orphans = []
+        directories = []
+        pending = [root]
+        while pending:
+            directory = pending.pop()
+            directories.append(directory)
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        pending.append(entry.path)
+                        continue
+                    stat = entry.stat(follow_symlinks=False)
+                    scanned += 1
+                    scanned_bytes += stat.st_size
+                    name = os.path.relpath(entry.path, root).replace(os.sep, '/')
+                    if name not in referenced and stat.st_mtime < cutoff:
+                        orphans.append((entry.path, name, stat.st_size))
+
+        # A re-upload of the same photo adopts its old content-addressed files
+        # (see image_store.py), so rows saved during the scan may name some
+        # of the candidates: look again just before deleting
+        if orphans and not options['dry_run']:
+            referenced = self._referenced()
+            orphans = [orphan for orphan in orphans if orphan[1] not in referenced]
+
+        freed = failed = 0
+        by_area = {}
+        for path, name, size in orphans:
+            if options['verbosity'] > 1:
+                self.stdout.write(f"  {name} ({size / 1024:.0f}KB)")
+            if not options['dry_run']:
+                try:
+                    os.remove(path)
+                except OSError as exc:
+                    failed += 1
+                    self.stderr.write(f"{name}: {exc}")
+                    continue
+            freed += size
+            area = '/'.join(name.split('/')[:2])
+            by_area[area] = by_area.get(area, 0) + size
+
+        # Folders left empty, deepest first; MEDIA_ROOT itself stays
+        if not options['dry_run']:
+            for directory in reversed(directories[1:]):
+                try:
+                    os.rmdir(directory)
+                except OSError:
+                    pass  # not empty
+
+        for area, size in sorted(by_area.items(), key=lambda item: -item[1]):
+            self.stdout.write(f"  {area}/: {size / (1024 * 1024):.1f}MB")
+        verb = "Would free" if options['dry_run'] else "Freed"
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ {verb} {freed / (1024 * 1024):.1f}MB of {scanned_bytes / (1024 * 1024):.1f}MB: "
+            f"{len(orphans) - failed} of {scanned} files unreferenced, {failed} failed "
+            f"in {time.monotonic() - started:.1f}s."
+        ))
@@ -0,0 +1,101 @@
+import multiprocessing
+import os
+import signal
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from dealership_app import image_jobs
+
+
+class Command(BaseCommand):
+    help = "Run queued jobs (uploaded car images, image versions, similar cars) in a pool of worker processes"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=max(1, (os.cpu_count() or 2) - 1),
+                            help='Worker processes (default: CPU count - 1)')
+        parser.add_argument('--poll', type=float, default=2.0,
+                            help='Seconds to wait between queue checks when idle')
+        parser.add_argument('--once', action='store_true',
+                            help='Exit when the queue is empty instead of waiting for new jobs')
+        parser.add_argument('--max-tasks-per-child', type=int, default=100,
+                            help='Restart a worker process after this many jobs (bounds memory growth)')
+
+    def handle(self, *args, **options):
+        self.stopping = False
+        signal.signal(signal.SIGTERM, self._stop)
+        self.counts = {'done': 0, 'pending': 0, 'failed': 0}
+
+        recovered = image_jobs.recover_stale()
+        if recovered:
+            self.stdout.write(f"↩️  Requeued {recovered} job(s) left behind by a stopped worker")
+
+        # A crashed worker process breaks the pool; its jobs are retried in a new one
+        while not self.stopping:
+            if self._run_pool(options):
+                break
+
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ Image jobs: {self.counts['done']} done, {self.counts['pending']} to retry, "
+            f"{self.counts['failed']} failed."
+        ))
+
+    def _stop(self, signum, frame):
+        self.stdout.write("Stopping after the running jobs...")
+        self.stopping = True
+
+    def _record(self, job_id, error):
+        status = image_jobs.finish(job_id, error)
+        if status in self.counts:
+            self.counts[status] += 1
+        if error:
+            self.stderr.write(f"Job {job_id} → {status}: {error.strip().splitlines()[-1]}")
+
+    def _run_pool(self, options):
+        """Run jobs until stopped (or the queue is empty with --once). False if the pool broke."""
+        workers = options['workers']
+        pool = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            # Spawned processes start without Django; this module must not be
+            # what sets it up, since unpickling it would import the models first
+            initializer=django.setup,
+            max_tasks_per_child=options['max_tasks_per_child'],
+        )
+        running = {}
+        last_recovery = time.monotonic()
+        try:
+            while True:
+                close_old_connections()
+                if not self.stopping and len(running) < workers:
+                    for job_id in image_jobs.claim(workers - len(running)):
+                        running[pool.submit(image_jobs.run_job, job_id)] = job_id
+
+                if not running:
+                    if self.stopping or options['once']:
+                        return True
+                    time.sleep(options['poll'])
+                    if time.monotonic() - last_recovery > image_jobs.STALE_AFTER:
+                        image_jobs.recover_stale()
+                        last_recovery = time.monotonic()
+                    continue
+
+                done, _ = wait(running, timeout=options['poll'], return_when=FIRST_COMPLETED)
+                for future in done:
+                    job_id = running.pop(future)
+                    try:
+                        error = future.result()
+                    except BrokenProcessPool:
+                        # A worker process died (e.g. killed for memory) and took the pool down
+                        for job_id in [job_id, *running.values()]:
+                            self._record(job_id, 'Worker process died while running the job')
+                        return False
+                    self._record(job_id, error)
+        except KeyboardInterrupt:
+            image_jobs.release(running.values())
+            raise
+        finally:
+            pool.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,155 @@
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from dealership_app import image_specs
+from dealership_app.models import Car, CarImage
+
+
+MODELS = {'car': (Car, 'main_image', 'id'), 'car_image': (CarImage, 'image', 'car_id')}
+
+
+class Command(BaseCommand):
+    help = (
+        "Re-encode the resized versions, srcset copies and placeholders of car images after their settings "
+        "changed, in a pool of worker processes; an interrupted run resumes from its checkpoint"
+    )
+
+    def add_arguments(self, parser):
+        outputs = sorted({name for model, _, _ in MODELS.values() for name in image_specs.output_names(model)})
+        parser.add_argument('--spec', action='append', choices=outputs, dest='specs',
+                            help='Only this spec, or ladder/placeholder (repeatable; default: everything)')
+        parser.add_argument('--min-car-id', type=int, help='Only cars with this ID or higher')
+        parser.add_argument('--max-car-id', type=int, help='Only cars with this ID or lower')
+        parser.add_argument('--since', type=date.fromisoformat, help='Only cars added on or after YYYY-MM-DD')
+        parser.add_argument('--until', type=date.fromisoformat, help='Only cars added on or before YYYY-MM-DD')
+        parser.add_argument('--workers', type=int, default=max(1, (os.cpu_count() or 2) - 1),
+                            help='Worker processes (default: CPU count - 1)')
+        parser.add_argument('--batch-size', type=int, default=50,
+                            help='Rows handed to a worker at a time')
+        parser.add_argument('--checkpoint', default=os.path.join(settings.BASE_DIR, 'tmp', 'regenerate_images.json'),
+                            help='File recording the rows done, to resume an interrupted run')
+        parser.add_argument('--restart', action='store_true',
+                            help='Ignore an existing checkpoint and regenerate every selected row')
+
+    def handle(self, *args, **options):
+        # What the checkpoint was made for, as it reads back from JSON
+        params = {
+            'specs': sorted(options['specs'] or []),
+            'min_car_id': options['min_car_id'],
+            'max_car_id': options['max_car_id'],
+            'since': options['since'] and options['since'].isoformat(),
+            'until': options['until'] and options['until'].isoformat(),
+        }
+        done = self._load_checkpoint(options['checkpoint'], params, options['restart'])
+
+        size = options['batch_size']
+        batches = []
+        for name, (model, field_name, car_field) in MODELS.items():
+            outputs = image_specs.output_names(model)
+            if options['specs']:
+                outputs = [output for output in outputs if output in options['specs']]
+                if not outputs:
+                    continue
+            finished = set(done[name])
+            ids = [pk for pk in image_specs.distinct_sources(self._rows(model, field_name, car_field, options))
+                   if pk not in finished]
+            batches += [(name, ids[start:start + size], outputs) for start in range(0, len(ids), size)]
+        total = sum(len(ids) for _, ids, _ in batches)
+        resumed = sum(len(pks) for pks in done.values())
+        if resumed:
+            self.stdout.write(f"Resuming: {resumed} images already regenerated.")
+        if not total:
+            self._remove_checkpoint(options['checkpoint'])
+            self.stdout.write(self.style.SUCCESS("✅ No images to regenerate."))
+            return
+
+        rows = written = failed = 0
+        started = time.monotonic()
+        with ProcessPoolExecutor(
+            max_workers=options['workers'],
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=django.setup,
+        ) as pool:
+            futures = {
+                pool.submit(image_specs.warm, name, ids, True, outputs): (name, ids)
+                for name, ids, outputs in batches
+            }
+            for future in as_completed(futures):
+                name, ids = futures[future]
+                try:
+                    batch_rows, batch_written, errors = future.result()
+                except Exception as exc:
+                    # The worker process died; the batch stays out of the checkpoint
+                    batch_rows, batch_written, errors = len(ids), 0, [(pk, f"{name} {pk}: {exc}") for pk in ids]
+                rows += batch_rows
+                written += batch_written
+                failed += len(errors)
+                for _, error in errors:
+                    self.stderr.write(error)
+                failed_pks = {pk for pk, _ in errors}
+                done[name].extend(pk for pk in ids if pk not in failed_pks)
+                self._save_checkpoint(options['checkpoint'], params, done)
+                elapsed = time.monotonic() - started
+                rate = rows / elapsed
+                self.stdout.write(
+                    f"{rows}/{total} images ({rows * 100 // total}%), {written} versions made, {failed} failed, "
+                    f"{rate:.1f} images/s, {(total - rows) / rate:.0f}s left"
+                )
+
+        # A run with failures keeps its checkpoint, so running it again retries only those
+        if not failed:
+            self._remove_checkpoint(options['checkpoint'])
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ Regenerated {rows - failed} images: {written} versions made, {failed} failed "
+            f"in {elapsed:.1f}s ({rows / elapsed:.1f} images/s)."
+        ))
+
+    def _rows(self, model, field_name, car_field, options):
+        queryset = model.objects.exclude(**{field_name: ''})
+        car = '' if car_field == 'id' else 'car__'
+        if options['min_car_id'] is not None:
+            queryset = queryset.filter(**{f'{car_field}__gte': options['min_car_id']})
+        if options['max_car_id'] is not None:
+            queryset = queryset.filter(**{f'{car_field}__lte': options['max_car_id']})
+        if options['since']:
+            queryset = queryset.filter(**{f'{car}created_at__date__gte': options['since']})
+        if options['until']:
+            queryset = queryset.filter(**{f'{car}created_at__date__lte': options['until']})
+        return queryset
+
+    def _load_checkpoint(self, path, params, restart):
+        done = {name: [] for name in MODELS}
+        if restart or not os.path.exists(path):
+            return done
+        with open(path) as fh:
+            checkpoint = json.load(fh)
+        if checkpoint['params'] != params:
+            raise CommandError(
+                f"{path} is the checkpoint of a run with other options ({checkpoint['params']}); "
+                f"repeat those to resume it, or pass --restart."
+            )
+        done.update(checkpoint['done'])
+        return done
+
+    def _save_checkpoint(self, path, params, done):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        # Replaced whole, so an interruption never leaves half a checkpoint
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.tmp')
+        with os.fdopen(fd, 'w') as fh:
+            json.dump({'params': params, 'done': done}, fh)
+        os.replace(tmp, path)
+
+    def _remove_checkpoint(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,17 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from dealership_app import image_resize
+
+
+class Command(BaseCommand):
+    help = "Delete the least recently served resized images until the cache is below IMAGE_RESIZE_CACHE_MAX_BYTES"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-bytes', type=int,
+                            help='Size limit to trim to (default: IMAGE_RESIZE_CACHE_MAX_BYTES)')
+
+    def handle(self, *args, **options):
+        freed = image_resize.trim(options['max_bytes'])
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ Freed {freed / (1024 * 1024):.1f}MB from {settings.IMAGE_RESIZE_CACHE_DIR}."
+        ))
@@ -0,0 +1,59 @@
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import django
+from django.core.management.base import BaseCommand
+from dealership_app import image_specs
+from dealership_app.models import Car, CarImage
+
+
+class Command(BaseCommand):
+    help = "Generate the missing resized versions (ImageKit specs) of every car image in a pool of worker processes"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=max(1, (os.cpu_count() or 2) - 1),
+                            help='Worker processes (default: CPU count - 1)')
+        parser.add_argument('--batch-size', type=int, default=50,
+                            help='Rows handed to a worker at a time')
+        parser.add_argument('--force', action='store_true',
+                            help='Regenerate versions that already exist')
+
+    def handle(self, *args, **options):
+        size = options['batch_size']
+        batches = []
+        for name, queryset in (('car', Car.objects.exclude(main_image='')),
+                               ('car_image', CarImage.objects.exclude(image=''))):
+            ids = image_specs.distinct_sources(queryset)
+            batches += [(name, ids[start:start + size]) for start in range(0, len(ids), size)]
+        total = sum(len(ids) for _, ids in batches)
+        if not total:
+            self.stdout.write(self.style.SUCCESS("✅ No images to warm."))
+            return
+
+        rows = written = failed = 0
+        started = time.monotonic()
+        with ProcessPoolExecutor(
+            max_workers=options['workers'],
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=django.setup,
+        ) as pool:
+            futures = [pool.submit(image_specs.warm, name, ids, options['force']) for name, ids in batches]
+            for future in as_completed(futures):
+                batch_rows, batch_written, errors = future.result()
+                rows += batch_rows
+                written += batch_written
+                failed += len(errors)
+                for _, error in errors:
+                    self.stderr.write(error)
+                elapsed = time.monotonic() - started
+                self.stdout.write(
+                    f"{rows}/{total} images ({rows * 100 // total}%), {written} versions written, "
+                    f"{rows / elapsed:.1f} images/s"
+                )
+
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ Warmed {rows} images: {written} versions written, {failed} failed "
+            f"in {time.monotonic() - started:.1f}s."
+        ))
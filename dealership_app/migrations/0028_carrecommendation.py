@@ -0,0 +1,28 @@
+# Generated by Django 5.1.7 on 2026-10-18 05:51
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dealership_app', '0027_car_show_promo_badge_car_show_registered_badge_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CarRecommendation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rank', models.PositiveSmallIntegerField()),
+                ('score', models.IntegerField()),
+                ('car', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recommendations', to='dealership_app.car')),
+                ('recommended', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recommended_for', to='dealership_app.car')),
+            ],
+            options={
+                'ordering': ['car', 'rank'],
+                'unique_together': {('car', 'rank')},
+            },
+        ),
+    ]
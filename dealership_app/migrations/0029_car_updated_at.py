@@ -0,0 +1,18 @@
+# Generated by Django 5.1.7 on 2026-10-18 05:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dealership_app', '0028_carrecommendation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='car',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, verbose_name='Ажурирано'),
+        ),
+    ]
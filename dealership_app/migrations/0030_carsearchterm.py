@@ -0,0 +1,58 @@
+# Generated by Django 5.1.7 on 2026-10-18 06:03
+
+import re
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+# Frozen copy of search_index.car_terms() as of this migration, so later
+# changes to the tokenizer cannot change what this step writes
+WEIGHTS = {'brand': 8, 'model': 8, 'title': 4, 'year': 4, 'description': 1}
+TERM_MAX_LENGTH = 64
+WORD = re.compile(r'\w+')
+
+
+def car_terms(title, brand, model, year, description):
+    terms = {}
+    fields = (('brand', brand), ('model', model), ('title', title), ('year', year), ('description', description))
+    for field, value in fields:
+        for word in WORD.findall(str(value or '').lower()):
+            term = word[:TERM_MAX_LENGTH]
+            terms[term] = max(terms.get(term, 0), WEIGHTS[field])
+    return terms
+
+
+def index_existing_cars(apps, schema_editor):
+    Car = apps.get_model('dealership_app', 'Car')
+    CarSearchTerm = apps.get_model('dealership_app', 'CarSearchTerm')
+    values = Car.objects.values_list('id', 'title', 'brand__name', 'model_name__name', 'year', 'description')
+    CarSearchTerm.objects.bulk_create(
+        (CarSearchTerm(car_id=car_id, term=term, weight=weight)
+         for car_id, *indexed in values.iterator()
+         for term, weight in car_terms(*indexed).items()),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dealership_app', '0029_car_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CarSearchTerm',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(db_index=True, max_length=64)),
+                ('weight', models.PositiveSmallIntegerField()),
+                ('car', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_terms', to='dealership_app.car')),
+            ],
+            options={
+                'unique_together': {('car', 'term')},
+            },
+        ),
+        migrations.RunPython(index_existing_cars, migrations.RunPython.noop),
+    ]
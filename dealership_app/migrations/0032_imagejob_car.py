@@ -0,0 +1,24 @@
+# Generated by Django 5.1.7 on 2026-10-18 06:17
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dealership_app', '0031_imagejob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='imagejob',
+            name='car',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='image_jobs', to='dealership_app.car'),
+        ),
+        migrations.AlterField(
+            model_name='imagejob',
+            name='task',
+            field=models.CharField(choices=[('car_image', 'Process uploaded car image'), ('car_image_specs', 'Generate car image versions'), ('car_specs', 'Generate main image versions')], max_length=30),
+        ),
+    ]
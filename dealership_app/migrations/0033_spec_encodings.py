@@ -0,0 +1,23 @@
+# Generated by Django 5.1.7 on 2026-10-18 06:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dealership_app', '0032_imagejob_car'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='car',
+            name='spec_encodings',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.AddField(
+            model_name='carimage',
+            name='spec_encodings',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
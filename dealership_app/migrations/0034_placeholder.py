@@ -0,0 +1,23 @@
+# Generated by Django 5.1.7 on 2026-10-18 06:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dealership_app', '0033_spec_encodings'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='car',
+            name='placeholder',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='carimage',
+            name='placeholder',
+            field=models.TextField(blank=True, editable=False),
+        ),
+    ]
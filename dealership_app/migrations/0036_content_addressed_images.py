@@ -0,0 +1,24 @@
+# Generated by Django 5.1.7 on 2026-10-18 06:39
+
+import dealership_app.image_store
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dealership_app', '0035_stored_image_metadata'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='car',
+            name='main_image',
+            field=dealership_app.image_store.ContentAddressedImageField(db_index=True, upload_to='cars/main_images/original/', verbose_name='Главна слика'),
+        ),
+        migrations.AlterField(
+            model_name='carimage',
+            name='image',
+            field=dealership_app.image_store.ContentAddressedImageField(db_index=True, upload_to='cars/extra_images/original/'),
+        ),
+    ]
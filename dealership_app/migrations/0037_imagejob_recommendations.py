@@ -0,0 +1,18 @@
+# Generated by Django 5.1.7 on 2026-10-18 07:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dealership_app', '0036_content_addressed_images'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='imagejob',
+            name='task',
+            field=models.CharField(choices=[('car_image', 'Process uploaded car image'), ('car_image_specs', 'Generate car image versions'), ('car_specs', 'Generate main image versions'), ('recommendations', 'Recompute similar cars')], max_length=30),
+        ),
+    ]
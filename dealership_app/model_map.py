@@ -0,0 +1,67 @@
+"""
+Brand -> models map for the model dropdowns.
+
+Built with two queries per catalog version and cached both as a dict and as
+its serialized JSON, so ajax_models / ajax_load_models answer from the cache
+and the search forms can embed or fetch the whole map once instead of asking
+the server on every brand change.
+"""
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .catalog_version import get_catalog_version
+from .models import Car, CarModel
+
+
+def _build(version):
+    available_ids = set(
+        Car.objects.filter(sold=False, model_name__isnull=False)
+        .order_by().values_list('model_name_id', flat=True).distinct()
+    )
+    all_models, available = {}, {}
+    for model_id, brand_id, name in CarModel.objects.order_by('name', 'id').values_list('id', 'brand_id', 'name'):
+        entry = {'id': model_id, 'name': name}
+        all_models.setdefault(str(brand_id), []).append(entry)
+        if model_id in available_ids:
+            available.setdefault(str(brand_id), []).append(entry)
+    return {'version': version, 'available': available, 'all': all_models}
+
+
+def _cached(version):
+    key = f'models:map:{version}'
+    cached = cache.get(key)
+    if cached is None:
+        model_map = _build(version)
+        cached = (model_map, json.dumps(model_map, ensure_ascii=False))
+        cache.set(key, cached, 24 * 60 * 60)
+    return cached
+
+
+def get_model_map():
+    """
+    {'version': catalog version,
+     'available': {brand id: [{'id', 'name'}]} (models with unsold cars),
+     'all': {brand id: [{'id', 'name'}]}} — brand ids are strings, as in JSON.
+    """
+    return _cached(get_catalog_version())[0]
+
+
+def model_map_json():
+    """get_model_map() already serialized."""
+    return _cached(get_catalog_version())[1]
+
+
+def models_for_brand(brand_id, available=True):
+    """[{'id', 'name'}] for a brand, ordered by name; [] for unknown brands."""
+    return get_model_map()['available' if available else 'all'].get(str(brand_id), [])
+
+
+def model_map_context():
+    """Template context for the search forms' model dropdown."""
+    model_map = get_model_map()
+    return {
+        'model_map_version': model_map['version'],
+        'model_map_inline': model_map['available'] if getattr(settings, 'MODEL_MAP_INLINE', True) else None,
+    }
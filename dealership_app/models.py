@@ -3,13 +3,87 @@ import os
 import io
 from PIL import Image
 from django.db import models
+from django.utils import timezone
 from django.core.files.base import ContentFile
-from imagekit.models import ImageSpecField, ProcessedImageField
+from imagekit.models import ImageSpecField
 from imagekit.processors import ResizeToFit, Thumbnail
 from pilkit.processors import Anchor
 from pilkit.processors.base import ProcessorPipeline
 
-
+from .image_pipeline import Ladder, Measured, Pipeline, Placeholder, Variant, measure
+from .image_store import ContentAddressedImageField
+
+
+# Stored originals and their versions, decoded once per image (see image_pipeline.py)
+# Widths of the WebP/AVIF copies offered to browsers through srcset
+SRCSET_WIDTHS = (320, 480, 640, 800, 1200)
+
+MAIN_IMAGE = Pipeline(
+    Variant([ResizeToFit(1200, 800)], options={'quality': 85}),  # Reduced max size for better performance
+    ladder=Ladder(SRCSET_WIDTHS),
+    placeholder=Placeholder(),
+    main_image_thumbnail=Variant([Thumbnail(250, 250)], options={'quality': 75}),
+    # Web display version, encoded at the best quality (up to 85) that fits 100 KB
+    main_image_web=Variant([ResizeToFit(800, 550)], options={'quality': 85, 'optimize': True}, max_bytes=100 * 1024),
+)
+
+CAR_IMAGE = Pipeline(
+    Variant([ResizeToFit(1200, 800)], options={'quality': 85}),  # Reduced max size for better compression
+    ladder=Ladder(SRCSET_WIDTHS),
+    placeholder=Placeholder(),
+    thumbnail=Variant([Thumbnail(150, 150)], options={'quality': 70}),  # smaller for faster loading
+    # Web display version (700x500 max), best quality (up to 85) that fits 80 KB
+    web_display=Variant([ResizeToFit(700, 500)], options={'quality': 85, 'optimize': True}, max_bytes=80 * 1024),
+)
+
+
+def set_image_columns(instance, field_name, measured):
+    """Set the <field>_size/_width/_height/_hash columns of `instance` from a Measured; returns their names."""
+    columns = {f'{field_name}_{key}': value for key, value in measured._asdict().items()}
+    for column, value in columns.items():
+        setattr(instance, column, value)
+    return list(columns)
+
+
+def record_image(instance, field_name):
+    """Measure the stored file of an image field and update its columns, on the instance and in its row."""
+    with getattr(instance, field_name).open('rb') as fh:
+        columns = set_image_columns(instance, field_name, measure(fh))
+    type(instance).objects.filter(pk=instance.pk).update(**{column: getattr(instance, column) for column in columns})
+
+
+def adopt_image(instance, field_name, **twins):
+    """
+    Copy the recorded columns, spec settings and placeholder of another row
+    storing the same (deduplicated) image file, filtered further by `twins`,
+    onto `instance`. Returns the names of the columns set; none when no such
+    row has them.
+    """
+    columns = [f'{field_name}_{key}' for key in Measured._fields] + ['spec_encodings', 'placeholder']
+    twin = (
+        type(instance).objects.filter(**{field_name: getattr(instance, field_name).name}, **twins)
+        .exclude(pk=instance.pk).exclude(**{f'{field_name}_hash': ''})
+        .values(*columns).first()
+    )
+    if twin is None:
+        return []
+    for column, value in twin.items():
+        setattr(instance, column, value)
+    return columns
+
+
+def release_image(file, derived=()):
+    """
+    Delete a stored image, and the `derived` file names made from it, once
+    no Car or CarImage refers to it; the rows naming a file are its
+    references (see image_store.py).
+    """
+    if not file:
+        return
+    if Car.objects.filter(main_image=file.name).exists() or CarImage.objects.filter(image=file.name).exists():
+        return
+    for name in (file.name, *derived):
+        file.storage.delete(name)
 
 
 class CarBrand(models.Model):
@@ -142,6 +216,9 @@ class Car(models.Model):
     engine_capacity = models.PositiveIntegerField("Кубикажа (cm³)", null=True, blank=True)
 
     kilowatts = models.PositiveIntegerField("Киловати")
+
+    # Upper kW limit for the "for beginners" filter on the vehicle list
+    BEGINNER_MAX_KW = 77
     price = models.PositiveIntegerField("Цена (во евра)")
     
     # Banner field - single choice selection
@@ -215,34 +292,35 @@ class Car(models.Model):
     equipment = models.ManyToManyField(CarEquipment, blank=True)
 
     # Main image with ImageKit processing
-    main_image = ProcessedImageField(
+    main_image = ContentAddressedImageField(
         upload_to='cars/main_images/original/',
-        processors=[ResizeToFit(1200, 800)],  # Reduced max size for better performance
-        format='JPEG',
-        options={'quality': 85},  # Balanced quality for main image
-        verbose_name="Главна слика"
+        verbose_name="Главна слика",
+        db_index=True,
+        **MAIN_IMAGE.original.field_kwargs()
     )
     
     # Main image thumbnail
-    main_image_thumbnail = ImageSpecField(
-        source='main_image',
-        processors=[Thumbnail(250, 250)],
-        format='JPEG',
-        options={'quality': 75}
-    )
+    main_image_thumbnail = ImageSpecField(source='main_image', **MAIN_IMAGE.spec('main_image_thumbnail'))
     
-    # Main image web display version (~500KB target)
-    main_image_web = ImageSpecField(
-        source='main_image',
-        processors=[ResizeToFit(800, 550)],  # Optimized size for main image
-        format='JPEG',
-        options={'quality': 65, 'progressive': True, 'optimize': True}  # Aggressive compression for 500KB target
-    )
+    # Main image web display version
+    main_image_web = ImageSpecField(source='main_image', **MAIN_IMAGE.spec('main_image_web'))
+
+    # Encoder settings each version was written with (quality, subsampling, bytes, ...)
+    spec_encodings = models.JSONField(default=dict, blank=True, editable=False)
+    # Blurred micro-thumbnail (data: URI) shown while the image loads
+    placeholder = models.TextField(blank=True, editable=False)
+
+    # The stored main image, recorded when it is saved, so the size limit is checked without touching storage
+    main_image_size = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    main_image_width = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    main_image_height = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    main_image_hash = models.CharField(max_length=64, blank=True, editable=False)
     
     # Position field for ordering cars
     position = models.PositiveIntegerField("Позиција", default=0, help_text="Позиција за подредување на возилата")
 
     created_at = models.DateTimeField("Креирано", auto_now_add=True)
+    updated_at = models.DateTimeField("Ажурирано", auto_now=True)
 
     @classmethod
     def get_fuel_choices(cls, language='mk'):
@@ -329,20 +407,15 @@ class Car(models.Model):
         return [img.image.url for img in self.images.all() if img.image]
     
     def delete(self, *args, **kwargs):
-        """Override delete to remove image files from filesystem"""
-        import os
-        
-        # Delete extra images
-        for img in self.images.all():
-            if img.image and os.path.isfile(img.image.path):
-                os.remove(img.image.path)
-        
-        # Delete main image
-        if self.main_image and os.path.isfile(self.main_image.path):
-            os.remove(self.main_image.path)
-        
+        """Override delete to remove image files no other car still uses"""
+        files = [self.main_image] + [img.image for img in self.images.all()]
+
         # Call the parent delete method
-        super().delete(*args, **kwargs)
+        result = super().delete(*args, **kwargs)
+
+        for file in files:
+            release_image(file)
+        return result
 
     @property
     def horsepower(self):
@@ -360,18 +433,25 @@ class Car(models.Model):
 
 
     def get_total_size(self):
-        """Calculate total size of car (main image + extra images)"""
-        total_size = 0
-        
-        # Add main image size
-        if self.main_image:
-            total_size += self.main_image.size
-            
-        # Add extra images sizes
-        for img in self.images.all():
-            if img.image:
-                total_size += img.image.size
-                
+        """Calculate total size of car (main image + extra images) from the recorded sizes"""
+        if self.main_image and (not self.main_image._committed or self.main_image_size is None):
+            # A new upload (not stored yet), or a car saved before sizes were recorded
+            total_size = self.main_image.size
+        else:
+            total_size = self.main_image_size or 0
+
+        # Add extra images sizes; uploads still queued for processing count once processed
+        queued = ImageJob.objects.filter(task='car_image', status__in=['pending', 'processing'])
+        images = self.images.exclude(pk__in=queued.values('car_image_id')).exclude(image='')
+        totals = images.aggregate(
+            size=models.Sum('image_size'),
+            unmeasured=models.Count('pk', filter=models.Q(image_size__isnull=True)),
+        )
+        total_size += totals['size'] or 0
+        # Images stored before sizes were recorded, until backfill_image_metadata has run
+        if totals['unmeasured']:
+            total_size += sum(img.image.size for img in images.filter(image_size__isnull=True))
+
         return total_size
     
     def clean(self):
@@ -393,8 +473,12 @@ class Car(models.Model):
 
     def save(self, *args, **kwargs):
         """Override save method - ImageKit handles compression automatically"""
-        # Run validation
-        self.clean()
+        update_fields = kwargs.get('update_fields')
+        new_image = bool(self.main_image) and not self.main_image._committed
+
+        # Run validation; only a new main image can change the total size
+        if update_fields is None or 'main_image' in update_fields:
+            self.clean()
 
         # If this car is being marked as exclusive, unmark any other exclusive cars
         if self.is_exclusive:
@@ -402,6 +486,14 @@ class Car(models.Model):
 
         super().save(*args, **kwargs)
 
+        # ImageKit has just stored the processed upload, or found it stored already
+        if new_image:
+            columns = adopt_image(self, 'main_image')
+            if columns:
+                Car.objects.filter(pk=self.pk).update(**{column: getattr(self, column) for column in columns})
+            else:
+                record_image(self, 'main_image')
+
     def __str__(self):
         return self.title
 
@@ -409,28 +501,17 @@ class CarImage(models.Model):
     car = models.ForeignKey(Car, on_delete=models.CASCADE, related_name="images")
     
     # Original image - will be processed automatically by ImageKit
-    image = ProcessedImageField(
+    image = ContentAddressedImageField(
         upload_to='cars/extra_images/original/',
-        processors=[ResizeToFit(1200, 800)],  # Reduced max size for better compression
-        format='JPEG',
-        options={'quality': 85}
+        db_index=True,
+        **CAR_IMAGE.original.field_kwargs()
     )
     
-    # Thumbnail version (150x150) - smaller for faster loading
-    thumbnail = ImageSpecField(
-        source='image',
-        processors=[Thumbnail(150, 150)],
-        format='JPEG',
-        options={'quality': 70}
-    )
+    # Thumbnail version (150x150)
+    thumbnail = ImageSpecField(source='image', **CAR_IMAGE.spec('thumbnail'))
     
-    # Web display version (700x500 max, ~500KB target)
-    web_display = ImageSpecField(
-        source='image',
-        processors=[ResizeToFit(700, 500)],
-        format='JPEG',
-        options={'quality': 60, 'progressive': True, 'optimize': True}  # Aggressive compression for 500KB target
-    )
+    # Web display version (700x500 max)
+    web_display = ImageSpecField(source='image', **CAR_IMAGE.spec('web_display'))
     
     position = models.PositiveIntegerField("Position", default=0)
     uploaded_at = models.DateTimeField(auto_now_add=True, null=True, blank=True)
@@ -444,33 +525,96 @@ class CarImage(models.Model):
         ],
         default='pending'
     )
+    # Encoder settings each version was written with (quality, subsampling, bytes, ...)
+    spec_encodings = models.JSONField(default=dict, blank=True, editable=False)
+    # Blurred micro-thumbnail (data: URI) shown while the image loads
+    placeholder = models.TextField(blank=True, editable=False)
+    # The stored image, recorded by the upload queue
+    image_size = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    image_width = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    image_height = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    image_hash = models.CharField(max_length=64, blank=True, editable=False)
 
     class Meta:
         ordering = ['position', 'id']
 
     def delete(self, *args, **kwargs):
-        """Override delete to remove image files from filesystem"""
-        import os
-        
-        # Delete the original image file
-        if self.image and os.path.isfile(self.image.path):
-            os.remove(self.image.path)
-            
-        # Delete generated thumbnails and web display versions if they exist
-        try:
-            if self.thumbnail and os.path.isfile(self.thumbnail.path):
-                os.remove(self.thumbnail.path)
-        except:
-            pass
-            
-        try:
-            if self.web_display and os.path.isfile(self.web_display.path):
-                os.remove(self.web_display.path)
-        except:
-            pass
-        
+        """Override delete to remove the image and its versions unless another car still uses them"""
+        versions = []
+        for spec in (self.thumbnail, self.web_display):
+            try:
+                versions.append(spec.name)
+            except Exception:
+                pass
+
         # Call the parent delete method
-        super().delete(*args, **kwargs)
+        result = super().delete(*args, **kwargs)
+
+        release_image(self.image, versions)
+        return result
 
     def __str__(self):
         return f"Image for {self.car.title}"
+
+
+
+class CarRecommendation(models.Model):
+    """Precomputed "similar cars" for a car, maintained by recommendations.py."""
+    car = models.ForeignKey(Car, on_delete=models.CASCADE, related_name="recommendations")
+    recommended = models.ForeignKey(Car, on_delete=models.CASCADE, related_name="recommended_for")
+    rank = models.PositiveSmallIntegerField()
+    score = models.IntegerField()
+
+    class Meta:
+        ordering = ['car', 'rank']
+        unique_together = ("car", "rank")
+
+    def __str__(self):
+        return f"{self.car_id} -> {self.recommended_id} (#{self.rank})"
+
+
+class CarSearchTerm(models.Model):
+    """One word of a car's indexed text (see search_index.py), maintained by signals."""
+    car = models.ForeignKey(Car, on_delete=models.CASCADE, related_name="search_terms")
+    term = models.CharField(max_length=64, db_index=True)
+    weight = models.PositiveSmallIntegerField()
+
+    class Meta:
+        unique_together = ("car", "term")
+
+    def __str__(self):
+        return f"{self.car_id}: {self.term} ({self.weight})"
+
+
+class ImageJob(models.Model):
+    """Queued image and similar-car work for the process_images worker (see image_jobs.py)."""
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('processing', 'Processing'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+    TASK_CHOICES = [
+        ('car_image', 'Process uploaded car image'),
+        ('car_image_specs', 'Generate car image versions'),
+        ('car_specs', 'Generate main image versions'),
+        ('recommendations', 'Recompute similar cars'),
+    ]
+
+    task = models.CharField(max_length=30, choices=TASK_CHOICES)
+    car = models.ForeignKey(Car, on_delete=models.CASCADE, null=True, blank=True, related_name="image_jobs")
+    car_image = models.ForeignKey(CarImage, on_delete=models.CASCADE, null=True, blank=True, related_name="jobs")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['run_after', 'id']
+        indexes = [models.Index(fields=['status', 'run_after'])]
+
+    def __str__(self):
+        return f"{self.task} #{self.pk} ({self.status})"
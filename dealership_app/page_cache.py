@@ -0,0 +1,99 @@
+"""
+Full-page cache for the public site.
+
+Pages are cached for anonymous visitors only, keyed by scheme, host,
+language, path, the normalized query string and the catalog version (see
+catalog_version.py), so any catalog write invalidates every cached page at
+once.  The site answers on more than one domain and pages carry absolute
+URLs (og:url), so a page is never served to another host than it was
+rendered for.
+
+The rendered CSRF tokens of the language-switch forms are swapped for a
+placeholder before storing and filled in with the visitor's own token on
+every hit; requests that have pending messages bypass the cache.
+"""
+import hashlib
+import re
+from functools import wraps
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.contrib import messages
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+from django.utils import translation
+
+from .catalog_version import get_catalog_version
+
+
+CSRF_PLACEHOLDER = b'__PAGE_CACHE_CSRF_TOKEN__'
+_CSRF_INPUT = re.compile(rb'(name="csrfmiddlewaretoken" value=")[^"]*(")')
+
+# Query parameters added by ad and social links; they never change the page
+IGNORED_PARAMS = ('utm_source', 'utm_medium', 'utm_campaign', 'utm_term', 'utm_content',
+                  'fbclid', 'gclid', 'msclkid')
+
+
+def _timeout():
+    return getattr(settings, 'PAGE_CACHE_TIMEOUT', 60 * 60 * 24)
+
+
+def _normalized_query(request):
+    params = sorted(
+        (name, value)
+        for name, values in request.GET.lists() if name not in IGNORED_PARAMS
+        for value in values
+    )
+    return urlencode(params)
+
+
+def shared_path(request):
+    """Path and query of `request` as every visitor sharing its cached page may see them."""
+    query = _normalized_query(request)
+    return f'{request.path}?{query}' if query else request.path
+
+
+def _cache_key(request):
+    query = hashlib.md5(_normalized_query(request).encode('utf-8')).hexdigest()
+    return (
+        f'page:{get_catalog_version()}:{request.scheme}:{request.get_host()}:'
+        f'{translation.get_language()}:{request.path}:{query}'
+    )
+
+
+def _cacheable_request(request):
+    return (
+        request.method in ('GET', 'HEAD')
+        and not request.user.is_authenticated
+        and not len(messages.get_messages(request))
+    )
+
+
+def cache_public_page(view):
+    """Serve `view` from the page cache for anonymous GET requests."""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        timeout = _timeout()
+        if not timeout or not _cacheable_request(request):
+            return view(request, *args, **kwargs)
+
+        key = _cache_key(request)
+        cached = cache.get(key)
+        if cached is not None:
+            content, content_type = cached
+            if CSRF_PLACEHOLDER in content:
+                content = content.replace(CSRF_PLACEHOLDER, get_token(request).encode('ascii'))
+            response = HttpResponse(content, content_type=content_type)
+            response['X-Page-Cache'] = 'hit'
+            return response
+
+        response = view(request, *args, **kwargs)
+        if response.status_code == 200 and not response.streaming and not response.cookies:
+            if hasattr(response, 'render') and not response.is_rendered:
+                response.render()
+            content = _CSRF_INPUT.sub(rb'\1' + CSRF_PLACEHOLDER + rb'\2', response.content)
+            cache.set(key, (content, response['Content-Type']), timeout)
+            response['X-Page-Cache'] = 'miss'
+        return response
+    return wrapper
@@ -0,0 +1,148 @@
+"""
+Keyset (cursor) pagination.
+
+Instead of OFFSET + COUNT(*), every page is fetched with a WHERE clause on the
+sort key of the last (or first) row already shown, so page N costs the same
+as page 1.  Cursors are signed tokens carrying that sort key; they are opaque
+to the browser and cannot be tampered with.
+"""
+from django.conf import settings
+from django.core import signing
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Q
+
+
+CURSOR_SALT = 'dealership_app.pagination.cursor'
+
+
+def keyset_enabled(request):
+    """Keyset mode is on for the whole site via LISTING_PAGINATION, or per request via ?cursor=."""
+    return getattr(settings, 'LISTING_PAGINATION', 'offset') == 'keyset' or 'cursor' in request.GET
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+class KeysetPage:
+    """Page of results; mirrors the parts of django.core.paginator.Page the templates use."""
+
+    is_keyset = True
+
+    def __init__(self, object_list, has_next, has_previous, next_cursor, previous_cursor):
+        self.object_list = object_list
+        self.has_next = has_next
+        self.has_previous = has_previous
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __bool__(self):
+        return bool(self.object_list)
+
+    def has_other_pages(self):
+        return self.has_next or self.has_previous
+
+
+class KeysetPaginator:
+    """
+    Paginate `queryset` by `ordering` (order_by() style field names).
+
+    The primary key is appended as a tie breaker, so every ordering is total.
+    Ordering fields must be non-nullable columns of the model itself or
+    annotations with JSON-serializable values (e.g. an integer score).
+    """
+
+    def __init__(self, queryset, ordering, per_page):
+        ordering = list(ordering)
+        if not any(f.lstrip('-') in ('pk', 'id') for f in ordering):
+            ordering.append('id')
+        self.queryset = queryset
+        self.ordering = ordering
+        self.per_page = per_page
+        self.fields = [f.lstrip('-') for f in ordering]
+
+    def _reversed(self):
+        return [f[1:] if f.startswith('-') else f'-{f}' for f in self.ordering]
+
+    def _after(self, ordering, values):
+        """Q matching rows strictly after `values` in `ordering`."""
+        condition = Q()
+        equal = Q()
+        for field, value in zip(ordering, values):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            condition |= equal & Q(**{f'{name}__{lookup}': value})
+            equal &= Q(**{name: value})
+        return condition
+
+    def _field(self, name):
+        try:
+            return self.queryset.model._meta.get_field(name)
+        except FieldDoesNotExist:
+            return None  # an annotation
+
+    def cursor(self, obj, direction):
+        """Signed cursor for the page after ('next') or before ('prev') `obj`."""
+        values = []
+        for name in self.fields:
+            field = self._field(name)
+            values.append(field.value_to_string(obj) if field else getattr(obj, name))
+        return signing.dumps({'o': self.ordering, 'd': direction, 'k': values},
+                             salt=CURSOR_SALT, compress=True)
+
+    def _decode(self, cursor):
+        if not cursor:
+            raise InvalidCursor(cursor)
+        try:
+            data = signing.loads(cursor, salt=CURSOR_SALT)
+        except signing.BadSignature:
+            raise InvalidCursor(cursor)
+        if data.get('o') != self.ordering or data.get('d') not in ('next', 'prev'):
+            raise InvalidCursor(cursor)
+        values = []
+        for name, value in zip(self.fields, data['k']):
+            field = self._field(name)
+            values.append(field.to_python(value) if field else value)
+        return data['d'], values
+
+    def decode(self, cursor):
+        """(direction, sort key values) of `cursor`, or (None, None) for a missing or invalid one."""
+        try:
+            return self._decode(cursor)
+        except (InvalidCursor, ValueError, TypeError):
+            return None, None
+
+    def get_page(self, cursor=None):
+        """Return the page after/before `cursor`; an invalid cursor gives the first page."""
+        direction, values = self.decode(cursor)
+
+        if direction == 'prev':
+            ordering = self._reversed()
+            qs = self.queryset.order_by(*ordering).filter(self._after(ordering, values))
+        else:
+            qs = self.queryset.order_by(*self.ordering)
+            if direction == 'next':
+                qs = qs.filter(self._after(self.ordering, values))
+
+        rows = list(qs[:self.per_page + 1])
+        more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if direction == 'prev':
+            rows.reverse()
+            has_next, has_previous = True, more
+        else:
+            has_next, has_previous = more, direction == 'next'
+
+        return KeysetPage(
+            rows,
+            has_next=has_next,
+            has_previous=has_previous,
+            next_cursor=self.cursor(rows[-1], 'next') if rows and has_next else None,
+            previous_cursor=self.cursor(rows[0], 'prev') if rows and has_previous else None,
+        )
@@ -0,0 +1,202 @@
+"""
+Precomputed "similar cars" for vehicle_detail.
+
+The best TOP_K neighbours of every car are stored in CarRecommendation.
+Candidates are unsold cars of the same model; when a model group has fewer
+than TOP_K other cars it is widened to the same brand, then to the same body
+type, with same-model cars always ranked first.  Scores are computed with
+numpy over the whole candidate pool at once, and a car change only recomputes
+the cars whose neighbour lists can change: the car, its model group and the
+cars recommending it right away, and the cars of its brand and body type
+that widen to it in the process_images worker (image_jobs.queue_recommendations),
+so a save never rescores most of the catalog in the request.
+"""
+import numpy as np
+from django.db import transaction
+from django.db.models import Count, Q
+
+from .models import Car, CarRecommendation
+
+
+TOP_K = 12
+
+# Keeps same-model cars above the ones added by widening
+SAME_MODEL_BONUS = 100
+
+_FIELDS = ['id', 'model_name_id', 'brand_id', 'body_type', 'fuel_type', 'transmission',
+           'price', 'year', 'kilowatts', 'position']
+
+
+class _Cars:
+    """Column arrays for a list of cars; categorical values become integer codes."""
+
+    def __init__(self, rows, codes):
+        def code(value):
+            return codes.setdefault(value, len(codes))
+
+        columns = list(zip(*rows)) if rows else [()] * len(_FIELDS)
+        data = dict(zip(_FIELDS, columns))
+        self.id = np.array(data['id'], dtype=np.int64)
+        # -1 stands for NULL
+        self.model = np.array([m or -1 for m in data['model_name_id']], dtype=np.int64)
+        self.brand = np.array([b or -1 for b in data['brand_id']], dtype=np.int64)
+        self.body = np.array([code(v) for v in data['body_type']], dtype=np.int64)
+        self.fuel = np.array([code(v) for v in data['fuel_type']], dtype=np.int64)
+        self.transmission = np.array([code(v) for v in data['transmission']], dtype=np.int64)
+        self.price = np.array(data['price'], dtype=np.float64)
+        self.year = np.array(data['year'], dtype=np.int64)
+        self.kilowatts = np.array(data['kilowatts'], dtype=np.int64)
+        self.position = np.array(data['position'], dtype=np.int64)
+
+    def __len__(self):
+        return len(self.id)
+
+
+def _load(queryset, codes):
+    return _Cars(list(queryset.values_list(*_FIELDS)), codes)
+
+
+def _candidates(cars, i, pool):
+    """Pool indexes recommended for car i: same model, widened while short of TOP_K."""
+    others = pool.id != cars.id[i]
+    mask = np.zeros(len(pool), dtype=bool)
+    if cars.model[i] >= 0:
+        mask |= others & (pool.model == cars.model[i])
+    if np.count_nonzero(mask) < TOP_K and cars.brand[i] >= 0:
+        mask |= others & (pool.brand == cars.brand[i])
+    if np.count_nonzero(mask) < TOP_K:
+        mask |= others & (pool.body == cars.body[i])
+    return np.flatnonzero(mask)
+
+
+def _scores(cars, i, pool, idx):
+    """Score pool[idx] against car i (same weights the detail page always used)."""
+    price = cars.price[i]
+    year = cars.year[i]
+    p = pool.price[idx]
+
+    score = np.where((pool.model[idx] == cars.model[i]) & (cars.model[i] >= 0), SAME_MODEL_BONUS, 0)
+    # Same brand (NULL == NULL counts, as before)
+    score += np.where(pool.brand[idx] == cars.brand[i], 50, 0)
+
+    # Similar price (±30%) = 25, otherwise up to 20 for being within 50%
+    diff = np.abs(p - price)
+    max_diff = price * 0.5
+    if max_diff:
+        near = np.where(diff <= max_diff,
+                        np.maximum(5, 20 - (diff / (max_diff / 15)).astype(np.int64)), 0)
+    else:
+        near = 0
+    score += np.where((p >= price * 0.7) & (p <= price * 1.3), 25, near)
+
+    score += np.where(pool.fuel[idx] == cars.fuel[i], 20, 0)
+    score += np.where(pool.body[idx] == cars.body[i], 15, 0)
+    score += np.where(pool.transmission[idx] == cars.transmission[i], 10, 0)
+
+    year_diff = np.abs(pool.year[idx] - year)
+    score += np.where(year_diff <= 3, np.maximum(2, 10 - year_diff * 2), 0)
+    score += np.where(np.abs(pool.kilowatts[idx] - cars.kilowatts[i]) <= 50, 5, 0)
+
+    # Newer cars and better (lower) positions get a small bonus
+    score += np.minimum(3, pool.year[idx] - 2020)
+    position = pool.position[idx]
+    score += np.select(
+        [position <= 5, position <= 10, position <= 15, position <= 20, position <= 30],
+        [10, 8, 6, 4, 2], 0)
+    return score
+
+
+def _top(cars, i, pool):
+    """[(car id, score)] of the best TOP_K candidates for car i, ties in listing order."""
+    idx = _candidates(cars, i, pool)
+    if not len(idx):
+        return []
+    scores = _scores(cars, i, pool, idx)
+    best = np.argsort(-scores, kind='stable')[:TOP_K]
+    return [(int(pool.id[idx[j]]), int(scores[j])) for j in best]
+
+
+def _pool(codes):
+    # Listing order, so equal scores keep the order the old view produced
+    return _load(Car.objects.filter(sold=False).order_by('position', '-created_at'), codes)
+
+
+def _store(cars, pool):
+    rows = [
+        CarRecommendation(car_id=int(cars.id[i]), recommended_id=car_id, rank=rank, score=score)
+        for i in range(len(cars))
+        for rank, (car_id, score) in enumerate(_top(cars, i, pool))
+    ]
+    with transaction.atomic():
+        CarRecommendation.objects.filter(car_id__in=cars.id.tolist()).delete()
+        CarRecommendation.objects.bulk_create(rows, batch_size=1000)
+    return len(rows)
+
+
+def rebuild_recommendations(batch_size=1000):
+    """Recompute the neighbours of every car (sold cars keep a detail page too)."""
+    codes = {}
+    pool = _pool(codes)
+    ids = list(Car.objects.order_by('pk').values_list('pk', flat=True))
+    for start in range(0, len(ids), batch_size):
+        _store(_load(Car.objects.filter(pk__in=ids[start:start + batch_size]), codes), pool)
+    return len(ids)
+
+
+def _affected_cars(car_ids, widened=False):
+    """
+    Cars whose neighbour lists can change when `car_ids` change: the cars,
+    the cars recommending them and their model groups, and with `widened`
+    the cars of their brands and body types whose model group is small
+    enough to widen to them.
+    """
+    changed = list(Car.objects.filter(pk__in=car_ids).values_list('model_name_id', 'brand_id', 'body_type'))
+    models = {model for model, _, _ in changed if model}
+    affected = (
+        Q(pk__in=car_ids)
+        | Q(pk__in=CarRecommendation.objects.filter(recommended_id__in=car_ids).values('car_id'))
+        | Q(model_name_id__in=models)
+    )
+    if widened:
+        brands = {brand for _, brand, _ in changed if brand}
+        bodies = {body for _, _, body in changed}
+        # Model groups big enough never widen to other models
+        big_models = (Car.objects.filter(sold=False).values('model_name_id')
+                      .annotate(n=Count('id')).filter(n__gt=TOP_K, model_name_id__isnull=False)
+                      .values('model_name_id'))
+        affected |= (Q(brand_id__in=brands) | Q(body_type__in=bodies)) & ~Q(model_name_id__in=big_models)
+    return Car.objects.filter(affected)
+
+
+def refresh_recommendations(car_ids, widened=False):
+    """
+    Recompute only the cars affected by a change to `car_ids`, the ones
+    widening to them as well with `widened` (see _affected_cars). Returns how many.
+    """
+    car_ids = list(car_ids)
+    codes = {}
+    cars = _load(_affected_cars(car_ids, widened), codes)
+    _store(cars, _pool(codes))
+    return len(cars)
+
+
+def recommended_cars(car, limit=None):
+    """Stored neighbours of `car` that are still for sale, best first."""
+    qs = (CarRecommendation.objects.filter(car=car, recommended__sold=False)
+          .select_related('recommended__brand', 'recommended__model_name'))
+    if limit is not None:
+        qs = qs[:limit]
+    cars = [row.recommended for row in qs]
+    if not cars:
+        # Not indexed yet (or every stored neighbour sold since): score on the fly
+        codes = {}
+        pool = _load(
+            Car.objects.filter(sold=False)
+            .filter(Q(model_name_id=car.model_name_id) | Q(brand_id=car.brand_id) | Q(body_type=car.body_type))
+            .order_by('position', '-created_at'),
+            codes,
+        )
+        ids = [car_id for car_id, _ in _top(_load(Car.objects.filter(pk=car.pk), codes), 0, pool)]
+        by_id = Car.objects.select_related('brand', 'model_name').in_bulk(ids)
+        cars = [by_id[car_id] for car_id in ids]
+    return cars if limit is None else cars[:limit]
@@ -0,0 +1,107 @@
+"""
+Inverted index for the admin car searches.
+
+Every car is split into lower-cased words from its title, brand, model, year
+and description, stored one row per (car, word) in CarSearchTerm with the
+weight of the field it came from.  A search looks each query word up as a
+term prefix - a range scan on the term index instead of leading-wildcard
+LIKEs across three joined tables - and ranks cars by the summed weights.
+Rows follow Car/CarBrand/CarModel saves (see signals.py); build_search_index
+rebuilds all of them.
+"""
+import re
+from functools import reduce
+from operator import or_
+
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Max, OuterRef, Q, Subquery, Value, When
+
+from .models import Car, CarSearchTerm
+
+
+# Weight of a term by the field it came from; a term in several fields keeps the highest
+WEIGHTS = {
+    'brand': 8,
+    'model': 8,
+    'title': 4,
+    'year': 4,
+    'description': 1,
+}
+
+TERM_MAX_LENGTH = CarSearchTerm._meta.get_field('term').max_length
+
+_WORD = re.compile(r'\w+')
+
+_VALUES = ['id', 'title', 'brand__name', 'model_name__name', 'year', 'description']
+
+
+def tokenize(text):
+    """Lower-cased words of `text` (any script), cut to the term column's length."""
+    return [word[:TERM_MAX_LENGTH] for word in _WORD.findall(str(text or '').lower())]
+
+
+def car_terms(title, brand, model, year, description):
+    """{term: weight} for one car's indexed values."""
+    terms = {}
+    fields = (('brand', brand), ('model', model), ('title', title), ('year', year), ('description', description))
+    for field, value in fields:
+        for term in tokenize(value):
+            terms[term] = max(terms.get(term, 0), WEIGHTS[field])
+    return terms
+
+
+def _rows(values):
+    for car_id, *indexed in values:
+        for term, weight in car_terms(*indexed).items():
+            yield CarSearchTerm(car_id=car_id, term=term, weight=weight)
+
+
+def index_cars(car_ids=None, batch_size=500):
+    """(Re)index `car_ids`, or every car when None. Returns the number of cars indexed."""
+    cars = Car.objects.order_by('pk')
+    if car_ids is not None:
+        car_ids = list(car_ids)
+        cars = cars.filter(pk__in=car_ids)
+    ids = list(cars.values_list('pk', flat=True))
+    with transaction.atomic():
+        stale = CarSearchTerm.objects.all() if car_ids is None else CarSearchTerm.objects.filter(car_id__in=car_ids)
+        stale.delete()
+        for start in range(0, len(ids), batch_size):
+            values = Car.objects.filter(pk__in=ids[start:start + batch_size]).values_list(*_VALUES)
+            CarSearchTerm.objects.bulk_create(_rows(values), batch_size=1000)
+    return len(ids)
+
+
+def _prefix(word):
+    # istartswith is a plain LIKE 'word%' on MySQL, which the term index can serve
+    return Q(term__istartswith=word)
+
+
+def search_cars(queryset, query):
+    """
+    Narrow `queryset` to cars matching every word of `query` (each as the
+    prefix of one of their terms) and annotate search_rank, higher is better.
+    A query without words returns `queryset` as is, with search_rank 0.
+    """
+    words = list(dict.fromkeys(tokenize(query)))
+    if not words:
+        return queryset.annotate(search_rank=Value(0, output_field=IntegerField()))
+
+    # Best weight per query word and car; a car needs all of them above 0
+    best = {
+        f'w{i}': Max(Case(When(_prefix(word), then=F('weight')), default=Value(0), output_field=IntegerField()))
+        for i, word in enumerate(words)
+    }
+    matches = (
+        CarSearchTerm.objects.filter(reduce(or_, map(_prefix, words)))
+        .values('car_id')
+        .annotate(**best)
+        .filter(**{f'{name}__gt': 0 for name in best})
+    )
+    rank = sum((F(name) for name in best), Value(0))
+    return queryset.filter(pk__in=matches.values('car_id')).annotate(
+        search_rank=Subquery(
+            matches.filter(car_id=OuterRef('pk')).annotate(rank=rank).values('rank')[:1],
+            output_field=IntegerField(),
+        )
+    )
@@ -0,0 +1,87 @@
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_save, post_delete, pre_delete
+from django.dispatch import receiver
+
+from . import catalog_snapshot, image_jobs, recommendations, search_index
+from .catalog_version import bump_catalog_version
+from .models import Car, CarBrand, CarEquipment, CarImage, CarModel, CarRecommendation
+
+
+def catalog_changed(car_ids=None, rescore=True):
+    """
+    Refresh data derived from the catalog once the current transaction commits.
+
+    Model signals call this for single rows; views that write through
+    bulk_update()/update() (which bypass signals) must call it themselves.
+    Pass None when the set of affected cars is unknown, and rescore=False
+    when nothing the recommendations are scored on changed.
+    """
+    car_ids = None if car_ids is None else list(car_ids)
+
+    def refresh():
+        bump_catalog_version()
+        if catalog_snapshot.is_enabled():
+            if car_ids is None:
+                catalog_snapshot.build_snapshot()
+            else:
+                catalog_snapshot.refresh_cars(car_ids)
+        if rescore:
+            if car_ids is None:
+                image_jobs.queue_recommendations()
+            else:
+                recommendations.refresh_recommendations(car_ids)
+                image_jobs.queue_recommendations(car_ids)
+
+    transaction.on_commit(refresh)
+
+
+@receiver([post_save, post_delete], sender=Car)
+def car_changed(sender, instance, **kwargs):
+    catalog_changed([instance.pk])
+
+
+@receiver(post_save, sender=Car)
+def car_saved(sender, instance, **kwargs):
+    # Deleted cars lose their search terms through the cascade
+    car_id = instance.pk
+    transaction.on_commit(lambda: search_index.index_cars([car_id]))
+
+
+@receiver(pre_delete, sender=Car)
+def car_deleting(sender, instance, **kwargs):
+    # The cascade drops the rows recommending this car; rescore the cars that had it
+    car_ids = list(CarRecommendation.objects.filter(recommended=instance).values_list('car_id', flat=True))
+    if car_ids:
+        transaction.on_commit(lambda: recommendations.refresh_recommendations(car_ids))
+
+
+@receiver([post_save, post_delete], sender=CarImage)
+def car_image_changed(sender, instance, **kwargs):
+    catalog_changed([instance.car_id], rescore=False)
+
+
+@receiver([post_save, post_delete], sender=CarBrand)
+@receiver([post_save, post_delete], sender=CarModel)
+@receiver([post_save, post_delete], sender=CarEquipment)
+def catalog_label_changed(sender, instance, **kwargs):
+    # Names shown in cached facets and pages; no car rows change
+    transaction.on_commit(bump_catalog_version)
+
+
+@receiver([post_save, pre_delete], sender=CarBrand)
+@receiver([post_save, pre_delete], sender=CarModel)
+def search_label_changed(sender, instance, **kwargs):
+    # Brand and model names are indexed with every car that has them;
+    # deleting one nulls the cars' foreign key without a Car signal
+    if kwargs.get('created'):
+        return
+    cars = Car.objects.filter(**{'brand' if sender is CarBrand else 'model_name': instance})
+    car_ids = list(cars.values_list('pk', flat=True))
+    if car_ids:
+        transaction.on_commit(lambda: search_index.index_cars(car_ids))
+
+
+@receiver(m2m_changed, sender=Car.equipment.through)
+def car_equipment_changed(sender, instance, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        transaction.on_commit(bump_catalog_version)
@@ -1,6 +1,8 @@
 from django import template
 import random
 
+from ..page_cache import shared_path
+
 register = template.Library()
 
 @register.simple_tag
@@ -9,4 +11,9 @@ def random_number(min_val, max_val):
     try:
         return random.randint(int(min_val), int(max_val))
     except (ValueError, TypeError):
-        return 1
\ No newline at end of file
+        return 1
+
+@register.filter
+def page_path(request):
+    """The path and query of a cached page, without the ad tracking parameters other visitors came with"""
+    return shared_path(request)
@@ -0,0 +1,104 @@
+from django import template
+from django.template.base import token_kwargs
+from django.utils.html import format_html, format_html_join
+
+from dealership_app.image_pipeline import Ladder
+from dealership_app.image_resize import resize_url
+
+register = template.Library()
+
+MIME_TYPES = {'AVIF': 'image/avif', 'WEBP': 'image/webp'}
+
+
+def _ladder(image):
+    """The srcset ladder recorded for the FieldFile `image`, or None when it is not built (yet)."""
+    if not image:
+        return None
+    ladder = getattr(image.instance, 'spec_encodings', {}).get('ladder')
+    # A new upload keeps the old record until the worker has built its ladder
+    if not ladder or ladder.get('source') != image.name:
+        return None
+    return ladder
+
+
+def _srcset(image, ladder, fmt):
+    return ', '.join(f"{image.storage.url(Ladder.name(image.name, width, fmt))} {width}w" for width in ladder['widths'])
+
+
+@register.simple_tag
+def srcset(image, fmt='WEBP'):
+    """srcset value listing the `fmt` copies of `image` (empty until they are built)"""
+    ladder = _ladder(image)
+    if not ladder or fmt.upper() not in ladder['formats']:
+        return ''
+    return _srcset(image, ladder, fmt.upper())
+
+
+@register.simple_tag
+def resized(image, width, height=None, fit='fit', fmt='webp'):
+    """Signed URL of `image` resized on request, e.g. {% resized car.main_image 400 300 'fill' %}"""
+    if not image:
+        return ''
+    return resize_url(image.name, int(width), int(height) if height else None, fit, fmt)
+
+
+@register.simple_tag
+def placeholder(image):
+    """
+    style attribute painting the placeholder of `image` as the background of
+    the <img> showing it, so its box is not empty while the image loads:
+    <img src="..." alt="..."{% placeholder car.main_image %}>. Empty until
+    the worker has made it for the current image.
+    """
+    if not image or getattr(image.instance, 'spec_encodings', {}).get('placeholder', {}).get('source') != image.name:
+        return ''
+    return format_html(
+        ' style="background-image: url({}); background-size: cover; background-position: center"',
+        image.instance.placeholder,
+    )
+
+
+class PictureNode(template.Node):
+    def __init__(self, image, sizes, nodelist):
+        self.image = image
+        self.sizes = sizes
+        self.nodelist = nodelist
+
+    def render(self, context):
+        img = self.nodelist.render(context)
+        image = self.image.resolve(context)
+        ladder = _ladder(image)
+        if not ladder:
+            return img
+        sizes = self.sizes.resolve(context) if self.sizes else '100vw'
+        sources = format_html_join(
+            '', '<source type="{}" srcset="{}" sizes="{}">',
+            ((MIME_TYPES.get(fmt, f'image/{fmt.lower()}'), _srcset(image, ladder, fmt), sizes)
+             for fmt in ladder['formats']),
+        )
+        # display: contents keeps the <img> styled and laid out as it was without the wrapper
+        return format_html('<picture style="display: contents">{}{}</picture>', sources, img)
+
+
+@register.tag
+def picture(parser, token):
+    """
+    Wrap an <img> in a <picture> offering the AVIF/WebP copies of an image
+    at every srcset width, so the browser fetches only the format and width
+    it needs; the <img> stays the fallback. Until the copies exist the <img>
+    is rendered alone.
+
+        {% picture car.main_image sizes="(max-width: 700px) 100vw, 400px" %}
+          <img src="{{ car.main_image_web.url }}" alt="{{ car.title }}">
+        {% endpicture %}
+    """
+    bits = token.split_contents()
+    if len(bits) < 2:
+        raise template.TemplateSyntaxError("'picture' takes the image field as its first argument")
+    image = parser.compile_filter(bits[1])
+    kwargs = token_kwargs(bits[2:], parser)
+    if len(kwargs) != len(bits) - 2 or set(kwargs) - {'sizes'}:
+        raise template.TemplateSyntaxError("'picture' only accepts a sizes=\"...\" argument")
+    nodelist = parser.parse(('endpicture',))
+    parser.delete_first_token()
+    return PictureNode(image, kwargs.get('sizes'), nodelist)
@@ -1,3 +1,1081 @@
-from django.test import TestCase
+import gc
+import hashlib
+import html
+import io
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import weakref
+from concurrent import futures
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from PIL import ExifTags, Image
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.template import Context, Template
+from django.test import RequestFactory, TestCase, override_settings
+from django.utils import timezone
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from . import catalog_snapshot, image_benchmark, image_jobs, image_pipeline, image_resize, image_specs, typeahead
+from .catalog_version import bump_catalog_version, get_catalog_version
+from .facets import FACETS, get_vehicle_facets
+from .frontend_views import _vehicle_queryset
+from .management.commands import media_gc
+from .models import (
+    CAR_IMAGE, MAIN_IMAGE, Car, CarBrand, CarEquipment, CarImage, CarModel, CarRecommendation, ImageJob,
+)
+from .recommendations import rebuild_recommendations
+from .search_index import car_terms, index_cars, search_cars
+from .signals import catalog_changed
+
+
+MEDIA_ROOT = tempfile.mkdtemp(prefix='dealership-tests-')
+# Tests never touch the project's file cache (catalog version, cached pages)
+CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+class _InlinePool(futures.Executor):
+    """Stands in for a process pool: spawned workers would not see the test database."""
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def submit(self, fn, *args):
+        future = futures.Future()
+        future.set_result(fn(*args))
+        return future
+
+
+def _jpeg(name='car.jpg', size=(64, 48), color=(120, 30, 30)):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, color).save(buffer, 'JPEG')
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/jpeg')
+
+
+@override_settings(
+    MEDIA_ROOT=MEDIA_ROOT,
+    PAGE_CACHE_TIMEOUT=0,
+    CATALOG_SNAPSHOT_ENABLED=False,
+    CACHES=CACHES,
+)
+class SeededCatalogTestCase(TestCase):
+    """
+    CARS cars (every seventh sold) over three brands of three models, each
+    with IMAGES_PER_CAR extra images and some equipment, and a staff user.
+    """
+
+    CARS = 30
+    IMAGES_PER_CAR = 2
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.equipment = [CarEquipment.objects.create(name=f'Equipment {i}') for i in range(5)]
+        brands = [CarBrand.objects.create(name=f'Brand {i}') for i in range(3)]
+        cls.models = [CarModel.objects.create(brand=brand, name=f'Model {brand.pk}-{i}')
+                      for brand in brands for i in range(3)]
+        cls._add_cars(range(cls.CARS))
+        cls.staff = User.objects.create_user('staff', password='x', is_staff=True)
+        cls.car = Car.objects.filter(sold=False).first()
+        cls.brand = brands[0]
+
+    @classmethod
+    def _add_cars(cls, numbers):
+        equipment, models = cls.equipment, cls.models
+        for i in numbers:
+            model = models[i % len(models)]
+            car = Car.objects.create(
+                brand=model.brand, model_name=model, title=f'Car {i}', year=2010 + i % 12,
+                fuel_type='diesel' if i % 2 else 'petrol', transmission='manual',
+                body_type='sedan', registration_type='mk', kilowatts=60 + i * 5,
+                price=5000 + i * 700, mileage=10000 * i, color='black', seats='5',
+                position=i, sold=(i % 7 == 0), main_image=_jpeg(),
+            )
+            car.equipment.set(equipment[:1 + i % len(equipment)])
+            for position in range(cls.IMAGES_PER_CAR):
+                CarImage.objects.create(car=car, image=_jpeg(f'extra{position}.jpg'), position=position)
+        rebuild_recommendations()
+        index_cars()
+
+    def setUp(self):
+        cache.clear()
+
+
+class QueryBudgetTests(SeededCatalogTestCase):
+    """
+    Render every public and admin view against a seeded catalog and fail when
+    it runs more queries than its budget.
+
+    Budgets are for a cold cache and must not depend on how many cars, images
+    or equipment items the catalog has: an N+1 anywhere blows them, and every
+    view must run the same queries for three times the cars.
+    """
+
+    # (url name, args, query string, staff, budget)
+    PUBLIC_BUDGETS = [
+        ('frontend_index', [], '', False, 5),
+        ('frontend_vehicles', [], '', False, 5),
+        ('frontend_vehicles', [], 'brand={brand}&sort_price=desc', False, 5),
+        ('frontend_vehicles', [], 'cursor=', False, 4),
+        ('frontend_vehicles', [], 'brand={brand}&fuel=electric', False, 5),
+        ('frontend_vehicle_detail', ['{car}'], '', False, 5),
+        ('frontend_about', [], '', False, 0),
+        ('ajax_models', [], 'brand={brand}', False, 2),
+        ('ajax_model_map', [], '', False, 2),
+        ('ajax_vehicles', [], '', False, 2),
+        ('ajax_typeahead', [], 'q=brand', False, 4),
+    ]
+    ADMIN_BUDGETS = [
+        ('admin_dashboard', [], '', True, 5),
+        ('admin_car_list', [], '', True, 5),
+        ('admin_car_list', [], 'sort=brand&status=available', True, 5),
+        ('admin_car_list', [], 'q=brand 1 car', True, 5),
+        ('admin_car_add', [], '', True, 4),
+        ('admin_car_edit', ['{car}'], '', True, 9),
+        ('admin_car_reorder', [], '', True, 3),
+        ('exclusive_car_management', [], '', True, 5),
+        ('exclusive_car_management', [], 'search=model', True, 5),
+        ('ajax_load_models', [], 'brand={brand}', True, 4),
+    ]
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def _url(self, name, args, query):
+        values = {'car': self.car.pk, 'brand': self.brand.pk}
+        url = reverse(name, args=[arg.format(**values) for arg in args])
+        return f'{url}?{query.format(**values)}' if query else url
+
+    def _queries(self, url, staff):
+        """The queries a cold-cache GET of `url` runs."""
+        if staff:
+            self.client.force_login(self.staff)
+        else:
+            self.client.logout()
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+            if hasattr(response, 'streaming_content'):
+                b''.join(response.streaming_content)
+        self.assertEqual(response.status_code, 200)
+        return queries
+
+    def _check(self, budgets):
+        for name, args, query, staff, budget in budgets:
+            url = self._url(name, args, query)
+            with self.subTest(url=url):
+                queries = self._queries(url, staff)
+                self.assertLessEqual(
+                    len(queries), budget,
+                    f'{url} ran {len(queries)} queries (budget {budget}):\n' +
+                    '\n'.join(q['sql'] for q in queries.captured_queries),
+                )
+
+    def _check_scaling(self, budgets, rebuild=lambda: None):
+        """Run `budgets` again after tripling the catalog; every view must run as many queries."""
+        urls = [(self._url(name, args, query), staff) for name, args, query, staff, _ in budgets]
+        before = {url: [q['sql'] for q in self._queries(url, staff).captured_queries] for url, staff in urls}
+        self._add_cars(range(self.CARS, 3 * self.CARS))
+        rebuild()
+        for url, staff in urls:
+            with self.subTest(url=url):
+                self.assertEqual(len(self._queries(url, staff)), len(before[url]),
+                                 f'{url} ran, for {self.CARS} cars:\n' + '\n'.join(before[url]))
+
+    def _enable_snapshot(self):
+        directory = tempfile.mkdtemp(prefix='dealership-snapshot-')
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        snapshot_override = self.settings(CATALOG_SNAPSHOT_ENABLED=True,
+                                          CATALOG_SNAPSHOT_PATH=os.path.join(directory, 'catalog.snapshot'))
+        snapshot_override.enable()
+        self.addCleanup(snapshot_override.disable)
+        catalog_snapshot.build_snapshot()
+
+    def test_public_views_within_budget(self):
+        self._check(self.PUBLIC_BUDGETS)
+
+    def test_admin_views_within_budget(self):
+        self._check(self.ADMIN_BUDGETS)
+
+    def test_query_counts_do_not_grow_with_the_catalog(self):
+        self._check_scaling(self.PUBLIC_BUDGETS + self.ADMIN_BUDGETS + [('inventory_feed', [], '', False, 3)])
+
+    def test_snapshot_listing_within_budget_at_any_catalog_size(self):
+        self._enable_snapshot()
+        listings = [budget for budget in self.PUBLIC_BUDGETS if budget[0] == 'frontend_vehicles']
+        self._check(listings)
+        self._check_scaling(listings, rebuild=catalog_snapshot.build_snapshot)
+
+    def test_inventory_feed_within_budget(self):
+        # One query for the cars plus one per prefetched relation, per chunk
+        self._check([('inventory_feed', [], '', False, 3)])
+
+
+class VehicleListTests(SeededCatalogTestCase):
+    def test_no_results_ranks_closest_matches_first(self):
+        # Nothing is electric, so every car satisfies at most the brand filter
+        response = self.client.get(reverse('frontend_vehicles'), {'brand': self.brand.pk, 'fuel': 'electric'})
+        self.assertTrue(response.context['no_results_fallback'])
+        self.assertEqual(response.context['results_count'], Car.objects.filter(sold=False).count())
+        brands = [car.brand_id for car in response.context['cars']]
+        in_brand = Car.objects.filter(sold=False, brand=self.brand).count()
+        self.assertEqual(brands[:in_brand], [self.brand.pk] * min(in_brand, len(brands)))
+
+
+class SearchIndexTests(SeededCatalogTestCase):
+    def test_search_matches_every_word_as_a_prefix(self):
+        for query in ['bra 0 201', 'model car 2', 'CAR 1', 'brand nonexistent']:
+            words = query.lower().split()
+            expected = {
+                car.pk for car in Car.objects.select_related('brand', 'model_name')
+                if all(any(term.startswith(word) for term in car_terms(
+                    car.title, car.brand.name, car.model_name.name, car.year, car.description)) for word in words)
+            }
+            with self.subTest(query=query):
+                found = search_cars(Car.objects.all(), query)
+                self.assertEqual(set(found.values_list('pk', flat=True)), expected)
+
+    def test_search_index_follows_renames(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.brand.name = 'Zastava'
+            self.brand.save()
+            self.car.title = 'Yugo Koral'
+            self.car.save()
+        self.assertEqual(search_cars(Car.objects.all(), 'zast').count(), Car.objects.filter(brand=self.brand).count())
+        self.assertEqual(list(search_cars(Car.objects.all(), 'yugo kor')), [self.car])
+
+
+class AdminCarListTests(SeededCatalogTestCase):
+    def test_admin_car_list_cursor_links_stay_in_keyset_mode(self):
+        self.client.force_login(self.staff)
+
+        def follow(href):
+            response = self.client.get(reverse('admin_car_list') + html.unescape(href))
+            self.assertTrue(response.context['cars'].is_keyset)
+            links = dict(re.findall(r'href="(\?[^"]*)">\s*<i class="fas fa-angle-(double-left|left|right)"', response.content.decode()))
+            return [car.pk for car in response.context['cars']], {icon: href for href, icon in links.items()}
+
+        # '&' must survive the round trip through the links, not split the query
+        first_page, links = follow('?q=brand+%26+car&cursor=')
+        self.assertEqual(len(first_page), 12)
+        second_page, links = follow(links['right'])
+        self.assertTrue(set(second_page).isdisjoint(first_page))
+        self.assertEqual(follow(links['left'])[0], first_page)
+        self.assertEqual(follow(links['double-left'])[0], first_page)
+
+
+class InventoryFeedTests(SeededCatalogTestCase):
+    def test_inventory_feed_gzip_follows_accept_encoding_qualities(self):
+        for accept_encoding, gzipped in [
+            ('gzip, deflate, br', True),
+            ('br;q=1.0, gzip;q=0.5', True),
+            ('*', True),
+            ('GZIP ; q=0.001', True),
+            ('gzip;q=0', False),
+            ('gzip;q=0.0, deflate', False),
+            ('*, gzip;q=0', False),
+            ('identity', False),
+            ('', False),
+        ]:
+            with self.subTest(accept_encoding=accept_encoding):
+                response = self.client.get(reverse('inventory_feed'), HTTP_ACCEPT_ENCODING=accept_encoding)
+                content = b''.join(response.streaming_content)
+                self.assertEqual(response.get('Content-Encoding') == 'gzip', gzipped)
+                if not gzipped:
+                    self.assertEqual(len(json.loads(content)), Car.objects.filter(sold=False).count())
+
+
+@override_settings(CACHES=CACHES)
+class FacetTests(TestCase):
+    # Facet name -> the Car column it counts
+    COLUMNS = {'brand': 'brand_id', 'model': 'model_name_id', 'transmission': 'transmission',
+               'body': 'body_type', 'fuel': 'fuel_type', 'color': 'color'}
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.models = []
+        for brand_name, model_names in [('Audi', ['A3', 'A4']), ('Skoda', ['Fabia', 'Octavia'])]:
+            brand = CarBrand.objects.create(name=brand_name)
+            cls.models += [CarModel.objects.create(brand=brand, name=name) for name in model_names]
+        for i in range(24):
+            model = cls.models[i % 4]
+            Car.objects.create(
+                brand=model.brand, model_name=model, title=f'Car {i}', year=2010 + i % 7,
+                fuel_type=('diesel', 'petrol')[i % 2], transmission=('manual', 'automatic')[i % 3 == 0],
+                body_type=('sedan', 'hatchback', 'suv')[i % 3], registration_type='mk',
+                kilowatts=60 + 10 * (i % 5), price=4000 + 1500 * (i % 9), mileage=1000 * i,
+                color=('black', 'white', 'red', 'grey')[i % 5 % 4], seats='5', sold=i % 11 == 0,
+            )
+
+    def setUp(self):
+        cache.clear()
+
+    def _filters(self, **applied):
+        filters = dict.fromkeys(['brand', 'model', 'transmission', 'body', 'fuel', 'color', 'beginners',
+                                 'price_from', 'price_to', 'year_from'])
+        filters.update(applied)
+        return filters
+
+    def test_counts_match_a_naive_count_for_every_option(self):
+        audi, a4 = self.models[0].brand, self.models[1]
+        for filters in [
+            self._filters(),
+            self._filters(brand=str(audi.pk)),
+            self._filters(brand=str(audi.pk), model=str(a4.pk), fuel='diesel'),
+            self._filters(transmission='manual', body='sedan', color='black'),
+            self._filters(beginners='on', price_from=5000, price_to=12000),
+            self._filters(fuel='petrol', year_from=2013, color='white'),
+            self._filters(fuel='electric'),
+        ]:
+            with self.subTest(filters={k: v for k, v in filters.items() if v is not None}):
+                facets = get_vehicle_facets(filters)
+                self.assertEqual(facets['total'], _vehicle_queryset(filters).count())
+                for facet in FACETS:
+                    # An option counts what picking it would give, keeping the other filters
+                    others = _vehicle_queryset({**filters, facet: None})
+                    column = self.COLUMNS[facet]
+                    expected = {
+                        value: others.filter(**{column: value}).count()
+                        for value in Car.objects.filter(sold=False).values_list(column, flat=True)
+                    }
+                    expected = {value: n for value, n in expected.items() if n}
+                    self.assertEqual(facets['counts'][facet], expected, facet)
+                self.assertEqual(
+                    facets['counts']['beginners'],
+                    _vehicle_queryset({**filters, 'beginners': None}).filter(kilowatts__lte=Car.BEGINNER_MAX_KW).count())
+
+    def test_a_facet_ignores_its_own_filter(self):
+        audi, skoda = self.models[0].brand, self.models[2].brand
+        unfiltered = get_vehicle_facets(self._filters())
+        by_brand = get_vehicle_facets(self._filters(brand=str(audi.pk)))
+        # The other brand stays selectable with its full count ...
+        self.assertEqual(by_brand['counts']['brand'], unfiltered['counts']['brand'])
+        self.assertEqual(by_brand['counts']['brand'][skoda.pk], Car.objects.filter(sold=False, brand=skoda).count())
+        # ... while every other facet narrows to the brand
+        self.assertEqual(sum(by_brand['counts']['fuel'].values()),
+                         Car.objects.filter(sold=False, brand=audi).count())
+
+
+@override_settings(CACHES=CACHES)
+class TypeaheadTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        # More Fords, Ferraris and Volvos than Volkswagens, so counts alone would rank them first
+        for name, models, cars in [('Volkswagen', ['Golf'], 1), ('Ford', ['Focus'], 4),
+                                   ('Ferrari', ['F8'], 3), ('Volvo', ['V40'], 3)]:
+            brand = CarBrand.objects.create(name=name)
+            for model_name in models:
+                model = CarModel.objects.create(brand=brand, name=model_name)
+                for i in range(cars):
+                    Car.objects.create(
+                        brand=brand, model_name=model, title=f'{name} {model_name} {i}', year=2015,
+                        fuel_type='diesel', transmission='manual', body_type='sedan', registration_type='mk',
+                        kilowatts=80, price=9000, mileage=1000, color='black', seats='5',
+                    )
+
+    def setUp(self):
+        cache.clear()
+        # Every test starts like a fresh process
+        process_trie = mock.patch.object(typeahead, '_current', None)
+        process_trie.start()
+        self.addCleanup(process_trie.stop)
+
+    def _labels(self, query):
+        return [entry['label'] for entry in typeahead.suggest(query)]
+
+    def test_brand_abbreviations_and_local_spellings_rank_the_brand_first(self):
+        self.assertEqual(self._labels('VW')[0], 'Volkswagen')
+        self.assertEqual(self._labels('vw golf')[0], 'Volkswagen Golf')
+        self.assertEqual(self._labels('фолксваген')[0], 'Volkswagen')
+        self.assertEqual(self._labels('Ферари')[0], 'Ferrari')
+
+    def test_typeahead_answers_any_spelling_without_queries(self):
+        url = reverse('ajax_typeahead')
+        self.client.get(url, {'q': 'v'})
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, {'q': 'фолксваген'})
+        self.assertEqual(len(queries), 0)
+        labels = [result['label'] for result in response.json()['results']]
+        self.assertEqual(labels[0], 'Volkswagen')
+        self.assertIn('Volkswagen Golf', labels)
+
+    def test_trie_is_kept_per_process_until_the_catalog_changes(self):
+        with mock.patch.object(typeahead, 'build', wraps=typeahead.build) as build:
+            typeahead.suggest('volk')
+            with mock.patch.object(typeahead, 'cache') as shared:
+                typeahead.suggest('golf')
+            shared.get.assert_not_called()
+            # A request in another process finds it in the shared cache
+            with mock.patch.object(typeahead, '_current', None):
+                typeahead.suggest('ford')
+            self.assertEqual(build.call_count, 1)
+
+            bump_catalog_version()
+            self.assertEqual(self._labels('volvo')[0], 'Volvo')
+            self.assertEqual(build.call_count, 2)
+
+
+@override_settings(
+    MEDIA_ROOT=MEDIA_ROOT,
+    PAGE_CACHE_TIMEOUT=60,
+    CATALOG_SNAPSHOT_ENABLED=False,
+    ALLOWED_HOSTS=['dealership.krstevski.me', 'autodinero.krstevski.me', 'testserver'],
+    CACHES=CACHES,
+)
+class PageCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        brand = CarBrand.objects.create(name='Brand')
+        cls.car = Car.objects.create(
+            brand=brand, title='Exclusive car', year=2015, fuel_type='diesel', transmission='manual',
+            body_type='sedan', registration_type='mk', kilowatts=80, price=9000, mileage=1000,
+            color='black', seats='5', is_exclusive=True, main_image=_jpeg(color=(10, 200, 90)),
+        )
+        cls.images = [CarImage.objects.create(car=cls.car, image=_jpeg(color=(10, 200, 90 + i)), position=i)
+                      for i in range(2)]
+        cls.staff = User.objects.create_user('staff', password='x', is_staff=True)
+
+    def setUp(self):
+        cache.clear()
+
+    def _get(self, url, host='dealership.krstevski.me'):
+        response = self.client.get(url, HTTP_HOST=host)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_pages_are_cached_per_host_without_tracking_parameters(self):
+        url = reverse('frontend_index')
+        response = self._get(f'{url}?utm_source=newsletter&fbclid=abc')
+        self.assertEqual(response['X-Page-Cache'], 'miss')
+        self.assertContains(response, f'property="og:url" content="http://dealership.krstevski.me{url}"')
+        self.assertNotContains(response, 'newsletter')
+
+        response = self._get(url, host='autodinero.krstevski.me')
+        self.assertEqual(response['X-Page-Cache'], 'miss')
+        self.assertContains(response, f'property="og:url" content="http://autodinero.krstevski.me{url}"')
+
+        self.assertEqual(self._get(f'{url}?gclid=xyz')['X-Page-Cache'], 'hit')
+
+    def test_admin_writes_that_bypass_signals_invalidate_cached_pages(self):
+        index = reverse('frontend_index')
+        detail = reverse('frontend_vehicle_detail', args=[self.car.pk])
+        for url in (index, detail):
+            self._get(url)
+            self.assertEqual(self._get(url)['X-Page-Cache'], 'hit')
+        self.client.force_login(self.staff)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(
+                reverse('ajax_reorder_car_images'),
+                json.dumps({'image_ids': [image.pk for image in reversed(self.images)]}),
+                content_type='application/json', HTTP_X_REQUESTED_WITH='XMLHttpRequest',
+            )
+        self.client.logout()
+        self.assertEqual(self._get(detail)['X-Page-Cache'], 'miss')
+        self._get(index)
+
+        self.client.force_login(self.staff)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('exclusive_car_management'), {'action': 'remove_exclusive'})
+        self.client.logout()
+        self.assertFalse(Car.objects.filter(is_exclusive=True).exists())
+        self.assertEqual(self._get(index)['X-Page-Cache'], 'miss')
+
+    def test_validators_answer_repeat_requests_with_304_until_the_catalog_changes(self):
+        host = 'dealership.krstevski.me'
+        for url in (reverse('frontend_index'), reverse('frontend_vehicle_detail', args=[self.car.pk])):
+            with self.subTest(url=url):
+                # The validators cover the CSRF cookie the first visit sets
+                self._get(url)
+                self.assertIn(settings.CSRF_COOKIE_NAME, self.client.cookies)
+                first = self._get(url)
+                etag, last_modified = first['ETag'], first['Last-Modified']
+                for headers in ({'HTTP_IF_NONE_MATCH': etag}, {'HTTP_IF_MODIFIED_SINCE': last_modified}):
+                    response = self.client.get(url, HTTP_HOST=host, **headers)
+                    self.assertEqual(response.status_code, 304, headers)
+                    self.assertEqual(response.content, b'')
+
+                bump_catalog_version()
+                response = self.client.get(url, HTTP_HOST=host, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 200)
+                self.assertNotEqual(response['ETag'], etag)
+                self.assertEqual(self.client.get(url, HTTP_HOST=host, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+
+@override_settings(
+    MEDIA_ROOT=MEDIA_ROOT,
+    PAGE_CACHE_TIMEOUT=0,
+    CATALOG_SNAPSHOT_ENABLED=True,
+    CACHES=CACHES,
+)
+class CatalogSnapshotTests(TestCase):
+    """The snapshot must answer every vehicle_list filter and sort exactly like the ORM."""
+
+    FILTERS = [
+        {},
+        {'brand': '{brand}'},
+        {'brand': '{brand}', 'model_name': '{model}'},
+        {'transmission': 'automatic'},
+        {'vehicle_body': 'suv'},
+        {'fuel': 'diesel', 'color': 'white'},
+        {'for_beginners': '1'},
+        {'price_from': '6000', 'price_to': '9000'},
+        {'year_from': '2015'},
+        {'brand': '{brand}', 'fuel': 'electric', 'price_to': '7000'},
+    ]
+    SORTS = [{}] + [{f'sort_{column}': direction}
+                    for column in ('price', 'mileage', 'year') for direction in ('asc', 'desc')]
+
+    @classmethod
+    def setUpTestData(cls):
+        brands = [CarBrand.objects.create(name=f'Brand {i}') for i in range(3)]
+        models = [CarModel.objects.create(brand=brand, name=f'Model {brand.pk}-{i}')
+                  for brand in brands for i in range(2)]
+        for i in range(20):
+            model = models[i % len(models)]
+            Car.objects.create(
+                brand=model.brand, model_name=model, title=f'Car {i}', year=2010 + i % 8,
+                fuel_type=['petrol', 'diesel', 'hybrid'][i % 3], transmission='automatic' if i % 4 else 'manual',
+                body_type='suv' if i % 5 else 'sedan', registration_type='mk', kilowatts=50 + i * 3,
+                # Prices, mileages and positions repeat so the id has to break ties
+                price=5000 + (i % 6) * 1000, mileage=(i % 4) * 20000, color=['white', 'black'][i % 2],
+                seats='5', position=i % 3, sold=(i % 9 == 4), main_image=_jpeg(),
+            )
+        cls.brand = brands[1]
+        cls.model = models[3]
+
+    def setUp(self):
+        directory = tempfile.mkdtemp(prefix='dealership-snapshot-')
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        path_override = self.settings(CATALOG_SNAPSHOT_PATH=os.path.join(directory, 'catalog.snapshot'))
+        path_override.enable()
+        self.addCleanup(path_override.disable)
+        catalog_snapshot.build_snapshot()
+
+    def _params(self, params):
+        return {key: value.format(brand=self.brand.pk, model=self.model.pk) for key, value in params.items()}
+
+    def _listing(self, params):
+        """Every car id vehicle_list shows for `params`, page by page, and the fallback flag."""
+        ids, page, fallback = [], 1, None
+        while True:
+            response = self.client.get(reverse('frontend_vehicles'), {**params, 'page': page})
+            self.assertEqual(response.status_code, 200)
+            ids += [car.pk for car in response.context['cars']]
+            fallback = response.context['no_results_fallback']
+            if not response.context['cars'].has_next():
+                return ids, fallback
+            page += 1
+
+    def test_file_round_trips_columns_and_bitmaps(self):
+        cars = Car.objects.filter(sold=False).order_by('position', '-created_at', 'id')
+        with catalog_snapshot.CatalogSnapshot(catalog_snapshot.snapshot_path()) as snapshot:
+            self.assertEqual(snapshot.rows, cars.count())
+            self.assertEqual(list(snapshot.columns['id']), [car.pk for car in cars])
+            self.assertEqual(list(snapshot.columns['price']), [car.price for car in cars])
+            self.assertEqual(snapshot.categories['fuel'], ['diesel', 'hybrid', 'petrol'])
+            for i, car in enumerate(cars):
+                bit = 1 << i
+                self.assertTrue(snapshot.bitmap('brand', car.brand_id) & bit)
+                self.assertFalse(snapshot.bitmap('model', self.model.pk) & bit and car.model_name_id != self.model.pk)
+                self.assertEqual(bool(snapshot.beginners & bit), car.kilowatts <= Car.BEGINNER_MAX_KW)
+            self.assertEqual(snapshot.bitmap('brand', 0), 0)
+
+        with open(catalog_snapshot.snapshot_path(), 'r+b') as fh:
+            fh.write(b'NOTSNAP!')
+        with self.assertRaises(ValueError):
+            catalog_snapshot.CatalogSnapshot(catalog_snapshot.snapshot_path())
+
+    def test_search_matches_the_orm_for_every_filter_and_sort(self):
+        for filter_params in self.FILTERS:
+            for sort_params in self.SORTS:
+                params = self._params({**filter_params, **sort_params})
+                with self.subTest(params=params):
+                    with self.settings(CATALOG_SNAPSHOT_ENABLED=False):
+                        expected = self._listing(params)
+                    self.assertEqual(self._listing(params), expected)
+
+    def _keyset_walk(self, params):
+        """Car ids of every keyset page of vehicle_list, following next links, then prev links back."""
+        cursor, pages = '', []
+        while True:
+            cars = self.client.get(reverse('frontend_vehicles'), {**params, 'cursor': cursor}).context['cars']
+            pages.append([car.pk for car in cars])
+            if not cars.has_next:
+                break
+            cursor = cars.next_cursor
+        while cars.has_previous:
+            cars = self.client.get(reverse('frontend_vehicles'), {**params, 'cursor': cars.previous_cursor}).context['cars']
+            pages.append([car.pk for car in cars])
+        return pages
+
+    def test_keyset_pages_match_the_orm_for_every_filter_and_sort(self):
+        for filter_params in self.FILTERS:
+            for sort_params in self.SORTS:
+                params = self._params({**filter_params, **sort_params})
+                with self.subTest(params=params):
+                    with self.settings(CATALOG_SNAPSHOT_ENABLED=False):
+                        expected = self._keyset_walk(params)
+                    self.assertEqual(self._keyset_walk(params), expected)
+
+        # The page's cursor carries on in the infinite-scroll feed, which uses the ORM
+        params = self._params({'brand': '{brand}', 'fuel': 'electric', 'sort_price': 'asc'})
+        second = self._keyset_walk(params)[1]
+        cars = self.client.get(reverse('frontend_vehicles'), {**params, 'cursor': ''}).context['cars']
+        feed = self.client.get(reverse('ajax_vehicles'), {**params, 'cursor': cars.next_cursor}).json()
+        self.assertEqual([car['id'] for car in feed['results']], second)
+
+    def test_refresh_rewrites_only_changed_cars(self):
+        path = catalog_snapshot.snapshot_path()
+        first = catalog_snapshot.get_snapshot()
+        cheapest, sold = Car.objects.filter(sold=False).order_by('price', 'id')[:2]
+
+        stat = os.stat(path)
+        catalog_snapshot.refresh_cars([cheapest.pk, sold.pk])
+        self.assertEqual(os.stat(path).st_ino, stat.st_ino)
+        self.assertIs(catalog_snapshot.get_snapshot(), first)
+
+        # update() skips the signals, as the admin's bulk actions do
+        Car.objects.filter(pk=cheapest.pk).update(price=100_000)
+        Car.objects.filter(pk=sold.pk).update(sold=True)
+        catalog_snapshot.refresh_cars([cheapest.pk, sold.pk])
+        snapshot = catalog_snapshot.get_snapshot()
+        self.assertIsNot(snapshot, first)
+        # A request still holding the old snapshot keeps reading it
+        self.assertIn(sold.pk, first.search({}))
+        released = weakref.ref(first)
+        del first
+        gc.collect()
+        self.assertIsNone(released())
+
+        by_price = snapshot.search({}, ('price', 'desc'))
+        self.assertEqual(by_price[0], cheapest.pk)
+        self.assertNotIn(sold.pk, by_price)
+        self.assertEqual(by_price, list(
+            Car.objects.filter(sold=False).order_by('-price', 'id').values_list('pk', flat=True)))
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, CACHES=CACHES)
+class ImageJobTests(TestCase):
+    """The upload queue, run in-process instead of through the worker's pool."""
+
+    @classmethod
+    def setUpTestData(cls):
+        brand = CarBrand.objects.create(name='Brand')
+        cls.car = Car.objects.create(
+            brand=brand, title='Car', year=2015, fuel_type='diesel', transmission='manual',
+            body_type='sedan', registration_type='mk', kilowatts=80, price=9000, mileage=1000,
+            color='black', seats='5', main_image=_jpeg(),
+        )
+
+    def _run(self):
+        for job_id in image_jobs.claim(10):
+            image_jobs.finish(job_id, image_jobs.run_job(job_id))
+
+    def test_upload_is_stored_as_is_then_processed(self):
+        car_image = image_jobs.queue_car_image(self.car, _jpeg('big.jpg', size=(2400, 1600)), 1)
+        self.assertEqual(car_image.image.width, 2400)
+        self.assertEqual(ImageJob.objects.get(car_image=car_image).status, 'pending')
+
+        self._run()
+        car_image.refresh_from_db()
+        self.assertEqual(car_image.processing_status, 'completed')
+        self.assertEqual((car_image.image.width, car_image.image.height), (1200, 800))
+        self.assertEqual(ImageJob.objects.get(car_image=car_image).status, 'done')
+        self.assertTrue(car_image.thumbnail.storage.exists(car_image.thumbnail.name))
+        self.assertTrue(car_image.web_display.storage.exists(car_image.web_display.name))
+        web = car_image.spec_encodings['web_display']
+        self.assertEqual(web['bytes'], car_image.web_display.storage.size(car_image.web_display.name))
+        self.assertLessEqual(web['bytes'], CAR_IMAGE.variants['web_display'].max_bytes)
+
+    def test_byte_budget_picks_the_best_quality_that_fits(self):
+        photo = Image.effect_mandelbrot((700, 500), (-2, -1.5, 1, 1.5), 100).convert('RGB')
+        budget = 12 * 1024
+        encoded = image_pipeline.encode_within(photo, budget, {'quality': 85})
+        settings = encoded.settings
+        self.assertLessEqual(len(encoded.data), budget)
+        self.assertNotIn('over_budget', settings)
+        one_better = {'quality': settings['quality'] + 1, 'subsampling': settings['subsampling'], 'progressive': True}
+        self.assertGreater(len(image_pipeline._save(photo, 'JPEG', one_better)), budget)
+
+        noise = Image.effect_noise((700, 500), 100).convert('RGB')
+        settings = image_pipeline.encode_within(noise, budget, {'quality': 85}).settings
+        self.assertEqual((settings['quality'], settings['over_budget']), (image_pipeline.MIN_QUALITY, True))
+
+    def test_saved_main_image_queues_its_versions_instead_of_rendering_them(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.car.main_image = _jpeg('new.jpg', size=(1000, 700), color=(30, 90, 30))
+            self.car.save()
+        web = self.car.main_image_web
+        # Building the URL, as templates do, must not encode anything
+        self.assertTrue(web.url)
+        self.assertFalse(web.storage.exists(web.name))
+        image_jobs_queued = ImageJob.objects.exclude(task='recommendations')
+        self.assertEqual(list(image_jobs_queued.values_list('task', 'status')), [('car_specs', 'pending')])
+
+        self._run()
+        self.assertTrue(web.storage.exists(web.name))
+        self.assertTrue(self.car.main_image_thumbnail.storage.exists(self.car.main_image_thumbnail.name))
+
+    def test_warm_generates_missing_versions_only(self):
+        # Two JPEG versions, the srcset ladder and the placeholder
+        ladder = MAIN_IMAGE.ladder
+        files = 2 + len(ladder.rung_widths(self.car.main_image.width)) * len(ladder.formats) + 1
+        self.assertEqual(image_specs.warm('car', [self.car.pk]), (1, files, []))
+        self.assertEqual(image_specs.warm('car', [self.car.pk]), (1, 0, []))
+        self.assertEqual(image_specs.warm('car', [self.car.pk], force=True), (1, files, []))
+
+    def test_picture_offers_the_ladder_once_it_is_built(self):
+        page = Template(
+            '{% load image_tags %}{% picture car.main_image sizes="50vw" %}<img src="x">{% endpicture %}'
+        )
+        self.assertEqual(page.render(Context({'car': self.car})), '<img src="x">')
+
+        self.car.main_image = _jpeg('wide.jpg', size=(2400, 1440))
+        self.car.save()
+        image_specs.generate_specs(self.car)
+        html = page.render(Context({'car': self.car}))
+        self.assertIn('<source type="image/webp" srcset="', html)
+        self.assertIn(' 1200w" sizes="50vw">', html)
+        self.assertTrue(html.endswith('<img src="x"></picture>'))
+        name = image_pipeline.Ladder.name(self.car.main_image.name, 640, 'WEBP')
+        with self.car.main_image.storage.open(name) as fh, Image.open(fh) as rung:
+            self.assertEqual((rung.format, rung.width, rung.height), ('WEBP', 640, 384))
+            self.assertNotIn('exif', rung.info)
+
+    def test_placeholder_is_inlined_once_it_is_made(self):
+        page = Template('{% load image_tags %}<img src="x"{% placeholder car.main_image %}>')
+        self.car.main_image = _jpeg('photo.jpg', size=(1000, 700), color=(30, 30, 120))
+        self.car.save()
+        self.assertEqual(page.render(Context({'car': self.car})), '<img src="x">')
+
+        version = get_catalog_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            image_specs.generate_specs(self.car)
+        # Pages cached before the worker got to it render again, with the placeholder
+        self.assertGreater(get_catalog_version(), version)
+        self.car.refresh_from_db()
+        self.assertTrue(self.car.placeholder.startswith('data:image/webp;base64,'))
+        self.assertLess(len(self.car.placeholder), 1024)
+        self.assertIn(f'url({self.car.placeholder})', page.render(Context({'car': self.car})))
+
+        # A new image shows no placeholder until its own is made
+        self.car.main_image = _jpeg('new.jpg', size=(1000, 700))
+        self.car.save()
+        self.assertEqual(page.render(Context({'car': self.car})), '<img src="x">')
+
+    def test_saving_a_car_checks_its_size_without_reading_storage(self):
+        self.assertEqual(self.car.main_image_size, self.car.main_image.storage.size(self.car.main_image.name))
+        car_image = image_jobs.queue_car_image(self.car, _jpeg('extra.jpg'), 1)
+        self._run()
+        car_image.refresh_from_db()
+        with car_image.image.open('rb') as fh:
+            self.assertEqual(
+                (car_image.image_size, car_image.image_width, car_image.image_height, car_image.image_hash),
+                tuple(image_pipeline.measure(fh)),
+            )
+
+        self.car.refresh_from_db()
+        with mock.patch('django.core.files.storage.FileSystemStorage.size', side_effect=AssertionError('storage was read')):
+            self.car.save()
+            CarImage.objects.filter(pk=car_image.pk).update(image_size=5 * 1024 * 1024)
+            with self.assertRaises(ValidationError):
+                self.car.save()
+            # Saving other fields only does not check the size at all
+            self.car.save(update_fields=['position'])
+
+    def test_uploads_are_hashed_while_received(self):
+        data = _jpeg().read()
+        request = RequestFactory().post('/', {'photo': SimpleUploadedFile('photo.jpg', data)})
+        self.assertEqual(request.FILES['photo'].sha256, hashlib.sha256(data).hexdigest())
+
+    def test_a_photo_uploaded_again_reuses_the_stored_copy(self):
+        first = image_jobs.queue_car_image(self.car, _jpeg('a.jpg', size=(800, 600), color=(10, 20, 200)), 1)
+        self._run()
+        first.refresh_from_db()
+        with mock.patch.object(image_pipeline.Pipeline, 'decode', side_effect=AssertionError('decoded again')):
+            again = image_jobs.queue_car_image(self.car, _jpeg('b.jpg', size=(800, 600), color=(10, 20, 200)), 2)
+        self.assertEqual((again.processing_status, again.image.name), ('completed', first.image.name))
+        self.assertEqual((again.image_hash, again.placeholder), (first.image_hash, first.placeholder))
+        self.assertEqual(again.spec_encodings, first.spec_encodings)
+        self.assertFalse(ImageJob.objects.filter(car_image=again).exists())
+
+        # The file is deleted with the last image using it
+        first.delete()
+        self.assertTrue(default_storage.exists(again.image.name))
+        self.assertTrue(default_storage.exists(again.thumbnail.name))
+        again.delete()
+        self.assertFalse(default_storage.exists(again.image.name))
+        self.assertFalse(default_storage.exists(again.thumbnail.name))
+
+    @mock.patch('dealership_app.management.commands.regenerate_images.ProcessPoolExecutor', _InlinePool)
+    def test_regenerate_images_resumes_and_covers_shared_files_once(self):
+        twin = Car.objects.get(pk=self.car.pk)
+        twin.pk = None
+        twin.save()
+        checkpoint = os.path.join(MEDIA_ROOT, 'regenerate.json')
+        options = {'specs': ['placeholder'], 'checkpoint': checkpoint, 'stdout': io.StringIO()}
+        with mock.patch.object(image_specs, 'generate_specs', wraps=image_specs.generate_specs) as generate:
+            call_command('regenerate_images', min_car_id=self.car.pk, **options)
+        self.assertEqual(generate.call_count, 1)
+        twin.refresh_from_db()
+        self.assertTrue(twin.placeholder.startswith('data:image/webp'))
+        self.assertFalse(os.path.exists(checkpoint))
+
+        # An interrupted run picks up after the rows it has done
+        params = {'specs': ['placeholder'], 'min_car_id': None, 'max_car_id': None, 'since': None, 'until': None}
+        with open(checkpoint, 'w') as fh:
+            json.dump({'params': params, 'done': {'car': [self.car.pk], 'car_image': []}}, fh)
+        with self.assertRaises(CommandError):
+            call_command('regenerate_images', checkpoint=checkpoint, stdout=io.StringIO())
+        with mock.patch.object(image_specs, 'generate_specs') as generate:
+            call_command('regenerate_images', **options)
+        generate.assert_not_called()
+        self.assertFalse(os.path.exists(checkpoint))
+
+    def test_benchmark_flags_regressions_against_the_baseline(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = image_benchmark.write_corpus(directory, {(640, 480, 'JPEG')})[640, 480, 'JPEG']
+            metrics = image_benchmark.run_case('car_image', path, 2)
+        self.assertEqual(set(metrics['stages_ms']), {'decode', 'original', *CAR_IMAGE.variants, 'ladder', 'placeholder'})
+        self.assertGreater(metrics['peak_rss_mb'], 0)
+
+        baseline = {'cases': {'car_image/640x480.jpeg': metrics}}
+        slower = dict(metrics, images_per_s=metrics['images_per_s'] / 2, output_bytes=metrics['output_bytes'] + 1)
+        regressed = {
+            metric for _, metric, _, _, _, worse
+            in image_benchmark.compare({'car_image/640x480.jpeg': slower}, baseline, 0.2) if worse
+        }
+        self.assertEqual(regressed, {'images_per_s'})
+        self.assertEqual(image_benchmark.p95([5, 1, 4, 2, 3]), 5)
+
+    def test_large_uploads_are_decoded_reduced_and_upright(self):
+        buffer = io.BytesIO()
+        Image.new('RGB', (4000, 3000), (90, 90, 140)).save(buffer, 'JPEG')
+        buffer.seek(0)
+        # Decoded at 1/2 scale: still covers the 1067x800 the original keeps
+        self.assertEqual(image_pipeline.Pipeline.decode(buffer, (1200, 800)).size, (2000, 1500))
+
+        # Stored turned a quarter, as phones do, with the EXIF tag to show it upright
+        exif = Image.Exif()
+        exif[ExifTags.Base.Orientation] = 6
+        buffer = io.BytesIO()
+        Image.new('RGB', (1600, 800), (40, 140, 40)).save(buffer, 'JPEG', exif=exif)
+        buffer.seek(0)
+        original, _ = CAR_IMAGE.run(buffer)
+        with Image.open(io.BytesIO(original.data)) as image:
+            self.assertEqual(image.size, (400, 800))
+            self.assertNotIn(ExifTags.Base.Orientation, image.getexif())
+
+        with mock.patch.object(image_pipeline, 'MAX_PIXELS', 1000), self.assertRaises(ValueError):
+            image_jobs.queue_car_image(self.car, _jpeg(), 1)
+        self.assertFalse(CarImage.objects.exists())
+
+    def test_catalog_wide_changes_queue_one_recommendations_rebuild(self):
+        other = Car.objects.create(
+            brand=self.car.brand, title='Other car', year=2016, fuel_type='diesel', transmission='manual',
+            body_type='sedan', registration_type='mk', kilowatts=90, price=9500, mileage=2000,
+            color='black', seats='5',
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            catalog_changed()
+            catalog_changed()
+        self.assertEqual(ImageJob.objects.filter(task='recommendations', status='pending').count(), 1)
+        CarRecommendation.objects.all().delete()
+
+        self._run()
+        self.assertEqual(list(CarRecommendation.objects.filter(car=self.car).values_list('recommended', flat=True)),
+                         [other.pk])
+
+    def test_saving_a_car_rescores_the_cars_widening_to_it_in_the_worker(self):
+        def car(title, model):
+            return Car.objects.create(
+                brand=self.car.brand, model_name=model, title=title, year=2016, fuel_type='diesel',
+                transmission='manual', body_type='sedan', registration_type='mk', kilowatts=90,
+                price=9500, mileage=2000, color='black', seats='5',
+            )
+
+        models = [CarModel.objects.create(brand=self.car.brand, name=f'Model {i}') for i in range(2)]
+        first = car('First', models[0])
+        rebuild_recommendations()
+        with self.captureOnCommitCallbacks(execute=True):
+            second = car('Second', models[1])
+
+        # Only the new car's own model group is rescored in the request
+        def recommended():
+            return list(CarRecommendation.objects.filter(car=first).values_list('recommended', flat=True))
+
+        self.assertNotIn(second.pk, recommended())
+        self.assertEqual(ImageJob.objects.get(task='recommendations').car, second)
+        self._run()
+        self.assertIn(second.pk, recommended())
+
+    def test_long_upload_names_are_cut_to_the_column(self):
+        car_image = image_jobs.queue_car_image(self.car, _jpeg('x' * 200 + '.jpg', color=(7, 70, 7)), 1)
+        max_length = CarImage._meta.get_field('image').max_length
+        self.assertLessEqual(len(car_image.image.name), max_length)
+        self.assertTrue(car_image.image.name.endswith('.jpg'))
+        self.assertTrue(default_storage.exists(car_image.image.name))
+
+    def test_failures_back_off_then_give_up(self):
+        # A photo no other test stores, or the job would adopt its processed copy
+        car_image = image_jobs.queue_car_image(self.car, _jpeg(color=(7, 7, 7)), 1)
+        with car_image.image.open('wb') as fh:
+            fh.write(b'not an image')
+        job = ImageJob.objects.get(car_image=car_image)
+
+        self._run()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('pending', 1))
+        self.assertGreater(job.run_after, timezone.now())
+        self.assertEqual(image_jobs.claim(10), [])
+
+        ImageJob.objects.filter(pk=job.pk).update(attempts=image_jobs.MAX_ATTEMPTS - 1, run_after=timezone.now())
+        self._run()
+        job.refresh_from_db()
+        car_image.refresh_from_db()
+        self.assertEqual(job.status, 'failed')
+        self.assertEqual(car_image.processing_status, 'error')
+
+    def test_stale_jobs_are_requeued(self):
+        car_image = image_jobs.queue_car_image(self.car, _jpeg(), 1)
+        [job_id] = image_jobs.claim(10)
+        ImageJob.objects.filter(pk=job_id).update(
+            locked_at=timezone.now() - timedelta(seconds=image_jobs.STALE_AFTER + 1))
+        self.assertEqual(image_jobs.recover_stale(), 1)
+        self.assertEqual(image_jobs.claim(10), [job_id])
+
+    def test_invalid_upload_is_rejected(self):
+        with self.assertRaises(ValueError):
+            image_jobs.queue_car_image(self.car, SimpleUploadedFile('x.jpg', b'garbage'), 1)
+        self.assertFalse(CarImage.objects.exists())
+
+
+@override_settings(CACHES=CACHES)
+class MediaGCTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp(prefix='dealership-gc-')
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        media_override = self.settings(MEDIA_ROOT=media_root)
+        media_override.enable()
+        self.addCleanup(media_override.disable)
+        self.car = Car.objects.create(
+            brand=CarBrand.objects.create(name='Brand'), title='Car', year=2015, fuel_type='diesel',
+            transmission='manual', body_type='sedan', registration_type='mk', kilowatts=80, price=9000,
+            mileage=1000, color='black', seats='5', main_image=_jpeg('gc.jpg', color=(200, 200, 20)),
+        )
+
+    def test_media_gc_deletes_only_old_unreferenced_files(self):
+        image_specs.generate_specs(self.car)
+        kept = image_specs.stored_names(self.car)
+        failed_upload = default_storage.save('cars/extra_images/original/failed.jpg', _jpeg())
+        old_version = default_storage.save(os.path.dirname(kept[1]) + '/old.jpg', ContentFile(b'x' * 100))
+
+        call_command('media_gc', dry_run=True, min_age=0, stdout=io.StringIO())
+        self.assertTrue(default_storage.exists(failed_upload))
+        call_command('media_gc', min_age=1, stdout=io.StringIO())
+        self.assertTrue(default_storage.exists(failed_upload))
+
+        call_command('media_gc', min_age=0, stdout=io.StringIO())
+        self.assertFalse(default_storage.exists(failed_upload))
+        self.assertFalse(default_storage.exists(old_version))
+        self.assertEqual([name for name in kept if not default_storage.exists(name)], [])
+
+    def test_media_gc_keeps_files_adopted_while_it_scans(self):
+        removed = CarImage.objects.create(car=self.car, image=_jpeg('again.jpg', color=(9, 9, 9)), position=0)
+        name = removed.image.name
+        CarImage.objects.filter(pk=removed.pk).delete()
+        referenced = media_gc.Command._referenced
+
+        def upload_during_scan(command):
+            names = referenced(command)
+            if not CarImage.objects.exists():
+                # The same photo uploaded again after the first look at the database
+                CarImage.objects.create(car=self.car, image=name, position=0)
+            return names
+
+        with mock.patch.object(media_gc.Command, '_referenced', autospec=True, side_effect=upload_during_scan):
+            call_command('media_gc', min_age=0, stdout=io.StringIO())
+        self.assertTrue(default_storage.exists(name))
+
+
+@override_settings(
+    MEDIA_ROOT=MEDIA_ROOT,
+    IMAGE_RESIZE_CACHE_DIR=os.path.join(MEDIA_ROOT, 'resize-cache'),
+    CACHES=CACHES,
+)
+class ImageResizeTests(TestCase):
+    def setUp(self):
+        self.name = default_storage.save('cars/main_images/resize.jpg', _jpeg(size=(1200, 800)))
+        self.addCleanup(shutil.rmtree, os.path.join(MEDIA_ROOT, 'resize-cache'), True)
+
+    def _token(self, width, **kwargs):
+        return image_resize.resize_url(self.name, width, **kwargs).rstrip('/').rsplit('/', 1)[1]
+
+    def test_signed_url_serves_the_requested_size(self):
+        response = self.client.get(image_resize.resize_url(self.name, 300, 300, 'fill', 'webp'))
+        self.assertEqual(response['Content-Type'], 'image/webp')
+        with Image.open(io.BytesIO(b''.join(response.streaming_content))) as image:
+            self.assertEqual((image.format, image.size), ('WEBP', (300, 300)))
+
+        token = self._token(300)
+        forged = token[:-1] + ('x' if token[-1] != 'x' else 'y')
+        self.assertEqual(self.client.get(reverse('resized_image', args=[forged])).status_code, 404)
+        self.assertEqual(self.client.get(image_resize.resize_url('cars/missing.jpg', 300)).status_code, 404)
+
+    def test_concurrent_requests_encode_a_variant_once(self):
+        resize = image_resize.parse(self._token(640, format='jpeg'))
+        start = threading.Barrier(8)
+        paths = []
+
+        def request():
+            start.wait()
+            paths.append(image_resize.get_resized(resize))
+
+        with mock.patch.object(image_resize, 'render', wraps=image_resize.render) as render:
+            threads = [threading.Thread(target=request) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(render.call_count, 1)
+        self.assertEqual(len(set(paths)), 1)
+
+    def test_trim_drops_least_recently_served_first(self):
+        resizes = [image_resize.parse(self._token(width)) for width in (100, 200, 300)]
+        paths = [image_resize.get_resized(resize) for resize in resizes]
+        for age, path in zip((300, 200, 100), paths):
+            os.utime(path, (0, os.path.getmtime(path) - age))
+        image_resize.get_resized(resizes[0])  # served again, now the most recent
+        sizes = [os.path.getsize(path) for path in paths]
+        image_resize.trim(max_bytes=int((sizes[0] + sizes[2]) / image_resize.TRIM_TO) + 1)
+        self.assertEqual([os.path.exists(path) for path in paths], [True, False, True])
+
+    def test_bytes_written_by_separate_requests_add_up_to_a_trim(self):
+        path = image_resize.get_resized(image_resize.parse(self._token(120)))
+        # Each CGI request is a new process: nothing may be counted in memory
+        with override_settings(IMAGE_RESIZE_CACHE_MAX_BYTES=1000), mock.patch.object(image_resize, 'trim') as trim:
+            open(os.path.join(settings.IMAGE_RESIZE_CACHE_DIR, image_resize.WRITTEN_FILE), 'w').close()
+            image_resize._written(60)
+            image_resize._written(30)
+            trim.assert_not_called()
+            image_resize._written(20)
+            image_resize._written(20)  # counted from zero again
+            trim.assert_called_once()
+
+        call_command('trim_resize_cache', max_bytes=0, stdout=io.StringIO())
+        self.assertFalse(os.path.exists(path))
@@ -0,0 +1,225 @@
+"""
+Typeahead for the public search box.
+
+Brands, models (CarModel plus the spellings in cars.json) and the titles of
+available cars are indexed in a prefix trie whose nodes keep their best
+SUGGESTIONS entries precomputed, so a lookup is one walk down the trie and
+never touches the database.  Keys are folded spellings: Cyrillic is
+transliterated and letters that Macedonian and Latin spellings of the same
+name disagree on are merged, so "голф" finds Golf and "фолксваген" finds
+Volkswagen.  Each process keeps one trie for the current catalog version;
+when the version changes it takes the new trie from the shared cache, where
+the first process to need it stores it after building.
+"""
+import json
+import os
+import re
+import threading
+import unicodedata
+from heapq import nsmallest
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Q
+
+from .catalog_version import get_catalog_version
+from .models import Car, CarBrand, CarModel
+
+
+SUGGESTIONS = 8
+
+CYRILLIC = {
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'ѓ': 'gj', 'ђ': 'dj', 'е': 'e', 'ё': 'e', 'ж': 'zh',
+    'з': 'z', 'ѕ': 'dz', 'и': 'i', 'й': 'j', 'ј': 'j', 'к': 'k', 'л': 'l', 'љ': 'lj', 'м': 'm', 'н': 'n',
+    'њ': 'nj', 'о': 'o', 'п': 'p', 'р': 'r', 'с': 's', 'т': 't', 'ќ': 'kj', 'ћ': 'c', 'у': 'u', 'ф': 'f',
+    'х': 'h', 'ц': 'c', 'ч': 'ch', 'џ': 'dz', 'ш': 'sh', 'щ': 'sht', 'ъ': '', 'ы': 'i', 'ь': '', 'э': 'e',
+    'ю': 'ju', 'я': 'ja', 'є': 'e', 'і': 'i', 'ї': 'i',
+}
+LATIN = {'š': 'sh', 'č': 'ch', 'ć': 'c', 'ž': 'zh', 'đ': 'dj', 'ß': 'ss'}
+
+# Applied in order to the transliterated key; both sides of a match are folded the same way
+FOLDS = [
+    ('sch', 's'), ('sh', 's'), ('zh', 'z'), ('ch', 'c'), ('ph', 'f'), ('ck', 'k'), ('dz', 'z'), ('h', ''),
+    ('ou', 'u'), ('w', 'v'), ('f', 'v'), ('x', 'ks'), ('q', 'k'), ('y', 'i'), ('j', 'i'), ('z', 's'),
+]
+
+# Local spellings no folding rule can derive
+ALIASES = {
+    'Peugeot': ['Пежо'],
+    'Renault': ['Рено'],
+    'Jeep': ['Џип'],
+    'Chrysler': ['Крајслер'],
+    'Lancia': ['Ланча'],
+    'Dacija': ['Dacia'],
+    'Volkswagen': ['VW'],
+}
+
+_KIND_ORDER = {'brand': 0, 'model': 1, 'car': 2}
+_SOFT_C = re.compile(r'c(?=[ei])')
+_REPEATS = re.compile(r'(.)\1+')
+_WORD = re.compile(r'\w+')
+
+_lock = threading.Lock()
+_current = None
+
+
+def transliterate(text):
+    """Lower-case ASCII spelling of `text` (Cyrillic transliterated, accents dropped)."""
+    text = ''.join(CYRILLIC.get(ch, LATIN.get(ch, ch)) for ch in str(text).lower())
+    return unicodedata.normalize('NFKD', text).encode('ascii', 'ignore').decode()
+
+
+def fold(text):
+    """Trie key for `text`: transliterated, without separators, spelling variants merged."""
+    # Double letters are merged as spelled, not after folding: "vw" must not become "v"
+    key = _REPEATS.sub(r'\1', re.sub(r'[^a-z0-9]', '', transliterate(text)))
+    for old, new in FOLDS:
+        key = key.replace(old, new)
+    return _SOFT_C.sub('s', key).replace('c', 'k')
+
+
+def _word_starts(text):
+    """`text` from each of its words on: "Alfa Romeo 159" -> ..., "Romeo 159", "159"."""
+    starts = [m.start() for m in _WORD.finditer(text)]
+    return [text[start:] for start in starts]
+
+
+class Trie:
+    """Prefix trie of folded keys; every node holds its best suggestions, best first."""
+
+    def __init__(self, version):
+        self.version = version
+        self.root = {}
+
+    def add(self, text, entry):
+        for key in {fold(start) for start in _word_starts(text)}:
+            if not key:
+                continue
+            node = self.root
+            for ch in key:
+                node = node.setdefault(ch, {})
+            node.setdefault('', []).append(entry)
+
+    def finish(self):
+        """Collapse every node's subtree into its SUGGESTIONS best entries."""
+        stack = [(self.root, False)]
+        # Iterative post-order, titles can make deep tries
+        while stack:
+            node, children_done = stack.pop()
+            if children_done:
+                entries = node.pop('', [])
+                for child in node.values():
+                    entries.extend(child[''])
+                unique = {entry['key']: entry for entry in entries}
+                node[''] = nsmallest(SUGGESTIONS, unique.values(), key=lambda entry: entry['rank'])
+            else:
+                stack.append((node, True))
+                stack.extend((child, False) for ch, child in node.items() if ch != '')
+        return self
+
+    def lookup(self, query, limit=SUGGESTIONS):
+        key = fold(query)
+        if not key:
+            return []
+        node = self.root
+        for ch in key:
+            node = node.get(ch)
+            if node is None:
+                return []
+        return node.get('', [])[:limit]
+
+
+def _catalog_spellings():
+    path = os.path.join(settings.BASE_DIR, 'cars.json')
+    try:
+        with open(path, encoding='utf-8') as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return {}
+
+
+def _entry(kind, key, label, count, **ids):
+    # Brands before models before cars, then by available cars, then by name
+    return {'key': key, 'kind': kind, 'label': label, 'count': count,
+            'rank': (_KIND_ORDER[kind], -count, label.lower()), **ids}
+
+
+def build(version):
+    """Trie over the current catalog (four queries)."""
+    trie = Trie(version)
+    available = Q(car__sold=False)
+
+    brands = {}
+    for brand_id, name, count in (CarBrand.objects.annotate(n=Count('car', filter=available))
+                                  .values_list('id', 'name', 'n')):
+        brands[fold(name)] = (brand_id, name)
+        entry = _entry('brand', f'b{brand_id}', name, count, brand=brand_id)
+        for spelling in [name] + ALIASES.get(name, []):
+            trie.add(spelling, entry)
+
+    models = set()
+    for model_id, brand_id, brand_name, name, count in (
+            CarModel.objects.annotate(n=Count('car', filter=available))
+            .values_list('id', 'brand_id', 'brand__name', 'name', 'n')):
+        models.add((brand_id, fold(name)))
+        entry = _entry('model', f'm{model_id}', f'{brand_name} {name}', count, brand=brand_id, model=model_id)
+        _add_model(trie, brand_name, name, entry)
+
+    # Spellings from cars.json that are not loaded as CarModel rows link to their brand
+    for spelling, names in _catalog_spellings().items():
+        # "VW Volkswagen" in cars.json is the "Volkswagen" brand
+        keys = [fold(spelling)] + [fold(word) for word in _WORD.findall(spelling)]
+        brand = next((brands[key] for key in keys if key in brands), None)
+        if brand is None:
+            continue
+        brand_id, brand_name = brand
+        for name in names:
+            if (brand_id, fold(name)) in models:
+                continue
+            models.add((brand_id, fold(name)))
+            entry = _entry('model', f'j{brand_id}:{name}', f'{brand_name} {name}', 0, brand=brand_id, model=None)
+            _add_model(trie, f'{spelling} {brand_name}', name, entry)
+
+    for car_id, title in Car.objects.filter(sold=False).order_by().values_list('id', 'title'):
+        trie.add(title, _entry('car', f'c{car_id}', title, 0, car=car_id))
+    return trie.finish()
+
+
+def _add_model(trie, brand_names, name, entry):
+    trie.add(f'{brand_names} {name}', entry)
+    # "vw golf" as well as "golf" and "volkswagen golf"
+    words = _WORD.findall(brand_names)
+    for spelling in words + [alias for word in words for alias in ALIASES.get(word, [])]:
+        trie.add(f'{spelling} {name}', entry)
+
+
+def _shared_trie(version):
+    """The trie for `version` from the shared cache, built and stored there if missing."""
+    key = f'typeahead:trie:{version}'
+    trie = cache.get(key)
+    if trie is None:
+        trie = build(version)
+        cache.set(key, trie, 24 * 60 * 60)
+    return trie
+
+
+def get_trie():
+    """
+    This process's trie for the current catalog version.  Only a version
+    change reads the shared cache: unpickling the trie costs far more than
+    a lookup, so it must not happen per keystroke.
+    """
+    global _current
+    version = get_catalog_version()
+    trie = _current
+    if trie is None or trie.version != version:
+        with _lock:
+            if _current is None or _current.version != version:
+                _current = _shared_trie(version)
+            trie = _current
+    return trie
+
+
+def suggest(query, limit=SUGGESTIONS):
+    """Best suggestions for what the visitor has typed so far."""
+    return get_trie().lookup(query, limit)
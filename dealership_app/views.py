@@ -1,4 +1,3 @@
-import os
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib import messages
 from django.db.models import Q
@@ -6,7 +5,12 @@ from django.core.paginator import Paginator
 from django.http import JsonResponse
 from .models import Car, CarImage, CarEquipment,CarModel
 from .forms import CarModelForm, CarImageForm
-import threading
+from .conditional import catalog_conditional
+from .model_map import models_for_brand
+from .signals import catalog_changed
+from .pagination import KeysetPaginator, keyset_enabled
+from .search_index import search_cars
+from .image_jobs import queue_car_image
 from django.utils import timezone
 from django.db.models import Avg, Sum, Count, F, ExpressionWrapper, FloatField, Max
 from django.utils import timezone
@@ -19,25 +23,34 @@ def admin_dashboard(request):
     # Check if user is authenticated, if not redirect to admin login
     if not request.user.is_authenticated or not request.user.is_staff:
         return redirect('/admin/login/?next=/dashboard/')
-    total_cars = Car.objects.count()
-    total_sold = Car.objects.filter(sold=True).count()
+    current_year = timezone.now().year
+    age_price_expr = ExpressionWrapper(
+        F('price') / (current_year - F('year') + 1),
+        output_field=FloatField()
+    )
+    # All figures below in a single aggregate query
+    stats = Car.objects.aggregate(
+        total=Count('id'),
+        total_sold=Count('id', filter=Q(sold=True)),
+        avg=Avg('price'),
+        avg_sold=Avg('price', filter=Q(sold=True)),
+        inventory=Sum('price', filter=Q(sold=False)),
+        avg_per_year=Avg(age_price_expr),
+    )
+    total_cars = stats['total']
+    total_sold = stats['total_sold']
 
     # 1. Просечна цена на сите возила
-    avg_price = Car.objects.aggregate(avg=Avg('price'))['avg'] or 0
+    avg_price = stats['avg'] or 0
 
     # 2. Просечна цена на продадените
-    avg_price_sold = Car.objects.filter(sold=True).aggregate(avg=Avg('price'))['avg'] or 0
+    avg_price_sold = stats['avg_sold'] or 0
 
     # 3. Вредност на непродадени (инвентарио)
-    inventory_value = Car.objects.filter(sold=False).aggregate(total=Sum('price'))['total'] or 0
+    inventory_value = stats['inventory'] or 0
 
     # 4. Просечна цена по година на производство
-    current_year = timezone.now().year
-    age_price_expr = ExpressionWrapper(
-        F('price') / (current_year - F('year') + 1),
-        output_field=FloatField()
-    )
-    avg_price_per_year = Car.objects.annotate(age_price=age_price_expr).aggregate(avg=Avg('age_price'))['avg'] or 0
+    avg_price_per_year = stats['avg_per_year'] or 0
 
     # 5. Распределба по тип на гориво
     fuel_data = Car.objects.values('fuel_type').annotate(count=Count('id')).order_by()
@@ -66,6 +79,16 @@ def admin_dashboard(request):
 
 
 # ✅ LIST CARS
+# admin_car_list sorts that keyset pagination can follow (order_by fields incl. tie breaker)
+KEYSET_SORTS = {
+    'position': ['position', '-created_at', 'id'],
+    '-created_at': ['-created_at', 'id'],
+    'created_at': ['created_at', 'id'],
+    '-price': ['-price', 'id'],
+    'price': ['price', 'id'],
+    'relevance': ['-search_rank', '-created_at', 'id'],
+}
+
 def admin_car_list(request):
     if not request.user.is_authenticated or not request.user.is_staff:
         return redirect('/admin/login/?next=' + request.path)
@@ -73,18 +96,17 @@ def admin_car_list(request):
     # Get filter parameters
     q = request.GET.get('q', '')
     status = request.GET.get('status', '')
-    sort = request.GET.get('sort', '-created_at')
+    # Searches list the best matches first unless another sort is picked
+    sort = request.GET.get('sort', 'relevance' if q else '-created_at')
+    if sort == 'relevance' and not q:
+        sort = '-created_at'
     
     # Base queryset with related objects for optimization
     cars = Car.objects.select_related('brand', 'model_name').all()
     
-    # Apply search filter
+    # Apply search filter (indexed, see search_index.py)
     if q:
-        cars = cars.filter(
-            Q(title__icontains=q) |
-            Q(brand__name__icontains=q) |
-            Q(model_name__name__icontains=q)
-        )
+        cars = search_cars(cars, q)
     
     # Apply status filter
     if status == 'available':
@@ -98,22 +120,34 @@ def admin_car_list(request):
             cars = cars.order_by('brand__name', 'model_name__name')
         elif sort == 'position':
             cars = cars.order_by('position', '-created_at')
+        elif sort == 'relevance':
+            cars = cars.order_by(*KEYSET_SORTS['relevance'])
         else:
             cars = cars.order_by(sort)
     else:
         # Default sorting by position (custom order), then by creation date
         cars = cars.order_by('position', '-created_at')
     
-    # Calculate statistics
-    total_cars = Car.objects.count()
-    available_cars = Car.objects.filter(sold=False).count()
-    sold_cars = Car.objects.filter(sold=True).count()
-    avg_price = Car.objects.aggregate(avg=Avg('price'))['avg'] or 0
+    # Calculate statistics in a single query
+    stats = Car.objects.aggregate(
+        total=Count('id'),
+        available=Count('id', filter=Q(sold=False)),
+        sold=Count('id', filter=Q(sold=True)),
+        avg=Avg('price'),
+    )
+    total_cars = stats['total']
+    available_cars = stats['available']
+    sold_cars = stats['sold']
+    avg_price = stats['avg'] or 0
     
-    # Pagination
-    paginator = Paginator(cars, 12)  # Show 12 cars per page for better grid layout
-    page = request.GET.get('page')
-    cars = paginator.get_page(page)
+    # Pagination; keyset cursors for the column sorts, page numbers for the rest
+    ordering = KEYSET_SORTS.get(sort or 'position')
+    if ordering and keyset_enabled(request):
+        cars = KeysetPaginator(cars, ordering, 12).get_page(request.GET.get('cursor'))
+    else:
+        paginator = Paginator(cars, 12)  # Show 12 cars per page for better grid layout
+        page = request.GET.get('page')
+        cars = paginator.get_page(page)
     
     return render(request, 'admin_custom/car_list.html', {
         'cars': cars,
@@ -159,7 +193,8 @@ def admin_car_add(request):
             
             for i, f in enumerate(files):
                 print(f"DEBUG: saving image → {f}")
-                CarImage.objects.create(car=car, image=f, position=max_position + i + 1)
+                # Resizing happens in the process_images worker
+                queue_car_image(car, f, max_position + i + 1)
 
             # Handle AJAX request (for auto-save during image upload)
             if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
@@ -226,7 +261,8 @@ def admin_car_edit(request, pk):
             
             for i, f in enumerate(files):
                 print(f"DEBUG: saving image → {f}")
-                CarImage.objects.create(car=car, image=f, position=max_position + i + 1)
+                # Resizing happens in the process_images worker
+                queue_car_image(car, f, max_position + i + 1)
 
             messages.success(request, "✅ Car updated successfully!")
             return redirect("admin_car_edit", pk=car.pk)
@@ -254,8 +290,7 @@ def ajax_delete_car_image(request, pk):
     if request.method == "POST" and request.headers.get("x-requested-with") == "XMLHttpRequest":
         img = get_object_or_404(CarImage, id=pk)
         car_id = img.car.id  # CarImage must have a ForeignKey to Car
-        if img.image and os.path.isfile(img.image.path):
-            os.remove(img.image.path)
+        # Deletes the file too, unless another car uses the same photo
         img.delete()
         remaining = CarImage.objects.filter(car_id=car_id).count()
         return JsonResponse({"success": True, "remaining": remaining})
@@ -289,6 +324,7 @@ def ajax_reorder_car_images(request):
             # Bulk update all positions at once
             if images_to_update:
                 CarImage.objects.bulk_update(images_to_update, ['position'])
+                catalog_changed({image.car_id for image in images_to_update}, rescore=False)
                 return JsonResponse({
                     "success": True, 
                     "message": f"Successfully reordered {len(images_to_update)} images"
@@ -354,22 +390,20 @@ def admin_car_delete(request, pk):
         return redirect('/admin/login/?next=' + request.path)
     car = get_object_or_404(Car, pk=pk)
     extra_images = CarImage.objects.filter(car=car)
+    # Deleting the rows deletes the files no other car uses
     for img in extra_images:
-        if img.image and os.path.isfile(img.image.path):
-            os.remove(img.image.path)
         img.delete()
-    if car.main_image and os.path.isfile(car.main_image.path):
-        os.remove(car.main_image.path)
     car.delete()
     messages.success(request, "🗑 Car and all its images deleted!")
     return redirect("admin_car_list")
 
+@catalog_conditional
 def ajax_load_models(request):
     if not request.user.is_authenticated or not request.user.is_staff:
         return JsonResponse({"error": "Authentication required"}, status=401)
     bid = request.GET.get('brand')
-    qs = CarModel.objects.filter(brand_id=bid).values('id','name')
-    return JsonResponse(list(qs), safe=False)
+    # Every model of the brand, from the cached brand -> models map
+    return JsonResponse(models_for_brand(bid, available=False), safe=False)
 
 
 # ✅ CAR REORDERING VIEW
@@ -382,7 +416,7 @@ def admin_car_reorder(request):
     
     return render(request, 'admin_custom/car_reorder.html', {
         'cars': cars,
-        'total_cars': cars.count(),
+        'total_cars': len(cars),  # evaluates the queryset the template then iterates
     })
 
 
@@ -415,6 +449,7 @@ def ajax_update_car_position(request):
         
         # Bulk update for performance
         Car.objects.bulk_update(cars_to_update, ['position'])
+        catalog_changed(car.pk for car in cars_to_update)
         
         return JsonResponse({
             "success": True, 
@@ -447,6 +482,7 @@ def ajax_bulk_position_tools(request):
             for i, car in enumerate(cars):
                 car.position = i
             Car.objects.bulk_update(cars, ['position'])
+            catalog_changed()
             
             return JsonResponse({
                 "success": True,
@@ -463,6 +499,7 @@ def ajax_bulk_position_tools(request):
             for car, position in zip(cars, positions):
                 car.position = position
             Car.objects.bulk_update(cars, ['position'])
+            catalog_changed()
             
             return JsonResponse({
                 "success": True,
@@ -480,7 +517,7 @@ def ajax_bulk_position_tools(request):
 
 # ✅ AJAX UPLOAD SINGLE IMAGE (Individual Processing)
 def ajax_upload_single_image(request):
-    """AJAX endpoint to upload and process a single image"""
+    """AJAX endpoint to upload a single image and queue its processing"""
     if not request.user.is_authenticated or not request.user.is_staff:
         return JsonResponse({"success": False, "error": "Authentication required"}, status=401)
     
@@ -502,18 +539,9 @@ def ajax_upload_single_image(request):
                 max_pos=Max('position')
             )['max_pos'] or 0
             
-            # Create CarImage with processing_status as 'pending'
-            car_image = CarImage.objects.create(
-                car=car,
-                image=image_file,
-                position=max_position + 1,
-                processing_status='pending'
-            )
-            
-            # Start background processing
-            thread = threading.Thread(target=process_image_in_background, args=(car_image.id,))
-            thread.daemon = True
-            thread.start()
+            # Stored as uploaded and queued; the process_images worker resizes it
+            # and builds its thumbnails, so the request returns right away
+            car_image = queue_car_image(car, image_file, max_position + 1)
             
             return JsonResponse({
                 "success": True,
@@ -521,7 +549,7 @@ def ajax_upload_single_image(request):
                 "image_url": car_image.image.url if car_image.image else None,
                 "position": car_image.position,
                 "processing_status": car_image.processing_status,
-                "message": "Image uploaded successfully and is being processed"
+                "message": "Image uploaded successfully and queued for processing"
             })
             
         except Exception as e:
@@ -530,35 +558,6 @@ def ajax_upload_single_image(request):
     return JsonResponse({"success": False, "error": "Invalid request method"}, status=405)
 
 
-def process_image_in_background(car_image_id):
-    """Background function to process image thumbnails and web versions"""
-    try:
-        car_image = CarImage.objects.get(id=car_image_id)
-        car_image.processing_status = 'processing'
-        car_image.save()
-        
-        # ImageKit will automatically generate the thumbnails and web versions
-        # when accessed for the first time. We just need to trigger generation.
-        # This forces the creation of thumbnail and web_display versions
-        if car_image.thumbnail:
-            car_image.thumbnail.url  # This triggers generation
-        if car_image.web_display:
-            car_image.web_display.url  # This triggers generation
-            
-        car_image.processing_status = 'completed'
-        car_image.save()
-        
-    except CarImage.DoesNotExist:
-        pass
-    except Exception as e:
-        try:
-            car_image = CarImage.objects.get(id=car_image_id)
-            car_image.processing_status = 'error'
-            car_image.save()
-        except:
-            pass
-
-
 # ✅ AJAX CHECK IMAGE PROCESSING STATUS
 def ajax_check_image_status(request, image_id):
     """Check the processing status of an uploaded image"""
@@ -620,7 +619,10 @@ def exclusive_car_management(request):
 
         elif action == 'remove_exclusive':
             try:
-                Car.objects.filter(is_exclusive=True).update(is_exclusive=False)
+                exclusive = Car.objects.filter(is_exclusive=True)
+                car_ids = list(exclusive.values_list('pk', flat=True))
+                exclusive.update(is_exclusive=False)
+                catalog_changed(car_ids, rescore=False)
                 messages.success(request, 'Ексклузивното возило е отстрането.')
             except Exception as e:
                 messages.error(request, f'Грешка: {str(e)}')
@@ -628,18 +630,14 @@ def exclusive_car_management(request):
         return redirect('exclusive_car_management')
 
     # Get current exclusive car
-    exclusive_car = Car.objects.filter(is_exclusive=True).first()
+    exclusive_car = Car.objects.filter(is_exclusive=True).select_related('brand', 'model_name').first()
 
     # Get all cars for selection
     search_query = request.GET.get('search', '')
     cars = Car.objects.select_related('brand', 'model_name').order_by('-created_at')
 
     if search_query:
-        cars = cars.filter(
-            Q(title__icontains=search_query) |
-            Q(brand__name__icontains=search_query) |
-            Q(model_name__name__icontains=search_query)
-        )
+        cars = search_cars(cars, search_query).order_by('-search_rank', '-created_at')
 
     # Paginate cars
     paginator = Paginator(cars, 20)
@@ -650,7 +648,7 @@ def exclusive_car_management(request):
         'exclusive_car': exclusive_car,
         'cars': page_obj,
         'search_query': search_query,
-        'total_cars': cars.count(),
+        'total_cars': paginator.count,
     }
 
     return render(request, 'admin_custom/exclusive_car_management.html', context)
@@ -157,6 +157,11 @@ USE_TZ = True
 DATA_UPLOAD_MAX_MEMORY_SIZE = 20 * 1024 * 1024   # 20 MB total request (images are compressed)
 FILE_UPLOAD_MAX_MEMORY_SIZE = 5 * 1024 * 1024    # 5 MB per file (before compression)
 DATA_UPLOAD_MAX_NUMBER_FIELDS = 10000            # Equipment checkboxes + form fields
+# Same handlers as Django's, also hashing each file for content-addressed storage (image_store.py)
+FILE_UPLOAD_HANDLERS = [
+    'dealership_app.image_store.HashingMemoryFileUploadHandler',
+    'dealership_app.image_store.HashingTemporaryFileUploadHandler',
+]
 
 # Static files (CSS, JavaScript, Images)
 # https://docs.djangoproject.com/en/5.1/howto/static-files/
@@ -167,6 +172,41 @@ STATICFILES_DIRS = [os.path.join(BASE_DIR, 'dealership_app', 'static')]
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Image versions (ImageKit specs) are built by the process_images worker when a
+# source image is saved and by `manage.py warm_images`; rendering only builds URLs.
+IMAGEKIT_DEFAULT_CACHEFILE_STRATEGY = 'dealership_app.image_specs.Pregenerated'
+
+# Sizes made on request through signed URLs (see dealership_app/image_resize.py), kept
+# on disk and trimmed least recently served first when they outgrow the limit.
+IMAGE_RESIZE_CACHE_DIR = os.path.join(BASE_DIR, 'tmp', 'resize_cache')
+IMAGE_RESIZE_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+# Shared by all workers so the catalog version (dealership_app/catalog_version.py)
+# and everything cached under it stay consistent across processes.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, 'tmp', 'django_cache'),
+    }
+}
+
+# Columnar catalog snapshot for the public vehicle listing (see dealership_app/catalog_snapshot.py).
+# Shared read-only between workers through mmap; rebuilt from Car/CarImage signals.
+CATALOG_SNAPSHOT_ENABLED = False
+CATALOG_SNAPSHOT_PATH = os.path.join(BASE_DIR, 'tmp', 'catalog.snapshot')
+
+# 'offset' keeps numbered pages; 'keyset' pages vehicle_list/admin_car_list by cursor
+# (?cursor= switches a single request to keyset either way).
+LISTING_PAGINATION = 'offset'
+
+# Full-page cache for anonymous visitors (see dealership_app/page_cache.py); 0 disables it.
+# Entries are keyed by the catalog version, so catalog writes invalidate them immediately.
+PAGE_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Embed the brand -> models map in the search forms; when False they fetch it once
+# from ajax/model-map/?v=<catalog version> instead (see dealership_app/model_map.py).
+MODEL_MAP_INLINE = True
+
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
@@ -43,6 +43,11 @@ urlpatterns = [
     
     # AJAX endpoints (no translation needed)
     path('ajax/models/', frontend_views.ajax_models, name='ajax_models'),
+    path('ajax/model-map/', frontend_views.ajax_model_map, name='ajax_model_map'),
+    path('ajax/vehicles/', frontend_views.ajax_vehicles, name='ajax_vehicles'),
+    path('ajax/typeahead/', frontend_views.ajax_typeahead, name='ajax_typeahead'),
+    path('feed/inventory/', frontend_views.inventory_feed, name='inventory_feed'),
+    path('img/<str:token>/', frontend_views.resized_image, name='resized_image'),
     path('ajax/delete-car-image/<int:pk>/', views.ajax_delete_car_image, name="ajax_delete_car_image"),
     path('ajax/reorder-car-images/', views.ajax_reorder_car_images, name="ajax_reorder_car_images"),
     path('ajax/add-equipment/', views.ajax_add_equipment, name="ajax_add_equipment"),